@@ -3,20 +3,45 @@
 # -----------------------------------------------------------------------------
 # 自然言語からAIによってSQL生成・座席マップ表示・利用グラフ表示・雑談応答を切り替え。
 # よくある質問ボタンや送信ボタン、Enterキー送信にも対応。
+# 質問ごとの処理時間の内訳（AI判定・社員名の照合・SQL 実行・描画）は core/tracing.py で計測し、
+# 結果の下に表示します。
+# 月次集計（SeatLogMonthly）は質問の処理のたびに core/rollup.py の定期更新を呼び、
+# 前回から ROLLUP_REFRESH_SECONDS 以上たっていればバックグラウンドで更新します。
 # =============================================================================
 
+import json
+import os
+import sys
+import tempfile
+
+from core import import_profile
+import_profile.start()  # DATASK_PROFILE_IMPORTS=1 のときだけ、以降の import 時間を計測
+
 import streamlit as st
 import pandas as pd
-from core.db import run_query, engine, load_table
-from core.openai_sql import generate_semantic_sql
-from visual.charts import get_monthly_usage_by_employee, draw_monthly_usage_chart
-from visual.seatmap import (
-    get_seat_labels,
-    get_used_labels,
-    get_used_label_name_dict,
-    draw_auto_seat_map,
-    draw_auto_seat_map_with_names,
-)
+from core.db import get_engine, check_db_connection
+from core.export import fetch_page, export_table_to_file
+from core.sql_guard import run_governed_query
+from core.openai_sql import generate_semantic_sql, fast_path_stats
+from core.nl_cache import get_nl_cache
+from core.sql_examples import get_sql_examples
+from core.name_index import get_name_index
+from core.schema import get_schema_hint, schema_hint_stats
+from core.llm_async import get_llm_gateway
+from core.result_cache import get_result_cache
+from core.metrics import DB_METRICS, db_origin, pool_stats
+from core.rollup import get_rollup_refresher, rollup_status
+from visual.charts import get_chart_cache, get_dept_usage, show_monthly_usage_chart
+from core.occupancy import get_occupancy_snapshot
+from core.analytics import BY, get_utilization_store
+from core.archive import get_archive
+from core.tracing import finish_trace, recent_traces, span, start_trace, summarize
+from core.ai_search import search_faq_from_query
+from visual.floor_layout import get_floor_layout
+from visual.seatmap import show_area_seatmap
+
+if import_profile.active():
+    print(import_profile.format_report(import_profile.stop()[:30]), file=sys.stderr)
 
 # ─────────────────────────────────────
 # UI 初期設定
@@ -63,65 +88,383 @@ show_sql = st.checkbox("生成されたSQLを表示")
 sql_container = st.empty()
 
 # ─────────────────────────────────────
-# メイン処理
+# 座席マップ（エリア・ページの切り替えはこの部分だけ再実行）
 # ─────────────────────────────────────
-if st.session_state.run and st.session_state.query.strip():
-    st.session_state.run = False
-    result = generate_semantic_sql(st.session_state.query)
+@st.fragment
+def seatmap_view(with_names: bool, area: str | None):
+    floor = get_floor_layout()
+    names = floor.area_names()
+    area = st.selectbox("エリア", names, index=names.index(area) if area in names else 0, key="seatmap_area")
+    pages = floor.areas[area].pages()
+    page = 0
+    if len(pages) > 1:
+        page = st.number_input(f"表示範囲（全 {len(pages)} 画面）", 1, len(pages), 1, key=f"seatmap_page_{area}") - 1
+
+    # 使用状況は全セッション共有のスナップショットから取得（DBアクセスなし）
+    snapshot = get_occupancy_snapshot()
+    used = snapshot.used_label_name_dict() if with_names else snapshot.used_labels()
+    show_area_seatmap(area, used, page)
+    st.caption(f"使用状況は {snapshot.age():.0f} 秒前の時点です。")
+
+# ─────────────────────────────────────
+# 利用率の分析（集計単位・期間の切り替えはこの部分だけ再実行）
+# ─────────────────────────────────────
+BY_LABELS = {"area": "エリア", "dept": "部署", "seat": "席"}
+GRAIN_LABELS = {"hour": "時間帯", "weekday": "曜日", "hour_weekday": "時間帯×曜日", "total": "期間合計"}
+
+def _percent_columns(df: pd.DataFrame) -> dict:
+    return {c: st.column_config.NumberColumn(str(c), format="%.0f%%") for c in df.columns}
+
+@st.fragment
+def utilization_view(by: str, grain: str, days: int):
+    by_col, grain_col, days_col = st.columns(3)
+    with by_col:
+        by = st.selectbox("集計単位", BY, index=BY.index(by), format_func=BY_LABELS.get, key="util_by")
+    with grain_col:
+        grain = st.selectbox("区分", list(GRAIN_LABELS), index=list(GRAIN_LABELS).index(grain),
+                             format_func=GRAIN_LABELS.get, key="util_grain")
+    with days_col:
+        days = st.select_slider("期間（日）", [7, 14, 28, 90, 180], value=days if days in (7, 14, 28, 90, 180) else 28,
+                                key="util_days")
+
+    store = get_utilization_store()
+    df = store.utilization(by, grain, days)
+    total = store.utilization("area", "total", days)
+    peak = store.peak_concurrency("all", "total", days)
+    never = store.never_used_seats(days)
+
+    c1, c2, c3 = st.columns(3)
+    c1.metric("全体の利用率", f"{total['OccupiedHours'].sum() / max(total['CapacityHours'].sum(), 1):.1%}")
+    if len(peak):
+        p = peak.iloc[0]
+        c2.metric("同時在席数のピーク", f"{p['Peak']} / {p['Seats']} 席")
+        c2.caption(f"{pd.Timestamp(p['PeakDay']):%Y-%m-%d} {p['PeakHour']}時台")
+    c3.metric("使われていない席", f"{len(never)} 席")
 
-    if result["type"] == "seatmap":
-        labels = get_seat_labels(engine)
-        if result.get("detail") == "with_names":
-            used_dict = get_used_label_name_dict(engine)
-            draw_auto_seat_map_with_names(labels, used_dict)
+    if grain == "total":
+        table = df.set_index("Key")[["OccupiedHours", "Utilization"]].sort_values("Utilization", ascending=False)
+        table["Utilization"] *= 100
+        st.dataframe(table, use_container_width=True, column_config={
+            "OccupiedHours": st.column_config.NumberColumn("在席時間", format="%.0f h"),
+            "Utilization": st.column_config.NumberColumn("利用率", format="%.1f%%"),
+        })
+    else:
+        if grain == "hour_weekday":
+            key = st.selectbox(BY_LABELS[by], sorted(df["Key"].unique()), key="util_key")
+            pivot = df[df["Key"] == key].pivot(index="Weekday", columns="Hour", values="Utilization")
+            pivot = pivot.reindex([w for w in df["Weekday"].unique()])
         else:
-            used = get_used_labels(engine)
-            draw_auto_seat_map(labels, used)
-        st.success("🪑 座席マップを表示しました。")
-        if show_sql:
-            with sql_container.expander("🔍 AIによる判定内容"):
-                st.code("-- AI判定: 座席マップ呼び出し", language="sql")
-
-    elif result["type"] == "sql":
-        try:
-            df = run_query(result["sql"])
-            st.dataframe(df, use_container_width=True)
+            column = "Hour" if grain == "hour" else "Weekday"
+            pivot = df.pivot(index="Key", columns=column, values="Utilization")
+            if grain == "weekday":
+                pivot = pivot[list(df["Weekday"].unique())]
+        pivot = pivot * 100
+        st.dataframe(pivot, use_container_width=True, column_config=_percent_columns(pivot))
+
+    if by != "seat":
+        peaks = store.peak_concurrency(by, "hour", days).pivot(index="Key", columns="Hour", values="Peak")
+        st.caption("時間帯ごとの同時在席数のピーク")
+        st.dataframe(peaks.fillna(0).astype(int), use_container_width=True)
+    if by == "dept":
+        # 月ごとの部署別の利用回数（月次集計＋集計後の SeatLog）
+        start_month = (pd.Timestamp.now() - pd.Timedelta(days=days)).strftime("%Y-%m")
+        with st.expander("部署別・月ごとの利用回数"):
+            monthly = get_dept_usage(get_engine(), start_month=start_month)
+            if len(monthly):
+                st.dataframe(monthly.pivot(index="Dept", columns="Month", values="UsageCount").fillna(0).astype(int),
+                             use_container_width=True)
+            else:
+                st.caption("データがありません。")
+    if len(never):
+        with st.expander(f"直近 {days} 日に使われていない席（{len(never)} 席）"):
+            st.dataframe(never[["Label", "Area"]], use_container_width=True, hide_index=True)
+
+# ─────────────────────────────────────
+# 処理時間の内訳（スパンの開始・終了を横棒で表示）
+# ─────────────────────────────────────
+def show_trace_waterfall(record: dict):
+    spans = [
+        {**s, "end_ms": s["start_ms"] + s["duration_ms"], "row": f"{s['span_id']:02d} {s['name']}",
+         "detail": ", ".join(f"{k}={v}" for k, v in s["attrs"].items())}
+        for s in record["spans"]
+    ]
+    with st.expander(f"⏱️ 処理時間の内訳（{record['duration_ms']:.0f} ms・リクエストID {record['trace_id']}）"):
+        st.vega_lite_chart({
+            "data": {"values": spans},
+            "mark": {"type": "bar", "tooltip": True},
+            "encoding": {
+                "y": {"field": "row", "type": "nominal", "sort": None, "title": None},
+                "x": {"field": "start_ms", "type": "quantitative", "title": "ms"},
+                "x2": {"field": "end_ms"},
+                "color": {"field": "name", "type": "nominal", "legend": None},
+                "tooltip": [{"field": "name"}, {"field": "duration_ms", "title": "ms"}, {"field": "detail"}],
+            },
+        }, use_container_width=True)
+        st.dataframe(
+            pd.DataFrame(spans)[["row", "start_ms", "duration_ms", "detail", "error"]].set_index("row"),
+            use_container_width=True,
+        )
+
+# ─────────────────────────────────────
+# メイン処理
+# ─────────────────────────────────────
+question_trace = None
+result = None
+# 途中で例外になっても（表示の失敗など）トレースは必ず終了し、エラーとして記録する
+try:
+    if st.session_state.run and st.session_state.query.strip():
+        st.session_state.run = False
+        # 表示（座席マップ・利用率の分析）まで含めて 1 件のトレースにまとめる
+        question_trace = start_trace("question", question=st.session_state.query)
+        get_rollup_refresher().maybe_refresh()  # 前回から一定時間たっていれば月次集計を更新（バックグラウンド）
+        result = generate_semantic_sql(st.session_state.query)
+        if result.get("fallback"):
+            st.caption("⚠️ AI に接続できなかったため、ローカル判定で応答しています（結果は保存しません）。")
+
+        if result["type"] == "seatmap":
+            # エリアの指定がなければ質問文に含まれるエリア名、それもなければ先頭のエリア
+            area = result.get("area") or get_floor_layout().find_area(st.session_state.query)
+            st.session_state.seatmap = {"with_names": result.get("detail") == "with_names", "area": area}
+            st.session_state.pop("seatmap_area", None)
+            st.success("🪑 座席マップを表示しました。")
             if show_sql:
-                with sql_container.expander("🔍 生成されたSQL"):
-                    st.code(result["sql"], language="sql")
-        except Exception as e:
-            st.error(f"SQL実行エラー: {e}")
-
-    elif result["type"] == "chart":
-        df = get_monthly_usage_by_employee(engine, result["emp_code"])
-        if df.empty:
-            st.warning("データがありません。")
-        else:
-            draw_monthly_usage_chart(df, name=result.get("name", ""))
-            st.success(f"📊 {result.get('name', '')}さんのグラフを表示しました。")
+                with sql_container.expander("🔍 AIによる判定内容"):
+                    st.code("-- AI判定: 座席マップ呼び出し", language="sql")
+
+        elif result["type"] == "sql":
+            try:
+                # 読み取り専用チェック・行数上限・タイムアウトを適用して実行
+                df = run_governed_query(result["sql"])
+                if len(df) > 0 and not result.get("fallback"):
+                    # 実行でき結果もある質問と SQL を、次の質問の例として記録（ローカル判定の代わりの応答は除く）
+                    get_sql_examples().record(
+                        st.session_state.query, result["sql"], get_engine().dialect.name,
+                        df.attrs.get("elapsed_ms"), len(df), get_schema_hint(),
+                    )
+                if result.get("reused"):
+                    st.caption("♻️ 以前に実行できた同じ質問の SQL を使いました（AI呼び出しなし）。")
+                with span("render", target="table", rows=len(df)):
+                    st.dataframe(df, use_container_width=True)
+                if df.attrs.get("truncated"):
+                    st.info(f"結果が多いため先頭 {len(df)} 件のみ表示しています。")
+                if df.attrs.get("source") == "archive":
+                    st.caption("🗄️ 過去の期間のため、アーカイブ（Parquet）から集計しました。")
+                if show_sql:
+                    with sql_container.expander("🔍 生成されたSQL"):
+                        st.code(df.attrs.get("sql", result["sql"]), language="sql")
+            except Exception as e:
+                if result.get("reused"):
+                    get_sql_examples().forget(st.session_state.query, get_engine().dialect.name)
+                st.error(f"SQL実行エラー: {e}")
 
-    elif result["type"] == "chat":
-        st.markdown("### 💬 AIの応答")
-        st.info(result["message"])
+        elif result["type"] == "chart":
+            # 描画済みのグラフをデータバージョンごとにキャッシュ（SeatLog が増えるまで再描画しない）
+            if show_monthly_usage_chart(get_engine(), result["emp_code"]):
+                st.success(f"📊 {result.get('name', '')}さんのグラフを表示しました。")
+            else:
+                st.warning("データがありません。")
 
-    elif result["type"] == "error":
-        st.warning(result["message"])
+        elif result["type"] == "utilization":
+            st.session_state.utilization = {k: result[k] for k in ("by", "grain", "days")}
+            for key in ("util_by", "util_grain", "util_days", "util_key"):
+                st.session_state.pop(key, None)
+            st.success("📈 利用率を集計しました。")
+            if show_sql:
+                with sql_container.expander("🔍 AIによる判定内容"):
+                    st.code(f"-- AI判定: 利用率の分析（{BY_LABELS[result['by']]}・{GRAIN_LABELS[result['grain']]}）", language="sql")
+
+        elif result["type"] == "chat":
+            st.markdown("### 💬 AIの応答")
+            st.info(result["message"])
+            # ローカルの FAQ インデックスから関連する質問を表示（ネットワークアクセスなし）
+            faqs = search_faq_from_query(st.session_state.query)
+            if faqs:
+                st.caption("関連するよくある質問：" + " / ".join(faqs))
+
+        elif result["type"] == "error":
+            st.warning(result["message"])
+
+        for view in ("seatmap", "utilization"):
+            if result["type"] != view:
+                st.session_state.pop(view, None)
+
+    # エリア・ページや集計単位を切り替えても表示し続ける
+    if "seatmap" in st.session_state:
+        seatmap_view(**st.session_state.seatmap)
+    if "utilization" in st.session_state:
+        with span("render", target="utilization"):
+            utilization_view(**st.session_state.utilization)
+except Exception as e:
+    if question_trace is not None:
+        question_trace.root.error = f"{type(e).__name__}: {e}"
+    raise
+finally:
+    if question_trace is not None:
+        st.session_state.last_trace = finish_trace(question_trace, result=result["type"] if result else None)
+if "last_trace" in st.session_state:
+    show_trace_waterfall(st.session_state.last_trace)
 
 # ─────────────────────────────────────
 # サイドバー：DB参照とCSV出力
 # ─────────────────────────────────────
 with st.sidebar.expander("🐳データベース参照", expanded=False):
     table = st.selectbox("表示するテーブルを選択", ["Seat", "Employee", "SeatLog"])
-    limit = st.slider("表示件数", 10, 5000, 100, 10)
-
-    if st.button("読み込み"):
-        df = load_table(table, limit)
-        st.dataframe(df, use_container_width=True)
-
-        csv = df.to_csv(index=False).encode("utf-8-sig")
-        st.download_button(
-            label=f"{table} をCSVで保存",
-            data=csv,
-            file_name=f"{table}.csv",
-            mime="text/csv"
+    page_size = st.slider("1ページの表示件数", 10, 500, 100, 10)
+
+    # キーセット・ページング：ページごとの開始キーを保持（表示中のページだけ取得）
+    browse = st.session_state.setdefault("browse", {"table": None, "size": None, "cursors": [None]})
+    if browse["table"] != table or browse["size"] != page_size:
+        browse.update(table=table, size=page_size, cursors=[None])
+
+    # 開いたときだけ取得する（起動直後の描画では DB に接続しない）
+    if st.checkbox("テーブルを表示"):
+        with db_origin("table_browse"):
+            page_df, last_key = fetch_page(table, browse["cursors"][-1], page_size)
+        prev_col, page_col, next_col = st.columns([1, 1, 1])
+        with prev_col:
+            if st.button("◀ 前へ", disabled=len(browse["cursors"]) == 1):
+                browse["cursors"].pop()
+                st.rerun()
+        with page_col:
+            st.caption(f"{len(browse['cursors'])} ページ目")
+        with next_col:
+            if st.button("次へ ▶", disabled=len(page_df) < page_size):
+                browse["cursors"].append(last_key)
+                st.rerun()
+        st.dataframe(page_df, use_container_width=True)
+
+    # エクスポート：チャンクごとに一時ファイルへ書き出し（件数が多くてもメモリは一定）
+    # 一時ファイルはエクスポートごとに作り（セッション間で共有しない）、保存時・作り直し時に消す
+    def discard_export():
+        export = st.session_state.pop("export_file", None)
+        if export is not None and os.path.exists(export[0]):
+            os.remove(export[0])
+
+    fmt = st.radio("保存形式", ["CSV", "Parquet"], horizontal=True)
+    max_rows = st.number_input("最大件数（0 = 全件）", min_value=0, value=0, step=10000)
+    if st.button("エクスポートを作成"):
+        ext = fmt.lower()
+        discard_export()
+        with tempfile.NamedTemporaryFile(prefix=f"datask_{table}_", suffix=f".{ext}", delete=False) as tmp:
+            path = tmp.name
+        try:
+            with st.spinner("エクスポート中..."):
+                size = export_table_to_file(table, path, fmt=ext, max_rows=int(max_rows) or None)
+        except Exception:
+            os.remove(path)
+            raise
+        st.session_state.export_file = (path, f"{table}.{ext}", size)
+
+    if "export_file" in st.session_state:
+        path, file_name, size = st.session_state.export_file
+        if os.path.exists(path):
+            # ファイルはクリックされたときに初めて読み込む（再実行のたびにメモリへ載せない）
+            # 読み込んだら一時ファイルを消す（on_click と別スレッドで動くため、削除はこちらで行う）
+            def read_export(path=path) -> bytes:
+                with open(path, "rb") as f:
+                    data = f.read()
+                os.remove(path)
+                return data
+
+            st.download_button(
+                label=f"{file_name} を保存（{size / 1024 / 1024:.1f} MB）",
+                data=read_export,
+                file_name=file_name,
+                mime="text/csv" if file_name.endswith(".csv") else "application/octet-stream",
+                on_click=lambda: st.session_state.pop("export_file", None),
+            )
+
+# ─────────────────────────────────────
+# サイドバー：AI判定・SQL結果キャッシュの統計
+# ─────────────────────────────────────
+with st.sidebar.expander("⚡AI判定の統計", expanded=False):
+    fp = fast_path_stats()
+    st.metric("高速判定ヒット率", f"{fp['fast_hit_ratio']:.0%}")
+    st.caption(
+        f"高速判定 平均 {fp['fast_avg_ms']:.2f} ms / LLM 平均 {fp['llm_avg_ms']:.0f} ms"
+        f"（推定 {fp['saved_seconds']:.1f} 秒短縮）"
+    )
+    sh = schema_hint_stats()
+    if sh["tokens"] is not None:
+        st.caption(f"スキーマヒント：推定 {sh['tokens']} トークン（{sh['source']}、{sh['tables']} テーブル）")
+    st.json(
+        {"fast_path": fp, "nl_cache": get_nl_cache().stats(), "sql_examples": get_sql_examples().stats(),
+         "llm_gateway": get_llm_gateway().stats(), "schema": sh, "name_index": get_name_index().stats()},
+        expanded=False,
+    )
+    rc = get_result_cache().stats()
+    st.caption(
+        f"SQL結果キャッシュ：ヒット率 {rc['hit_rate']:.0%}・{rc['entries']} 件"
+        f"（{rc['bytes'] / 1024:.0f} KB、節約 {rc['bytes_saved'] / 1024:.0f} KB）"
+    )
+    cc = get_chart_cache().stats()
+    st.caption(
+        f"グラフキャッシュ：ヒット率 {cc['hit_rate']:.0%}・{cc['entries']} 件"
+        f"（{cc['bytes'] / 1024:.0f} KB、描画 {cc['renders']} 回）"
+    )
+
+# ─────────────────────────────────────
+# サイドバー：DB接続・クエリ時間の内訳
+# ─────────────────────────────────────
+with st.sidebar.expander("📈DBメトリクス", expanded=False):
+    if st.button("接続を確認"):
+        ok, ms = check_db_connection()
+        if ok:
+            st.success(f"接続OK（{ms:.0f} ms）")
+    snap = DB_METRICS.snapshot(top=10)
+    # エンジンはクエリの初回実行まで作らないため、実行前はプールの状態を出さない
+    pool = pool_stats(get_engine()) if snap["origins"] else {}
+    if pool:
+        st.caption("接続プール：" + " / ".join(f"{k} {v}" for k, v in pool.items()))
+    if snap["origins"]:
+        st.dataframe(pd.DataFrame.from_dict(snap["origins"], orient="index"), use_container_width=True)
+        st.json(snap["top_statements"], expanded=False)
+    else:
+        st.caption("まだクエリは実行されていません。")
+    archive = get_archive()
+    if archive is not None:
+        ar = archive.stats()
+        st.caption(
+            f"アーカイブ：{ar['complete_through'] or '未作成'} まで・{ar['rows']:,} 行"
+            f"（{ar['bytes'] / 1024 / 1024:.1f} MB）、振り分け {ar['routed']} 件・DB へ戻し {ar['fallbacks']} 件"
         )
+    if snap["origins"]:
+        rs = rollup_status(get_engine())
+        refresher = get_rollup_refresher().stats()
+        if not rs["available"]:
+            st.caption("月次集計：未作成（python -m core.rollup init / backfill）")
+        else:
+            age = f"{rs['age_seconds'] / 60:.0f} 分前" if rs["age_seconds"] is not None else "未更新"
+            st.caption(
+                f"月次集計：最終更新 {age}（{'AIに案内' if rs['fresh'] else '古いためAIに案内しない'}）、"
+                f"アプリからの更新 {refresher['runs']} 回"
+                + (f"、前回の失敗 {refresher['last_error']}" if refresher["last_error"] else "")
+            )
+    json_col, prom_col = st.columns(2)
+    with json_col:
+        st.download_button("JSON", json.dumps({**snap, "pool": pool}, ensure_ascii=False, indent=2),
+                           file_name="datask_db_metrics.json", mime="application/json")
+    with prom_col:
+        st.download_button("Prometheus", DB_METRICS.to_prometheus(pool),
+                           file_name="datask_db_metrics.prom", mime="text/plain")
+
+# ─────────────────────────────────────
+# サイドバー：質問ごとの処理時間（直近のトレースの p50 / p95）
+# ─────────────────────────────────────
+with st.sidebar.expander("⏱️処理時間（直近の質問）", expanded=False):
+    traces = recent_traces()
+    if traces:
+        st.caption(f"直近 {len(traces)} 件（「*」は質問全体、ほかはスパンごと）")
+        st.dataframe(pd.DataFrame(summarize(traces)).set_index("span"), use_container_width=True)
+    else:
+        st.caption("まだ質問は処理されていません。")
+
+# ─────────────────────────────────────
+# サイドバー：起動時の import 時間（DATASK_PROFILE_IMPORTS=1 のときだけ）
+# ─────────────────────────────────────
+if import_profile.enabled():
+    with st.sidebar.expander("⏱️起動時の import 時間", expanded=False):
+        rows = import_profile.report()
+        st.caption(f"{len(rows)} モジュール（streamlit 本体は含まない）")
+        st.dataframe(pd.DataFrame(rows[:50]), use_container_width=True)
+
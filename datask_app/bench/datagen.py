@@ -0,0 +1,246 @@
+# =============================================================================
+# datagen.py - ベンチマーク用の合成データ生成（SQLite ファイルに出力）
+# -----------------------------------------------------------------------------
+# testdata/seatlog_dummy.py（20席・50人・5か月）より大きい、本番規模の
+# Seat / Employee / SeatLog を NumPy で生成し、SQLite ファイルに書き込みます。
+# テーブルはアプリと同じ定義（core/dialect.py）から作成します。
+# SeatLogMonthly（月次集計）とウォーターマークも作成するため、
+# 月別グラフ・部署別集計のクエリもアプリと同じ経路で計測できます。
+#
+# パラメータ：
+# - seats / employees / departments / days（今日で終わる期間）
+# - occupancy   : 平日の平均着席率（席数に対する割合、週末は weekend_factor 倍）
+# - skew        : 出社頻度の偏り（大きいほど一部の社員に集中、0 で一様）
+# - open_ratio  : 今日の行のうち未チェックアウト（CheckOut が NULL）の割合
+#
+# コマンド（datask_app ディレクトリで実行）：
+#   python -m bench.datagen bench.sqlite --seats 2000 --employees 5000 --days 730
+# =============================================================================
+
+import argparse
+import json
+import os
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+from core.dialect import create_app_engine, metadata
+
+SURNAMES = [
+    "佐藤", "鈴木", "高橋", "田中", "伊藤", "渡辺", "山本", "中村", "小林", "加藤",
+    "吉田", "山田", "佐々木", "山口", "松本", "井上", "木村", "林", "清水", "山崎",
+    "森", "池田", "橋本", "阿部", "石川", "山下", "中島", "石井", "小川", "前田",
+]
+GIVEN_NAMES = [
+    "太郎", "花子", "一郎", "美咲", "健太", "陽菜", "大輔", "結衣", "翔太", "さくら",
+    "拓也", "愛", "直樹", "彩", "亮", "真由美", "翼", "恵", "誠", "優子",
+]
+AREAS = ["東", "西", "南", "北"]
+SEAT_TYPES = ["フリー", "固定", "集中", "会議"]
+
+BENCH_META_DDL = "CREATE TABLE BenchMeta (Key TEXT PRIMARY KEY, Value TEXT)"
+
+# 本番DBと同じ検索を想定したインデックス（データ投入後に作成）
+INDEXES = [
+    "CREATE UNIQUE INDEX IX_Seat_Label ON Seat (Label)",
+    "CREATE INDEX IX_SeatLog_EmpCode ON SeatLog (EmpCode, CheckIn)",
+    "CREATE INDEX IX_SeatLog_Open ON SeatLog (CheckOut, SeatId)",
+    "CREATE INDEX IX_SeatLogMonthly_Month ON SeatLogMonthly (Month)",
+]
+
+
+def make_seats(n: int) -> pd.DataFrame:
+    ids = np.arange(1, n + 1)
+    return pd.DataFrame({
+        "SeatId": ids,
+        "Label": [f"{AREAS[(i - 1) * len(AREAS) // n]}-{i:05d}" for i in ids],
+        "Area": [AREAS[(i - 1) * len(AREAS) // n] for i in ids],
+        "SeatType": [SEAT_TYPES[i % len(SEAT_TYPES)] for i in ids],
+    })
+
+
+def make_employees(n: int, departments: int, rng: np.random.Generator) -> pd.DataFrame:
+    surname = rng.integers(0, len(SURNAMES), size=n)
+    given = rng.integers(0, len(GIVEN_NAMES), size=n)
+    return pd.DataFrame({
+        "EmpCode": [f"E{10000 + i}" for i in range(1, n + 1)],
+        "Name": [f"{SURNAMES[s]} {GIVEN_NAMES[g]}" for s, g in zip(surname, given)],
+        "Dept": [f"部署{d:02d}" for d in rng.integers(1, departments + 1, size=n)],
+    })
+
+
+def _as_text(values: np.ndarray) -> np.ndarray:
+    """datetime64 → SQLite に保存する 'YYYY-MM-DD HH:MM:SS' 文字列"""
+    return np.char.replace(np.datetime_as_string(values, unit="s"), "T", " ")
+
+
+def iter_seatlog_days(seats: int, employees: int, days: int, occupancy: float, skew: float,
+                      weekend_factor: float, open_ratio: float, rng: np.random.Generator,
+                      end: date | None = None):
+    """
+    1日ずつ SeatLog の DataFrame を返す（LogId は付けない）。
+    同じ日に同じ席・同じ社員が重複しないよう、席と社員は非復元抽出。
+    """
+    end = end or date.today()
+    weights = 1.0 / np.arange(1, employees + 1) ** skew  # 出社頻度（Zipf 風）
+    rng.shuffle(weights)
+    for offset in range(days - 1, -1, -1):
+        day = end - timedelta(days=offset)
+        rate = occupancy * (weekend_factor if day.weekday() >= 5 else 1.0)
+        n = min(rng.binomial(seats, min(rate, 1.0)), employees)
+        if n == 0:
+            continue
+        seat_ids = rng.choice(seats, size=n, replace=False) + 1
+        # 重み付き非復元抽出（Efraimidis-Spirakis）：キー u^(1/w) の上位 n 件
+        keys = rng.random(employees) ** (1.0 / weights)
+        emp_idx = np.argpartition(-keys, n - 1)[:n]
+        base = np.datetime64(day, "m")
+        check_in = base + (7 * 60 + rng.integers(0, 4 * 60, size=n)).astype("timedelta64[m]")
+        stay = np.clip(rng.normal(8 * 60, 90, size=n), 60, 12 * 60).astype("int64")
+        check_out = _as_text(check_in + stay.astype("timedelta64[m]")).astype(object)
+        if offset == 0 and open_ratio > 0:
+            check_out[rng.random(n) < open_ratio] = None
+        yield pd.DataFrame({
+            "SeatId": seat_ids,
+            "EmpCode": [f"E{10001 + i}" for i in emp_idx],
+            "CheckIn": _as_text(check_in),
+            "CheckOut": check_out,
+        })
+
+
+def _rollup(chunk: pd.DataFrame) -> pd.DataFrame:
+    """SeatLogMonthly と同じ粒度（EmpCode, Month, SeatId）の部分集計"""
+    check_in = pd.to_datetime(chunk["CheckIn"], format="%Y-%m-%d %H:%M:%S")
+    minutes = (pd.to_datetime(chunk["CheckOut"], format="%Y-%m-%d %H:%M:%S") - check_in).dt.total_seconds().div(60).fillna(0)
+    frame = pd.DataFrame({
+        "EmpCode": chunk["EmpCode"],
+        "Month": chunk["CheckIn"].str[:7],
+        "SeatId": chunk["SeatId"],
+        "UsageCount": 1,
+        "TotalMinutes": minutes.astype("int64"),
+    })
+    return frame.groupby(["EmpCode", "Month", "SeatId"], as_index=False).sum()
+
+
+def generate_dataset(path: str, seats: int = 2000, employees: int = 5000, departments: int = 20,
+                     days: int = 365, occupancy: float = 0.6, skew: float = 0.8,
+                     weekend_factor: float = 0.1, open_ratio: float = 0.7, seed: int = 0,
+                     progress=None) -> dict:
+    """
+    SQLite ファイルに合成データを書き込む（既存ファイルは作り直す）。
+
+    Returns:
+        生成パラメータと件数・所要時間（BenchMeta テーブルにも保存）
+    """
+    started = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_app_engine(f"sqlite:///{path}")
+    params = {"seats": seats, "employees": employees, "departments": departments, "days": days,
+              "occupancy": occupancy, "skew": skew, "weekend_factor": weekend_factor,
+              "open_ratio": open_ratio, "seed": seed}
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql("PRAGMA journal_mode=OFF")
+        conn.exec_driver_sql("PRAGMA synchronous=OFF")
+        metadata.create_all(conn)  # アプリと同じテーブル定義（core/dialect.py）
+        conn.exec_driver_sql(BENCH_META_DDL)
+        make_seats(seats).to_sql("Seat", conn, if_exists="append", index=False)
+        emp = make_employees(employees, departments, rng)
+        emp.to_sql("Employee", conn, if_exists="append", index=False)
+
+    depts = emp.set_index("EmpCode")["Dept"]
+    rollups = []
+    pending = []
+    rows = 0
+
+    def flush(conn):
+        # 1日ずつ書くと往復が多いため、まとめて書き込み・集計する
+        chunk = pd.concat(pending, ignore_index=True)
+        pending.clear()
+        # pandas.to_sql はパラメータ処理が重いため、sqlite3 の executemany を直接使う
+        conn.connection.driver_connection.executemany(
+            "INSERT INTO SeatLog (SeatId, EmpCode, CheckIn, CheckOut) VALUES (?, ?, ?, ?)",
+            chunk[["SeatId", "EmpCode", "CheckIn", "CheckOut"]].astype(object).itertuples(index=False, name=None),
+        )
+        rollups.append(_rollup(chunk))
+        if len(rollups) >= 8:
+            rollups[:] = [pd.concat(rollups).groupby(["EmpCode", "Month", "SeatId"], as_index=False).sum()]
+
+    with engine.begin() as conn:
+        for day in iter_seatlog_days(seats, employees, days, occupancy, skew,
+                                     weekend_factor, open_ratio, rng):
+            pending.append(day)
+            rows += len(day)
+            if sum(len(d) for d in pending) >= 200_000:
+                flush(conn)
+                if progress is not None:
+                    progress(rows)
+        if pending:
+            flush(conn)
+
+        monthly = pd.concat(rollups).groupby(["EmpCode", "Month", "SeatId"], as_index=False).sum()
+        monthly["Dept"] = monthly["EmpCode"].map(depts)
+        conn.connection.driver_connection.executemany(
+            "INSERT INTO SeatLogMonthly (EmpCode, Month, SeatId, Dept, UsageCount, TotalMinutes) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            monthly[["EmpCode", "Month", "SeatId", "Dept", "UsageCount", "TotalMinutes"]]
+            .astype(object).itertuples(index=False, name=None),
+        )
+        # 生成したデータはすべて集計済み。未チェックアウトの行は Pending に登録
+        conn.exec_driver_sql(
+            "INSERT INTO SeatLogRollupState (Id, LastLogId, UpdatedAt) "
+            "SELECT 1, COALESCE(MAX(LogId), 0), datetime('now') FROM SeatLog"
+        )
+        conn.exec_driver_sql("INSERT INTO SeatLogRollupPending SELECT LogId FROM SeatLog WHERE CheckOut IS NULL")
+        for ddl in INDEXES:
+            conn.exec_driver_sql(ddl)
+
+    meta = {**params, "seatlog_rows": rows, "monthly_rows": len(monthly),
+            "generated_at": date.today().isoformat(),
+            "seconds": round(time.perf_counter() - started, 2)}
+    with engine.begin() as conn:
+        conn.execute(sa.text("INSERT INTO BenchMeta (Key, Value) VALUES ('dataset', :v)"),
+                     {"v": json.dumps(meta)})
+        conn.exec_driver_sql("ANALYZE")
+    engine.dispose()
+    return meta
+
+
+def read_meta(engine) -> dict:
+    """generate_dataset() が保存した生成パラメータ"""
+    with engine.connect() as conn:
+        value = conn.execute(sa.text("SELECT Value FROM BenchMeta WHERE Key = 'dataset'")).scalar()
+    return json.loads(value) if value else {}
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="ベンチマーク用の合成データを SQLite に生成する")
+    parser.add_argument("path", help="出力する SQLite ファイル")
+    parser.add_argument("--seats", type=int, default=2000)
+    parser.add_argument("--employees", type=int, default=5000)
+    parser.add_argument("--departments", type=int, default=20)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--occupancy", type=float, default=0.6)
+    parser.add_argument("--skew", type=float, default=0.8)
+    parser.add_argument("--weekend-factor", type=float, default=0.1)
+    parser.add_argument("--open-ratio", type=float, default=0.7)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    meta = generate_dataset(
+        args.path, seats=args.seats, employees=args.employees, departments=args.departments,
+        days=args.days, occupancy=args.occupancy, skew=args.skew,
+        weekend_factor=args.weekend_factor, open_ratio=args.open_ratio, seed=args.seed,
+        progress=lambda n: print(f"\r  SeatLog {n:,} 行", end="", flush=True),
+    )
+    print()
+    print(json.dumps(meta, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
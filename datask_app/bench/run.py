@@ -0,0 +1,202 @@
+# =============================================================================
+# run.py - ベンチマークの実行とレポート出力
+# -----------------------------------------------------------------------------
+# bench/datagen.py で作った SQLite に対して（クエリは core/dialect.py により SQLite 用にコンパイル）
+# bench/scenarios.py のシナリオを計測し、p50 / p95 / p99 の遅延とメモリを
+# JSON / Markdown に出力します。前回の JSON を --baseline に渡すと差分も表示します。
+#
+# 計測方法：
+# - 各シナリオはウォームアップ後、iterations 回を perf_counter で計測
+# - メモリは別の1回を tracemalloc で計測（Python 上の確保量のピーク）、
+#   プロセス全体は最大 RSS（ru_maxrss）を記録
+# - SQL の実行時間は core/metrics.py で origin（seatmap / chart / llm_sql ...）別に集計
+#
+# コマンド（datask_app ディレクトリで実行）：
+#   python -m bench.datagen bench.sqlite --seats 2000 --employees 5000 --days 365
+#   python -m bench.run bench.sqlite --json report.json --markdown report.md
+#   python -m bench.run bench.sqlite --baseline old.json --scenario monthly_chart --scenario name_lookup
+# =============================================================================
+
+import argparse
+import gc
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from bench.datagen import read_meta
+from bench.scenarios import SCENARIOS, prepare
+from core.dialect import create_app_engine
+from core.metrics import DB_METRICS, instrument_engine
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _max_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_scenario(func, ctx, iterations: int, warmup: int = 2) -> dict:
+    """1つのシナリオを計測して結果を返す（遅延はミリ秒）"""
+    for _ in range(warmup):
+        func(ctx)
+
+    gc.collect()
+    tracemalloc.start()
+    func(ctx)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func(ctx)
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "iterations": iterations,
+        "p50_ms": round(_percentile(timings, 50), 3),
+        "p95_ms": round(_percentile(timings, 95), 3),
+        "p99_ms": round(_percentile(timings, 99), 3),
+        "mean_ms": round(statistics.fmean(timings), 3),
+        "max_ms": round(max(timings), 3),
+        "peak_alloc_kb": round(peak / 1024, 1),
+    }
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_bench(db_path: str, names: list[str] | None = None, iterations: int | None = None,
+              seed: int = 0, progress=None) -> dict:
+    """指定シナリオ（既定はすべて）を実行してレポートの dict を返す"""
+    engine = instrument_engine(create_app_engine(f"sqlite:///{db_path}"))
+    DB_METRICS.reset()
+    ctx = prepare(engine, seed=seed)
+    results = {}
+    for name in names or list(SCENARIOS):
+        func, default_iterations = SCENARIOS[name]
+        try:
+            results[name] = run_scenario(func, ctx, iterations or default_iterations)
+        except Exception as e:
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+        if progress is not None:
+            progress(name, results[name])
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "dataset": read_meta(engine),
+        "max_rss_mb": _max_rss_mb(),
+        "scenarios": results,
+        "db": DB_METRICS.snapshot(top=10),
+    }
+
+
+def compare(report: dict, baseline: dict, threshold: float = 0.2) -> dict:
+    """
+    p95 をベースラインと比べる。
+
+    Returns:
+        シナリオ名 → {"baseline_p95_ms", "p95_ms", "change", "regressed"}
+    """
+    diff = {}
+    for name, result in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name, {})
+        if "p95_ms" not in result or not base.get("p95_ms"):
+            continue
+        change = result["p95_ms"] / base["p95_ms"] - 1
+        diff[name] = {
+            "baseline_p95_ms": base["p95_ms"],
+            "p95_ms": result["p95_ms"],
+            "change": round(change, 3),
+            "regressed": change > threshold,
+        }
+    return diff
+
+
+def to_markdown(report: dict, diff: dict | None = None) -> str:
+    """レポートを Markdown の表にする"""
+    ds = report.get("dataset", {})
+    lines = [
+        f"# Datask benchmark ({report['created_at']}, rev {report.get('revision') or '-'})",
+        "",
+        f"- dataset: seats={ds.get('seats')}, employees={ds.get('employees')}, days={ds.get('days')}, "
+        f"SeatLog={ds.get('seatlog_rows', 0):,} rows",
+        f"- python {report['python']} / max RSS {report.get('max_rss_mb')} MB",
+        "",
+        "| scenario | n | p50 ms | p95 ms | p99 ms | peak alloc KB | vs baseline p95 |",
+        "|---|---:|---:|---:|---:|---:|---:|",
+    ]
+    for name, r in report["scenarios"].items():
+        if "error" in r:
+            lines.append(f"| {name} | - | - | - | - | - | error: {r['error']} |")
+            continue
+        d = (diff or {}).get(name)
+        vs = f"{d['change']:+.0%}{' ⚠' if d['regressed'] else ''}" if d else ""
+        lines.append(
+            f"| {name} | {r['iterations']} | {r['p50_ms']:.2f} | {r['p95_ms']:.2f} | {r['p99_ms']:.2f} "
+            f"| {r['peak_alloc_kb']:,.0f} | {vs} |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Datask のクエリ・処理のベンチマーク")
+    parser.add_argument("db", help="bench.datagen で作成した SQLite ファイル")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                        help="実行するシナリオ（複数指定可、既定はすべて）")
+    parser.add_argument("--iterations", type=int, help="反復回数（既定はシナリオごとの値）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="JSON レポートの出力先")
+    parser.add_argument("--markdown", help="Markdown レポートの出力先")
+    parser.add_argument("--baseline", help="比較する前回の JSON レポート")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p95 の悪化とみなす割合（既定 0.2）")
+    args = parser.parse_args(argv)
+
+    report = run_bench(
+        args.db, args.scenario, args.iterations, args.seed,
+        progress=lambda name, r: print(f"  {name}: {r.get('p95_ms', r.get('error'))}", file=sys.stderr),
+    )
+    diff = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            diff = compare(report, json.load(f), args.threshold)
+        report["baseline"] = {"path": args.baseline, "threshold": args.threshold, "diff": diff}
+
+    markdown = to_markdown(report, diff)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.markdown:
+        with open(args.markdown, "w", encoding="utf-8") as f:
+            f.write(markdown)
+    print(markdown)
+    return 1 if diff and any(d["regressed"] for d in diff.values()) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,200 @@
+# =============================================================================
+# scenarios.py - ベンチマークのシナリオ定義
+# -----------------------------------------------------------------------------
+# アプリが実際に呼ぶ関数・SQL をそのまま計測対象にします。
+# 各シナリオは BenchContext を受け取り、1回分の処理を実行する関数です。
+#
+# シナリオ：
+# - seatmap_query    : 座席マップ用クエリ（Seat 全件＋使用中の席と社員名）
+# - seatmap_snapshot : 共有スナップショット（core/occupancy.py）からの座席状態取得
+# - occupancy_poll   : スナップショットの差分ポーリング1回
+# - seatmap_render   : 座席マップの PNG 描画（最大エリアの1画面分、床の画像はキャッシュ済み）
+# - seatmap_svg      : 座席マップの SVG 生成（matplotlib なし）
+# - floor_query      : 5000 席のエリアを全ビューポートに分けて空間インデックスで検索
+# - monthly_chart    : 社員別の月別利用回数（visual/charts.py、月次集計＋差分）
+# - dept_usage       : 部署×月の利用集計
+# - utilization      : 利用率の差分更新（変わった日だけ再計算）＋時間帯×曜日・ピークの集計
+# - name_lookup      : 社員名の解決（core/name_index.py、姓・フルネーム・部分一致）
+# - name_index_build : 社員名インデックスの全件構築
+# - sample_sql       : 代表的な生成SQL（ガードで LIMIT を付与して実行）
+# =============================================================================
+
+import random
+from dataclasses import dataclass, field
+
+import pandas as pd
+import sqlalchemy as sa
+
+
+@dataclass
+class BenchContext:
+    """シナリオ間で共有する状態（エンジン・乱数・事前に読み込んだ値）"""
+    engine: sa.Engine
+    rng: random.Random
+    emp_codes: list[str] = field(default_factory=list)
+    names: list[str] = field(default_factory=list)
+    state: dict = field(default_factory=dict)
+
+
+# 生成SQLの代表例（ローカル判定の定型SQL＋SQLite 向けヒントでモデルが返す形）
+SAMPLE_SQL = [
+    "SELECT Dept, SUM(UsageCount) AS UsageCount, SUM(TotalMinutes) AS TotalMinutes "
+    "FROM SeatLogMonthly GROUP BY Dept ORDER BY UsageCount DESC",
+    "SELECT S.Label, COUNT(*) AS UsageCount FROM SeatLog L JOIN Seat S ON S.SeatId = L.SeatId "
+    "GROUP BY S.Label ORDER BY UsageCount DESC LIMIT 10",
+    "SELECT S.Label, COUNT(L.LogId) AS UsageCount FROM Seat S LEFT JOIN SeatLog L ON L.SeatId = S.SeatId "
+    "GROUP BY S.Label ORDER BY UsageCount ASC, S.Label",
+    "SELECT EmpCode, Name, Dept FROM Employee ORDER BY EmpCode LIMIT 100",
+    "SELECT strftime('%Y-%m', CheckIn) AS Month, COUNT(*) AS UsageCount FROM SeatLog "
+    "GROUP BY strftime('%Y-%m', CheckIn) ORDER BY Month",
+]
+
+
+def prepare(engine: sa.Engine, seed: int = 0) -> BenchContext:
+    """シナリオで使う社員コード・氏名を読み込む"""
+    with engine.connect() as conn:
+        rows = conn.execute(sa.text("SELECT EmpCode, Name FROM Employee")).fetchall()
+    return BenchContext(
+        engine=engine,
+        rng=random.Random(seed),
+        emp_codes=[r[0] for r in rows],
+        names=[r[1] for r in rows],
+    )
+
+
+def seatmap_query(ctx: BenchContext):
+    from visual.seatmap import get_seat_labels, get_used_label_name_dict
+
+    get_seat_labels(ctx.engine)
+    get_used_label_name_dict(ctx.engine)
+
+
+def _snapshot(ctx: BenchContext):
+    from core.occupancy import OccupancySnapshot
+
+    if "snapshot" not in ctx.state:
+        snapshot = OccupancySnapshot(ctx.engine, max_staleness=float("inf"))
+        snapshot.resync()
+        ctx.state["snapshot"] = snapshot
+    return ctx.state["snapshot"]
+
+
+def seatmap_snapshot(ctx: BenchContext):
+    snapshot = _snapshot(ctx)
+    snapshot.labels()
+    snapshot.used_label_name_dict()
+
+
+def occupancy_poll(ctx: BenchContext):
+    _snapshot(ctx).poll()
+
+
+def _area_page(ctx: BenchContext):
+    # 最も席の多いエリアの先頭ビューポート（アプリの座席マップと同じ単位）
+    from visual.floor_layout import load_floor_layout
+
+    if "floor" not in ctx.state:
+        ctx.state["floor"] = load_floor_layout(ctx.engine)
+    area = max(ctx.state["floor"].areas.values(), key=len)
+    return area.seat_layout(area.pages()[0])
+
+
+def seatmap_render(ctx: BenchContext):
+    from visual.seatmap import render_seatmap_png
+
+    render_seatmap_png(_area_page(ctx), _snapshot(ctx).used_label_name_dict())
+
+
+def seatmap_svg(ctx: BenchContext):
+    from visual.seatmap import render_seatmap_svg
+
+    render_seatmap_svg(_area_page(ctx), _snapshot(ctx).used_label_name_dict())
+
+
+def floor_query(ctx: BenchContext):
+    from visual.floor_layout import build_floor_layout, grid_positions
+
+    # 5000 席のエリアで、ビューポート内の席を空間インデックスで検索
+    if "big_area" not in ctx.state:
+        x, y = grid_positions(5000)
+        seats = pd.DataFrame({"SeatId": range(5000), "Label": [f"Z-{i:04d}" for i in range(5000)],
+                              "Area": "bench", "SeatType": "desk"})
+        positions = pd.DataFrame({"Label": seats["Label"], "X": x, "Y": y})
+        ctx.state["big_area"] = build_floor_layout(seats, positions).areas["bench"]
+    area = ctx.state["big_area"]
+    for view in area.pages():
+        area.in_view(view)
+
+
+def monthly_chart(ctx: BenchContext):
+    from visual.charts import get_monthly_usage_by_employee
+
+    get_monthly_usage_by_employee(ctx.engine, ctx.rng.choice(ctx.emp_codes))
+
+
+def dept_usage(ctx: BenchContext):
+    from visual.charts import get_dept_usage
+
+    get_dept_usage(ctx.engine)
+
+
+def _name_index(ctx: BenchContext):
+    from core.name_index import NameIndex
+
+    if "name_index" not in ctx.state:
+        index = NameIndex(ctx.engine, ttl=float("inf"))
+        index.refresh(force=True)
+        ctx.state["name_index"] = index
+    return ctx.state["name_index"]
+
+
+def utilization(ctx: BenchContext):
+    from core.analytics import UtilizationStore
+
+    if "utilization" not in ctx.state:
+        ctx.state["utilization"] = UtilizationStore(ctx.engine, max_staleness=0)
+    store = ctx.state["utilization"]
+    store.refresh()
+    store.utilization("area", "hour_weekday", 28)
+    store.peak_concurrency("dept", "hour", 28)
+
+
+def name_lookup(ctx: BenchContext):
+    index = _name_index(ctx)
+    name = ctx.rng.choice(ctx.names)
+    surname, _, given = name.partition(" ")
+    # 姓・フルネーム（空白なし）・名の一部 の3通りを引く
+    for query in (surname, name.replace(" ", ""), given[:1] or surname):
+        index.resolve(query)
+
+
+def name_index_build(ctx: BenchContext):
+    from core.name_index import NameIndex
+
+    NameIndex(ctx.engine, ttl=float("inf")).refresh(force=True)
+
+
+def sample_sql(ctx: BenchContext):
+    from core.metrics import db_origin
+    from core.sql_guard import govern_sql
+
+    sql = govern_sql(ctx.rng.choice(SAMPLE_SQL), max_rows=1000, dialect=ctx.engine.dialect.name)
+    with db_origin("llm_sql"), ctx.engine.connect() as conn:
+        conn.exec_driver_sql(sql).fetchmany(1001)
+
+
+# シナリオ名 → (関数, 既定の反復回数)
+SCENARIOS = {
+    "seatmap_query": (seatmap_query, 30),
+    "seatmap_snapshot": (seatmap_snapshot, 200),
+    "occupancy_poll": (occupancy_poll, 50),
+    "seatmap_render": (seatmap_render, 10),
+    "seatmap_svg": (seatmap_svg, 50),
+    "floor_query": (floor_query, 50),
+    "monthly_chart": (monthly_chart, 50),
+    "dept_usage": (dept_usage, 10),
+    "utilization": (utilization, 20),
+    "name_lookup": (name_lookup, 500),
+    "name_index_build": (name_index_build, 5),
+    "sample_sql": (sample_sql, 20),
+}
@@ -0,0 +1,127 @@
+# =============================================================================
+# soak_charts.py - グラフ描画のメモリ耐久テスト（RSS が増え続けないことの確認）
+# -----------------------------------------------------------------------------
+# bench/datagen.py で作った SQLite の月別利用データで、グラフを数千回描画し、
+# 一定回数ごとにプロセスの RSS（現在値）を記録します。
+# ウォームアップ後の増加が --max-growth-mb を超えたら終了コード 1 を返します。
+#
+# モード：
+#   figure : visual/charts.render_chart()（Figure を直接使い、描画後に解放）を毎回実行
+#   cached : visual/charts.monthly_usage_chart()（描画済みグラフのキャッシュ経由）
+#   pyplot : 変更前の描き方（plt.subplots して close しない）。比較用で、RSS が増え続ける
+#
+# コマンド（datask_app ディレクトリで実行）：
+#   python -m bench.soak_charts bench.sqlite --renders 5000
+#   python -m bench.soak_charts bench.sqlite --mode pyplot --renders 500
+# =============================================================================
+
+import argparse
+import gc
+import io
+import json
+import os
+import sys
+import time
+
+from bench.run import _max_rss_mb
+from core.dialect import create_app_engine
+from visual.charts import get_chart_cache, get_monthly_usage_by_employee, monthly_usage_chart, render_chart
+
+MODES = ("figure", "cached", "pyplot")
+
+
+def current_rss_mb() -> float | None:
+    """現在の RSS（Linux は /proc、それ以外は最大 RSS で代用）"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError, AttributeError):
+        return _max_rss_mb()
+
+
+def _render_pyplot(df):
+    # 変更前の draw_monthly_usage_chart と同じ（Figure を閉じない）
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(8, 4))
+    ax.bar(df["Month"], df["UsageCount"], color="salmon", edgecolor="black")
+    fig.savefig(io.BytesIO(), format="png")
+
+
+def soak(db_path: str, mode: str = "figure", renders: int = 5000, employees: int = 50,
+         sample_every: int = 250, warmup: int = 200, fmt: str = "png", progress=None) -> dict:
+    engine = create_app_engine(f"sqlite:///{db_path}")
+    with engine.connect() as conn:
+        emp_codes = [r[0] for r in conn.exec_driver_sql(
+            f"SELECT EmpCode FROM Employee ORDER BY EmpCode LIMIT {int(employees)}")]
+    frames = [get_monthly_usage_by_employee(engine, code) for code in emp_codes]
+    frames = [(code, df) for code, df in zip(emp_codes, frames) if not df.empty]
+    if not frames:
+        raise SystemExit("月別利用データがありません（bench.datagen で生成した DB を指定してください）")
+
+    samples = []
+    baseline = None
+    started = time.perf_counter()
+    for i in range(warmup + renders):
+        code, df = frames[i % len(frames)]
+        if mode == "figure":
+            render_chart("monthly_usage", df, fmt)
+        elif mode == "cached":
+            monthly_usage_chart(engine, code, fmt)
+        else:
+            _render_pyplot(df)
+        n = i + 1 - warmup
+        if n == 0:
+            gc.collect()
+            baseline = current_rss_mb()
+        elif n > 0 and (n % sample_every == 0 or n == renders):
+            gc.collect()
+            samples.append({"renders": n, "rss_mb": current_rss_mb(),
+                            "seconds": round(time.perf_counter() - started, 1)})
+            if progress is not None:
+                progress(samples[-1])
+
+    final = samples[-1]["rss_mb"] if samples else baseline
+    return {
+        "mode": mode,
+        "format": fmt,
+        "renders": renders,
+        "employees": len(frames),
+        "baseline_rss_mb": baseline,
+        "final_rss_mb": final,
+        "growth_mb": round(final - baseline, 1) if final is not None and baseline is not None else None,
+        "samples": samples,
+        "chart_cache": get_chart_cache().stats() if mode == "cached" else None,
+    }
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="グラフ描画を繰り返して RSS の増加を確認する")
+    parser.add_argument("db", help="bench.datagen で作成した SQLite ファイル")
+    parser.add_argument("--mode", choices=MODES, default="figure")
+    parser.add_argument("--renders", type=int, default=5000)
+    parser.add_argument("--employees", type=int, default=50, help="描画する社員数（グラフの種類）")
+    parser.add_argument("--sample-every", type=int, default=250)
+    parser.add_argument("--warmup", type=int, default=200, help="計測の基準にする前の描画回数")
+    parser.add_argument("--format", dest="fmt", choices=("png", "svg"), default="png")
+    parser.add_argument("--max-growth-mb", type=float, default=20.0)
+    parser.add_argument("--json", help="結果の JSON の出力先")
+    args = parser.parse_args(argv)
+
+    result = soak(
+        args.db, args.mode, args.renders, args.employees, args.sample_every, args.warmup, args.fmt,
+        progress=lambda s: print(f"  {s['renders']:>6} renders  {s['rss_mb']} MB  {s['seconds']} s", file=sys.stderr),
+    )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"{result['mode']}: {result['renders']} renders, RSS {result['baseline_rss_mb']} → "
+          f"{result['final_rss_mb']} MB（{result['growth_mb']:+} MB）")
+    return 1 if result["growth_mb"] is not None and result["growth_mb"] > args.max_growth_mb else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
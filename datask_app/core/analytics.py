@@ -0,0 +1,462 @@
+# =============================================================================
+# analytics.py - 座席・エリア・部署の利用率分析（SeatLog の在席区間から集計）
+# -----------------------------------------------------------------------------
+# SeatLog の CheckIn〜CheckOut を「在席区間」として扱い、次の値を求めます。
+# - 在席時間（分）と利用率：席 / エリア / 部署 × 時間帯（0〜23時）・曜日
+#   利用率 = 在席時間 ÷ 席数 × 対象時間（部署は全席数に対する割合）
+# - 同時在席数のピーク（全体 / エリア / 部署、時間帯ごと）
+# - 期間中に一度も使われなかった席
+#
+# 仕組み：
+# - 区間を日ごとに分割し、時間帯ごとの在席分数を NumPy でまとめて計算
+#   （区間 × 24 時間の重なりを一度に求める）
+# - 同時在席数は、開始 +1・終了 -1 のイベントを（日, グループ, 時刻）で並べて
+#   累積和をとるスイープライン（終了を先に数えるので、同時刻の入れ替わりは重複しない）
+# - 結果は日ごと（Day 列）に保持し、更新時は変わった日だけ計算し直す
+#   変わった日：前回以降に追加された行（LogId の差分、主キーのシーク）の区間にかかる日と、
+#   前回使用中だった行がかかる日（今日まで）。前回以降のチェックアウトは必ず後者に含まれるため、
+#   CheckOut の値では探さない（過去の時刻でのチェックアウトも漏れず、SeatLog を全件走査しない）
+# - 行の削除は差分では分からないため、resync_interval 秒ごとに全期間を計算し直す
+# - 対象はさかのぼって horizon_days 日分まで
+#
+# 設定（secrets / 環境変数）：
+#   ANALYTICS_DAYS           : 集計しておく日数（既定 180）
+#   ANALYTICS_MAX_STALENESS  : 差分更新までの最短間隔（秒、既定 60）
+#   ANALYTICS_RESYNC_SECONDS : 全期間の再計算の間隔（既定 86400）
+#
+# コマンド（datask_app ディレクトリで実行）：
+#   python -m core.analytics --by area --grain hour --days 28
+#   python -m core.analytics --by dept --grain weekday --peaks --never-used
+# =============================================================================
+
+import argparse
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+import streamlit as st
+from core.config import secret
+from core.dialect import db_now, employee, seat, seatlog
+from core.metrics import db_origin, record_rows
+
+BY = ("seat", "area", "dept")
+GRAINS = ("total", "hour", "weekday", "hour_weekday")
+WEEKDAYS = ("月", "火", "水", "木", "金", "土", "日")
+NO_AREA = "（エリア未設定）"
+NO_DEPT = "（部署未設定）"
+
+FRAME_COLUMNS = (
+    ["Day", "SeatId", "Dept", "Hour", "Minutes"],
+    ["Day", "Key", "Hour", "Peak", "Scope"],
+    ["Day", "SeatId"],
+)
+
+EDGES = np.arange(25) * 60.0  # 時間帯の境目（その日の 0:00 からの分）
+
+SEATS_QUERY = sa.select(seat.c.SeatId, seat.c.Label, seat.c.Area).order_by(seat.c.Label)
+
+# 区間 [lo, hi) にかかる SeatLog の行（CheckOut が NULL の行は使用中）
+INTERVALS_QUERY = (
+    sa.select(seatlog.c.SeatId, employee.c.Dept, seatlog.c.CheckIn, seatlog.c.CheckOut)
+    .select_from(seatlog.outerjoin(employee, employee.c.EmpCode == seatlog.c.EmpCode))
+    .where(
+        seatlog.c.CheckIn < sa.bindparam("hi"),
+        sa.or_(seatlog.c.CheckOut > sa.bindparam("lo"), seatlog.c.CheckOut.is_(None)),
+    )
+)
+
+CHANGED_QUERY = sa.select(seatlog.c.LogId, seatlog.c.CheckIn, seatlog.c.CheckOut).where(
+    seatlog.c.LogId > sa.bindparam("max_id")
+)
+
+WATERMARK_QUERY = sa.select(sa.func.max(seatlog.c.LogId), sa.func.min(seatlog.c.CheckIn), db_now())
+
+OPEN_FROM_QUERY = sa.select(sa.func.min(seatlog.c.CheckIn)).where(seatlog.c.CheckOut.is_(None))
+
+
+# -------------------------------
+# 区間の計算（NumPy）
+# -------------------------------
+def split_by_day(start, end) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    在席区間 [start, end) を日ごとに分割する。
+
+    Returns:
+        (元の行番号, 日, その日の開始分, その日の終了分)。分は 0:00 からの経過分（0〜1440）
+    """
+    s = np.asarray(start, dtype="datetime64[s]")
+    e = np.maximum(np.asarray(end, dtype="datetime64[s]"), s)
+    first = s.astype("datetime64[D]")
+    # 終了がちょうど 0:00 の区間は前日までとする（長さ 0 の区間はその日だけ）
+    last = np.where(e > s, (e - np.timedelta64(1, "s")).astype("datetime64[D]"), first)
+    n = (last - first).astype(np.int64) + 1
+    row = np.repeat(np.arange(len(s)), n)
+    offset = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    day = first[row] + offset.astype("timedelta64[D]")
+    day_start = day.astype("datetime64[s]")
+    lo = (np.maximum(s[row], day_start) - day_start).astype(np.int64) / 60
+    hi = (np.minimum(e[row], day_start + np.timedelta64(1, "D")) - day_start).astype(np.int64) / 60
+    return row, day, lo, hi
+
+
+def hour_minutes(lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """区間ごとの時間帯別の在席分数（区間数 × 24）"""
+    return np.clip(np.minimum(hi[:, None], EDGES[1:]) - np.maximum(lo[:, None], EDGES[:-1]), 0, None)
+
+
+def hourly_peaks(day: np.ndarray, key: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> pd.DataFrame:
+    """
+    (日, key) ごと・時間帯ごとの同時在席数の最大値（スイープライン）。
+    区間は同じ日のものに分割済みで、lo / hi はその日の経過分。
+    """
+    if len(lo) == 0:
+        return pd.DataFrame({"Day": pd.Series(dtype="datetime64[s]"), "Key": [], "Hour": [], "Peak": []})
+    codes, keys = pd.factorize(key)
+    n = len(lo)
+    ev_day = np.concatenate([day, day])
+    ev_key = np.concatenate([codes, codes])
+    t = np.concatenate([lo, hi])
+    delta = np.concatenate([np.ones(n, np.int64), -np.ones(n, np.int64)])
+    # 同時刻は終了（-1）を先に：(日, key) の中では必ず +1 と -1 が同数なので、
+    # 全体の累積和がそのままグループ内の在席数になる
+    order = np.lexsort((delta, t, ev_key, ev_day))
+    level = np.cumsum(delta[order])
+    starts = delta[order] > 0
+    events = pd.DataFrame({
+        "Day": ev_day[order][starts],
+        "Key": ev_key[order][starts],
+        "Hour": (t[order][starts] // 60).astype(np.int64),
+        "Peak": level[starts],
+    })
+    # 時間帯の開始時点ですでに在席している数（その時間帯にイベントがなくても数える）
+    piece, hour = np.nonzero((lo[:, None] <= EDGES[:-1]) & (hi[:, None] > EDGES[:-1]))
+    at_start = (
+        pd.DataFrame({"Day": day[piece], "Key": codes[piece], "Hour": hour})
+        .groupby(["Day", "Key", "Hour"]).size().rename("Peak").reset_index()
+    )
+    peaks = pd.concat([events, at_start]).groupby(["Day", "Key", "Hour"], as_index=False)["Peak"].max()
+    peaks["Key"] = keys[peaks["Key"].to_numpy()]
+    return peaks
+
+
+# -------------------------------
+# 日ごとの集計結果の保持と差分更新
+# -------------------------------
+def _as_datetime(value) -> datetime | None:
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def _runs(days: set[date]) -> list[tuple[date, date]]:
+    """日付の集合を連続した範囲 [開始, 終了] のリストにする"""
+    runs = []
+    for d in sorted(days):
+        if runs and d == runs[-1][1] + timedelta(days=1):
+            runs[-1] = (runs[-1][0], d)
+        else:
+            runs.append((d, d))
+    return runs
+
+
+class UtilizationStore:
+    """日ごとの在席分数・同時在席数のピーク・使われた席を保持し、変わった日だけ計算し直す"""
+
+    def __init__(self, engine, horizon_days: int = 180, max_staleness: float = 60,
+                 resync_interval: float = 86400):
+        self.engine = engine
+        self.horizon_days = horizon_days
+        self.max_staleness = max_staleness
+        self.resync_interval = resync_interval
+        self._lock = threading.RLock()
+        self.seats = pd.DataFrame(columns=["SeatId", "Label", "Area"])
+        # 在席分数：Day, SeatId, Dept, Hour, Minutes
+        # ピーク　：Day, Key, Hour, Peak, Scope（all / area / dept）
+        # 使われた席：Day, SeatId（長さ 0 の区間も含む）
+        self.minutes, self.peaks, self.used = (pd.DataFrame(columns=c) for c in FRAME_COLUMNS)
+        self.first_day: date | None = None
+        self.today: date | None = None
+        self._max_id = 0
+        self._open_from: date | None = None
+        self._now: datetime | None = None
+        self._refreshed_at = 0.0
+        self._resynced_at = 0.0
+        self.days_computed = 0
+        self.rows_fetched = 0
+
+    # ---------------------------------
+    # 更新
+    # ---------------------------------
+    def refresh(self, force: bool = False) -> dict:
+        """
+        変わった日だけ計算し直す（初回と resync_interval ごとは全期間）。
+
+        Returns:
+            {"mode": "full" / "incremental" / "skip", "days": 計算し直した日数}
+        """
+        with self._lock:
+            if not force and self._refreshed_at and time.time() - self._refreshed_at < self.max_staleness:
+                return {"mode": "skip", "days": 0}
+            full = not self._resynced_at or time.time() - self._resynced_at >= self.resync_interval
+            with db_origin("analytics"), self.engine.connect() as conn:
+                max_id, min_in, now = conn.execute(WATERMARK_QUERY).one()
+                now = _as_datetime(now) or datetime.now()
+                open_from = _as_datetime(conn.execute(OPEN_FROM_QUERY).scalar())
+                today = now.date()
+                horizon = today - timedelta(days=self.horizon_days - 1)
+                if full:
+                    seats = pd.read_sql(SEATS_QUERY, conn)
+                    seats["Area"] = seats["Area"].fillna(NO_AREA)
+                    first = max(horizon, _as_datetime(min_in).date()) if min_in is not None else today
+                    dirty = {first + timedelta(days=i) for i in range((today - first).days + 1)}
+                else:
+                    seats = self.seats
+                    dirty = self._changed_days(conn, today)
+                dirty = {d for d in dirty if horizon <= d <= today}
+                frames = [self._compute(conn, lo, hi, now, seats) for lo, hi in _runs(dirty)]
+            self._replace(dirty, frames, horizon, full)
+            self.seats = seats
+            self.today = today
+            if full:
+                self.first_day = min(dirty) if dirty else today
+            self._max_id = max_id or 0
+            self._open_from = open_from.date() if open_from is not None else None
+            self._now = now
+            self._refreshed_at = time.time()
+            if full:
+                self._resynced_at = self._refreshed_at
+            self.days_computed += len(dirty)
+            return {"mode": "full" if full else "incremental", "days": len(dirty)}
+
+    def _changed_days(self, conn, today: date) -> set[date]:
+        """前回以降に変わった（または使用中の行がかかっている）日"""
+        days = {today}
+        # 前回「今」まで在席として数えた使用中の行は、チェックアウトの有無に関わらず伸びている
+        if self._open_from is not None:
+            days |= {self._open_from + timedelta(days=i) for i in range((today - self._open_from).days + 1)}
+        rows = conn.execute(CHANGED_QUERY, {"max_id": self._max_id}).fetchall()
+        record_rows(len(rows))
+        self.rows_fetched += len(rows)
+        for _, check_in, check_out in rows:
+            first = _as_datetime(check_in).date()
+            last = (_as_datetime(check_out) or datetime.combine(today, datetime.min.time())).date()
+            days |= {first + timedelta(days=i) for i in range((last - first).days + 1)}
+        return days
+
+    def _compute(self, conn, first: date, last: date, now: datetime, seats: pd.DataFrame) -> tuple:
+        """first〜last 日の在席分数・ピーク・使われた席を計算する"""
+        lo = datetime.combine(first, datetime.min.time())
+        hi = datetime.combine(last + timedelta(days=1), datetime.min.time())
+        logs = pd.read_sql(INTERVALS_QUERY, conn, params={"lo": lo, "hi": hi})
+        record_rows(len(logs))
+        self.rows_fetched += len(logs)
+
+        check_in = pd.to_datetime(logs["CheckIn"]).to_numpy(dtype="datetime64[s]")
+        # 使用中の行は現在時刻まで、未来のチェックイン（予約など）は除く
+        check_out = pd.to_datetime(logs["CheckOut"]).fillna(pd.Timestamp(now)).to_numpy(dtype="datetime64[s]")
+        keep = check_in <= np.datetime64(now, "s")
+        row, day, start, end = split_by_day(check_in[keep], check_out[keep])
+        inside = (day >= np.datetime64(first)) & (day <= np.datetime64(last))
+        row, day, start, end = row[inside], day[inside], start[inside], end[inside]
+
+        seat_ids = logs["SeatId"].to_numpy()[keep][row]
+        depts = logs["Dept"].fillna(NO_DEPT).to_numpy(dtype=object)[keep][row]
+        area_of = dict(zip(seats["SeatId"], seats["Area"]))
+        areas = np.array([area_of.get(s, NO_AREA) for s in seat_ids], dtype=object)
+
+        per_hour = hour_minutes(start, end)
+        piece, hour = np.nonzero(per_hour)
+        minutes = (
+            pd.DataFrame({
+                "Day": day[piece], "SeatId": seat_ids[piece], "Dept": depts[piece],
+                "Hour": hour.astype(np.int8), "Minutes": per_hour[piece, hour],
+            })
+            .groupby(["Day", "SeatId", "Dept", "Hour"], as_index=False)["Minutes"].sum()
+        )
+        peaks = pd.concat([
+            hourly_peaks(day, np.full(len(day), "全体", dtype=object), start, end).assign(Scope="all"),
+            hourly_peaks(day, areas, start, end).assign(Scope="area"),
+            hourly_peaks(day, depts, start, end).assign(Scope="dept"),
+        ], ignore_index=True)
+        used = pd.DataFrame({"Day": day, "SeatId": seat_ids}).drop_duplicates()
+        return minutes, peaks, used
+
+    def _replace(self, days: set[date], frames: list[tuple], horizon: date, full: bool):
+        """計算し直した日の結果を差し替え、horizon より古い日を捨てる"""
+        parts = list(zip(*frames)) if frames else [[], [], []]
+        current = (self.minutes, self.peaks, self.used)
+        drop = np.array(sorted(days), dtype="datetime64[D]")
+        merged = []
+        for old, new, columns in zip(current, parts, FRAME_COLUMNS):
+            keep = [] if full or old.empty else [
+                old[~old["Day"].isin(drop) & (old["Day"] >= np.datetime64(horizon))]
+            ]
+            frames = [f for f in keep + list(new) if len(f)]
+            merged.append(pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns))
+        self.minutes, self.peaks, self.used = merged
+
+    def ensure_fresh(self):
+        self.refresh()
+
+    # ---------------------------------
+    # 参照
+    # ---------------------------------
+    def _days(self, days: int, end: date | None = None) -> tuple[date, date, pd.DatetimeIndex]:
+        """直近 days 日（データのある最初の日より前は含めない）"""
+        end = end or self.today
+        start = max(end - timedelta(days=days - 1), self.first_day or end)
+        return start, end, pd.date_range(start, end, freq="D")
+
+    def _slice(self, frame: pd.DataFrame, start: date, end: date) -> pd.DataFrame:
+        if frame.empty:
+            return frame
+        return frame[(frame["Day"] >= np.datetime64(start)) & (frame["Day"] <= np.datetime64(end))]
+
+    def utilization(self, by: str = "area", grain: str = "hour", days: int = 28) -> pd.DataFrame:
+        """
+        直近 days 日の在席時間と利用率。
+
+        Args:
+            by: seat（席）/ area（エリア）/ dept（部署）
+            grain: total（合計）/ hour（時間帯）/ weekday（曜日）/ hour_weekday（時間帯×曜日）
+
+        Returns:
+            Key, [Hour], [Weekday], OccupiedHours, CapacityHours, Utilization の DataFrame
+            （在席のなかった組み合わせも 0 として含む）
+        """
+        if by not in BY or grain not in GRAINS:
+            raise ValueError(f"by は {BY}、grain は {GRAINS} のいずれかです")
+        self.ensure_fresh()
+        with self._lock:
+            start, end, calendar = self._days(days)
+            m = self._slice(self.minutes, start, end).copy()
+            seats = self.seats
+        n_seats = max(len(seats), 1)
+
+        if by == "seat":
+            m["Key"] = m["SeatId"].map(dict(zip(seats["SeatId"], seats["Label"])))
+            keys = list(seats["Label"])
+            capacity = pd.Series(1, index=keys)
+        elif by == "area":
+            m["Key"] = m["SeatId"].map(dict(zip(seats["SeatId"], seats["Area"]))).fillna(NO_AREA)
+            capacity = seats.groupby("Area").size()
+            keys = list(capacity.index)
+        else:
+            m["Key"] = m["Dept"]
+            keys = sorted(m["Key"].dropna().unique())
+            capacity = pd.Series(n_seats, index=keys)
+
+        cols = {"total": [], "hour": ["Hour"], "weekday": ["Weekday"], "hour_weekday": ["Weekday", "Hour"]}[grain]
+        m["Weekday"] = pd.DatetimeIndex(m["Day"]).dayofweek if len(m) else []
+        occupied = m.groupby(["Key"] + cols)["Minutes"].sum() if len(m) else pd.Series(dtype=float)
+
+        # 集計の単位ごとの対象時間（分）：日数 × （時間帯なら 60、それ以外は 1440）
+        weekday_days = pd.Series(calendar.dayofweek).value_counts().reindex(range(7), fill_value=0)
+        levels = {"Hour": range(24), "Weekday": range(7)}
+        grid = pd.MultiIndex.from_product([keys] + [levels[c] for c in cols], names=["Key"] + cols)
+        result = pd.DataFrame(index=grid).reset_index()
+        per_cell = 60 if "Hour" in cols else 1440
+        day_count = result["Weekday"].map(weekday_days) if "Weekday" in cols else len(calendar)
+        result["OccupiedHours"] = (
+            occupied.reindex(grid, fill_value=0).to_numpy() / 60 if len(grid) else []
+        )
+        result["CapacityHours"] = result["Key"].map(capacity).to_numpy() * day_count * per_cell / 60
+        result["Utilization"] = (result["OccupiedHours"] / result["CapacityHours"]).where(result["CapacityHours"] > 0, 0.0)
+        if "Weekday" in cols:
+            result["Weekday"] = result["Weekday"].map(dict(enumerate(WEEKDAYS)))
+        return result
+
+    def peak_concurrency(self, by: str = "all", grain: str = "total", days: int = 28) -> pd.DataFrame:
+        """
+        直近 days 日の同時在席数の最大値。
+
+        Args:
+            by: all（全体）/ area（エリア）/ dept（部署）
+            grain: total（期間全体、発生日時つき）/ hour（時間帯）/ weekday（曜日）
+        """
+        self.ensure_fresh()
+        with self._lock:
+            start, end, _ = self._days(days)
+            p = self._slice(self.peaks, start, end)
+            seats = self.seats
+        p = p[p["Scope"] == by]
+        if grain == "total":
+            top = p.sort_values(["Peak", "Day", "Hour"], ascending=[False, True, True]).drop_duplicates("Key")
+            result = top[["Key", "Peak", "Day", "Hour"]].rename(columns={"Day": "PeakDay", "Hour": "PeakHour"})
+        elif grain == "hour":
+            result = p.groupby(["Key", "Hour"], as_index=False)["Peak"].max()
+        elif grain == "weekday":
+            p = p.assign(Weekday=pd.DatetimeIndex(p["Day"]).dayofweek if len(p) else [])
+            result = p.groupby(["Key", "Weekday"], as_index=False)["Peak"].max()
+            result["Weekday"] = result["Weekday"].map(dict(enumerate(WEEKDAYS)))
+        else:
+            raise ValueError(f"grain は total / hour / weekday のいずれかです: {grain}")
+        if by in ("all", "area"):
+            seat_count = seats.groupby("Area").size() if by == "area" else pd.Series({"全体": len(seats)})
+            result = result.assign(Seats=result["Key"].map(seat_count))
+        return result.reset_index(drop=True)
+
+    def never_used_seats(self, days: int = 28) -> pd.DataFrame:
+        """直近 days 日に一度も使われなかった席（SeatId, Label, Area）"""
+        self.ensure_fresh()
+        with self._lock:
+            start, end, _ = self._days(days)
+            used = self._slice(self.used, start, end)
+            seats = self.seats
+        used_ids = set(used["SeatId"]) if len(used) else set()
+        return seats[~seats["SeatId"].isin(used_ids)].reset_index(drop=True)
+
+    def stats(self) -> dict:
+        return {
+            "first_day": str(self.first_day) if self.first_day else None,
+            "today": str(self.today) if self.today else None,
+            "minute_rows": len(self.minutes),
+            "peak_rows": len(self.peaks),
+            "days_computed": self.days_computed,
+            "rows_fetched": self.rows_fetched,
+            "age_seconds": round(time.time() - self._refreshed_at, 1) if self._refreshed_at else None,
+        }
+
+
+@st.cache_resource
+def get_utilization_store() -> UtilizationStore:
+    """全セッションで共有する集計結果"""
+    from core.db import get_engine  # core.db は初回利用時まで読み込まない
+
+    return UtilizationStore(
+        get_engine(),
+        horizon_days=int(secret("ANALYTICS_DAYS", "180")),
+        max_staleness=float(secret("ANALYTICS_MAX_STALENESS", "60")),
+        resync_interval=float(secret("ANALYTICS_RESYNC_SECONDS", "86400")),
+    )
+
+
+def main(argv: list[str] | None = None):
+    from core.db import build_engine
+
+    parser = argparse.ArgumentParser(description="座席・エリア・部署の利用率を集計して表示")
+    parser.add_argument("--by", choices=BY, default="area")
+    parser.add_argument("--grain", choices=GRAINS, default="total")
+    parser.add_argument("--days", type=int, default=28)
+    parser.add_argument("--peaks", action="store_true", help="同時在席数のピークも表示")
+    parser.add_argument("--never-used", action="store_true", help="使われなかった席も表示")
+    args = parser.parse_args(argv)
+
+    store = UtilizationStore(build_engine(), horizon_days=max(args.days, 1))
+    started = time.perf_counter()
+    store.refresh()
+    print(f"集計：{store.stats()['days_computed']} 日分（{time.perf_counter() - started:.2f} 秒）")
+    with pd.option_context("display.max_rows", 200, "display.width", 160):
+        print(store.utilization(args.by, args.grain, args.days).to_string(index=False))
+        if args.peaks:
+            print(store.peak_concurrency("area" if args.by == "area" else "dept" if args.by == "dept" else "all",
+                                         days=args.days).to_string(index=False))
+        if args.never_used:
+            print(store.never_used_seats(args.days).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,550 @@
+# =============================================================================
+# archive.py - SeatLog の月別 Parquet アーカイブと過去データのクエリ経路
+# -----------------------------------------------------------------------------
+# 締まった月（月末から ARCHIVE_GRACE_DAYS 日以上たった月）の、チェックアウト済みの
+# SeatLog を CheckIn の年月ごとに Parquet へ書き出し、過去の期間だけを対象にする
+# クエリを本番DBではなくアーカイブ（DuckDB）で実行します。
+#
+# 保存形式（DATASK_ARCHIVE_DIR 以下）：
+#   manifest.json                              : 月ごとの件数・LogId の範囲・ファイル一覧
+#   SeatLog/month=2025-04/part-00001.parquet   : 1回の書き出しで1ファイル（zstd 圧縮）
+# - 差分の書き出し：月ごとに書き出し済みの最大 LogId より大きい行だけを追加のファイルにする
+#   書き出し時にまだ使用中（CheckOut が NULL）だった行は manifest に残し、
+#   チェックアウトされた時点で次の書き出しに含める
+# - manifest は一時ファイルに書いてから置き換える（途中で止まっても壊れない）
+# - complete_through：最も古い月からすき間なく書き出し済みの最後の月。
+#   CheckIn がこれより前の行はアーカイブだけで答えられる
+#
+# クエリの振り分け：
+# - AI生成SQL（core/sql_guard.py）：外側の FROM で SeatLog だけを1回参照し、外側の WHERE の
+#   最上位の AND 条件にある CheckIn の上限（CheckIn < '2025-01-01' / <= / BETWEEN）が
+#   complete_through 以前の場合に DuckDB で実行
+#   （SeatLog は Parquet、Seat / Employee は DB から読んだものを 10 分保持）。
+#   CASE・NOT・OR・サブクエリの中の比較は上限として扱わない。
+#   DuckDB の接続は、ビューを作った後に外部アクセスを止め（読めるのはアーカイブのディレクトリだけ）、
+#   設定を固定する（AI生成SQL から任意のファイルを読ませない）
+#   DuckDB で実行できない SQL（T-SQL の TOP など）は DB で実行する
+# - 席ごとの利用回数（visual/charts.py）：complete_through までをアーカイブ、以降を DB で数えて合算
+# 使用中のまま古い月に残った行（チェックアウト漏れ）はアーカイブ側の結果に含まれません。
+#
+# 設定（secrets / 環境変数）：
+#   DATASK_ARCHIVE_DIR  : アーカイブの保存先（未設定ならアーカイブは使わない）
+#   ARCHIVE_GRACE_DAYS  : 月末から何日たったら書き出すか（既定 7）
+#
+# duckdb は任意の依存のため、入っていなければアーカイブは無効（警告をログに出す）。
+#
+# コマンド（datask_app ディレクトリで実行、pyarrow と duckdb が必要）：
+#   python -m core.archive snapshot            # 締まった月を書き出す（定期実行）
+#   python -m core.archive snapshot --recheck  # 書き出し済みの月に後から入った行も確認
+#   python -m core.archive verify              # DB と件数を突き合わせ
+#   python -m core.archive prune --before 2025-01 --yes   # 書き出し済みの行を DB から削除
+#   python -m core.archive query "SELECT COUNT(*) FROM SeatLog"
+# =============================================================================
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+import sqlalchemy as sa
+import streamlit as st
+from core.config import secret
+from core.dialect import db_now, employee, import_duckdb, seat, seatlog
+from core.metrics import db_origin, record_rows
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+TABLE_DIR = "SeatLog"
+FORMAT_VERSION = 1
+DIMENSION_TTL = 600  # DuckDB 側に置く Seat / Employee を読み直す間隔（秒）
+
+COLUMNS = [seatlog.c.LogId, seatlog.c.SeatId, seatlog.c.EmpCode, seatlog.c.CheckIn, seatlog.c.CheckOut]
+
+
+def _month(d: date | datetime) -> str:
+    return f"{d.year:04d}-{d.month:02d}"
+
+
+def _month_start(month: str) -> datetime:
+    return datetime(int(month[:4]), int(month[5:7]), 1)
+
+
+def _next_month(month: str) -> str:
+    start = _month_start(month)
+    return _month((start + timedelta(days=32)).replace(day=1))
+
+
+def _months(first: str, last: str) -> list[str]:
+    months = []
+    while first <= last:
+        months.append(first)
+        first = _next_month(first)
+    return months
+
+
+def _as_datetime(value) -> datetime | None:
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def _arrow_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("LogId", pa.int64()),
+        ("SeatId", pa.int32()),
+        ("EmpCode", pa.string()),
+        ("CheckIn", pa.timestamp("s")),
+        ("CheckOut", pa.timestamp("s")),
+    ])
+
+
+class SeatLogArchive:
+    """月別 Parquet のアーカイブ（manifest の管理・書き出し・DuckDB でのクエリ）"""
+
+    def __init__(self, root: str, grace_days: int = 7):
+        self.root = root
+        self.grace_days = grace_days
+        self._lock = threading.RLock()
+        self.manifest = self._load_manifest()
+        self._duck = None
+        self._dims_loaded_at = 0.0
+        self.routed = 0
+        self.fallbacks = 0
+        self.query_seconds = 0.0
+
+    # ---------------------------------
+    # manifest
+    # ---------------------------------
+    def _load_manifest(self) -> dict:
+        path = os.path.join(self.root, MANIFEST)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        return {"version": FORMAT_VERSION, "table": TABLE_DIR, "complete_through": None, "months": {}}
+
+    def _save_manifest(self):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, MANIFEST)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    def cutoff(self) -> datetime | None:
+        """これより前の CheckIn はアーカイブだけで答えられる（書き出していなければ None）"""
+        through = self.manifest.get("complete_through")
+        return _month_start(_next_month(through)) if through else None
+
+    def files(self) -> list[str]:
+        return [
+            os.path.join(self.root, f["path"])
+            for m in self.manifest["months"].values() for f in m["files"]
+        ]
+
+    # ---------------------------------
+    # 書き出し
+    # ---------------------------------
+    def sealed_through(self, today: date) -> str:
+        """書き出してよい最後の月（月末から grace_days 日たった月）"""
+        return _month((today - timedelta(days=self.grace_days)).replace(day=1) - timedelta(days=1))
+
+    def snapshot(self, engine, chunk_size: int = 50_000, recheck: bool = False, progress=None) -> dict:
+        """
+        締まった月のチェックアウト済みの行を書き出す（書き出し済みの行は除く）。
+        recheck=True なら書き出し済みの月も、後から追加された行がないか確認する。
+
+        Returns:
+            {"months": 書き出した月の数, "rows": 行数, "bytes": バイト数, "complete_through": 月}
+        """
+        with self._lock, db_origin("archive"), engine.connect() as conn:
+            first, now = conn.execute(sa.select(sa.func.min(seatlog.c.CheckIn), db_now())).one()
+            if first is None:
+                return {"months": 0, "rows": 0, "bytes": 0, "complete_through": None}
+            last = self.sealed_through((_as_datetime(now) or datetime.now()).date())
+            months = self.manifest["months"]
+            written = {"months": 0, "rows": 0, "bytes": 0}
+            for month in _months(_month(_as_datetime(first)), last):
+                entry = months.get(month)
+                if entry is not None and not entry["open_log_ids"] and not recheck:
+                    continue
+                entry = entry or {"rows": 0, "max_log_id": 0, "open_log_ids": [], "files": []}
+                part = self._write_month(conn, month, entry, chunk_size)
+                entry["open_log_ids"] = [
+                    r[0] for r in conn.execute(
+                        sa.select(seatlog.c.LogId).where(*self._month_filter(month), seatlog.c.CheckOut.is_(None))
+                    )
+                ]
+                entry["updated_at"] = datetime.now().isoformat(timespec="seconds")
+                months[month] = entry
+                if part:
+                    written["months"] += 1
+                    written["rows"] += part["rows"]
+                    written["bytes"] += part["bytes"]
+                    if progress is not None:
+                        progress(month, part)
+            self.manifest["months"] = dict(sorted(months.items()))
+            self.manifest["complete_through"] = last if last >= _month(_as_datetime(first)) else None
+            self._save_manifest()
+        self._duck = None  # ファイルが増えたので DuckDB のビューを作り直す
+        record_rows(written["rows"], origin="archive")
+        return {**written, "complete_through": self.manifest["complete_through"]}
+
+    @staticmethod
+    def _month_filter(month: str) -> list:
+        return [seatlog.c.CheckIn >= _month_start(month), seatlog.c.CheckIn < _month_start(_next_month(month))]
+
+    def _write_month(self, conn, month: str, entry: dict, chunk_size: int) -> dict | None:
+        """month の未書き出しの行を1つの Parquet ファイルに書く（行がなければ None）"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        new_rows = seatlog.c.LogId > entry["max_log_id"]
+        if entry["open_log_ids"]:
+            new_rows = sa.or_(new_rows, seatlog.c.LogId.in_(entry["open_log_ids"]))
+        base = (
+            sa.select(*COLUMNS)
+            .where(*self._month_filter(month), seatlog.c.CheckOut.is_not(None), new_rows)
+            .order_by(seatlog.c.LogId)
+            .limit(chunk_size)
+        )
+        schema = _arrow_schema()
+        directory = os.path.join(self.root, TABLE_DIR, f"month={month}")
+        name = f"part-{len(entry['files']) + 1:05d}.parquet"
+        path = os.path.join(directory, name)
+        writer = None
+        rows, min_id, max_id, after = 0, None, None, None
+        try:
+            # LogId のキーセットで chunk_size 行ずつ読み、row group として書く
+            while True:
+                query = base if after is None else base.where(seatlog.c.LogId > after)
+                df = pd.read_sql(query, conn)
+                if df.empty:
+                    break
+                for col in ("CheckIn", "CheckOut"):
+                    df[col] = pd.to_datetime(df[col]).astype("datetime64[s]")
+                if writer is None:
+                    os.makedirs(directory, exist_ok=True)
+                    writer = pq.ParquetWriter(f"{path}.tmp", schema, compression="zstd")
+                writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+                after = int(df["LogId"].iloc[-1])
+                min_id = int(df["LogId"].iloc[0]) if min_id is None else min_id
+                max_id = after
+                rows += len(df)
+                if len(df) < chunk_size:
+                    break
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            return None
+        os.replace(f"{path}.tmp", path)
+        part = {
+            "path": os.path.relpath(path, self.root).replace(os.sep, "/"),
+            "rows": rows, "bytes": os.path.getsize(path), "min_log_id": min_id, "max_log_id": max_id,
+        }
+        entry["files"].append(part)
+        entry["rows"] += rows
+        entry["max_log_id"] = max(entry["max_log_id"], max_id)
+        return part
+
+    def verify(self, engine) -> pd.DataFrame:
+        """書き出し済みの月ごとに、DB のチェックアウト済みの件数とアーカイブの件数を比べる"""
+        months = list(self.manifest["months"])
+        if not months:
+            return pd.DataFrame(columns=["Month", "DbRows", "ArchiveRows", "ManifestRows", "PrunedRows", "Diff"])
+        with db_origin("archive"), engine.connect() as conn:
+            db = pd.read_sql(
+                sa.select(seatlog.c.CheckIn).where(
+                    seatlog.c.CheckIn < _month_start(_next_month(months[-1])), seatlog.c.CheckOut.is_not(None)
+                ), conn,
+            )
+        record_rows(len(db), origin="archive")
+        db_counts = pd.to_datetime(db["CheckIn"]).dt.strftime("%Y-%m").value_counts()
+        archived = self.query("SELECT month AS Month, COUNT(*) AS n FROM SeatLog GROUP BY month")
+        archive_counts = dict(zip(archived["Month"].astype(str), archived["n"]))
+        result = pd.DataFrame({
+            "Month": months,
+            "DbRows": [int(db_counts.get(m, 0)) for m in months],
+            "ArchiveRows": [int(archive_counts.get(m, 0)) for m in months],
+            "ManifestRows": [self.manifest["months"][m]["rows"] for m in months],
+            "PrunedRows": [self.manifest["months"][m].get("pruned_rows", 0) for m in months],
+        })
+        # DB から削除した行はアーカイブにだけある
+        result["Diff"] = result["DbRows"] + result["PrunedRows"] - result["ArchiveRows"]
+        return result
+
+    def prune(self, engine, before: str) -> int:
+        """
+        before より前の書き出し済みの月について、アーカイブと件数が一致する月だけ
+        チェックアウト済みの行を DB から削除する。使用中の行は残す。
+
+        Returns:
+            削除した行数
+        """
+        through = self.manifest.get("complete_through")
+        if not through:
+            return 0
+        check = self.verify(engine)
+        deletable = check[
+            (check["Month"] < before) & (check["Month"] <= through) & (check["Diff"] == 0) & (check["DbRows"] > 0)
+        ]
+        deleted = 0
+        with db_origin("archive"):
+            for month in deletable["Month"]:
+                max_id = self.manifest["months"][month]["max_log_id"]
+                with engine.begin() as conn:
+                    count = conn.execute(
+                        sa.delete(seatlog).where(
+                            *self._month_filter(month), seatlog.c.CheckOut.is_not(None), seatlog.c.LogId <= max_id,
+                        )
+                    ).rowcount
+                entry = self.manifest["months"][month]
+                entry["pruned_rows"] = entry.get("pruned_rows", 0) + count
+                deleted += count
+        self._save_manifest()
+        return deleted
+
+    # ---------------------------------
+    # クエリ（DuckDB）
+    # ---------------------------------
+    def _connection(self, engine=None):
+        """SeatLog（Parquet）と Seat / Employee（DB から読み込み）を参照できる DuckDB の接続"""
+        duckdb = import_duckdb("アーカイブへのクエリ")
+
+        if self._duck is None:
+            con = duckdb.connect()
+            files = self.files()
+            if files:
+                listed = ", ".join("'" + f.replace("'", "''") + "'" for f in files)
+                con.execute(f"CREATE VIEW SeatLog AS SELECT * FROM read_parquet([{listed}], hive_partitioning = true)")
+            else:
+                con.execute("CREATE VIEW SeatLog AS SELECT NULL::BIGINT AS LogId WHERE false")
+            # 以降はアーカイブ以外のファイルを読めないようにし、SQL から設定を戻せないよう固定する
+            con.execute("SET allowed_directories = ?", [[os.path.abspath(self.root)]])
+            con.execute("SET enable_external_access = false")
+            con.execute("SET lock_configuration = true")
+            self._duck = con
+            self._dims_loaded_at = 0.0
+        if engine is not None and time.time() - self._dims_loaded_at > DIMENSION_TTL:
+            with db_origin("archive"), engine.connect() as conn:
+                seats = pd.read_sql(sa.select(seat), conn)
+                employees = pd.read_sql(sa.select(employee), conn)
+            record_rows(len(seats) + len(employees), origin="archive")
+            # register() は接続ごとなので、cursor() からも見えるようテーブルにコピーする
+            for name, df in (("Seat", seats), ("Employee", employees)):
+                self._duck.register(f"{name}_df", df)
+                self._duck.execute(f"CREATE OR REPLACE TABLE {name} AS SELECT * FROM {name}_df")
+                self._duck.unregister(f"{name}_df")
+            self._dims_loaded_at = time.time()
+        return self._duck
+
+    def query(self, sql: str, engine=None, max_rows: int | None = None) -> pd.DataFrame:
+        """アーカイブに対して SQL を実行する（engine を渡すと Seat / Employee も参照できる）"""
+        started = time.perf_counter()
+        with self._lock:
+            cursor = self._connection(engine).cursor()
+        try:
+            result = cursor.execute(sql)
+            if max_rows is None:
+                df = result.df()
+            else:
+                rows = result.fetchmany(max_rows + 1)
+                df = pd.DataFrame.from_records(rows[:max_rows], columns=[d[0] for d in result.description])
+                df.attrs["truncated"] = len(rows) > max_rows
+        finally:
+            cursor.close()
+        self.query_seconds += time.perf_counter() - started
+        return df
+
+    def stats(self) -> dict:
+        months = self.manifest["months"]
+        return {
+            "root": self.root,
+            "complete_through": self.manifest.get("complete_through"),
+            "months": len(months),
+            "rows": sum(m["rows"] for m in months.values()),
+            "bytes": sum(f["bytes"] for m in months.values() for f in m["files"]),
+            "open_rows": sum(len(m["open_log_ids"]) for m in months.values()),
+            "routed": self.routed,
+            "fallbacks": self.fallbacks,
+            "query_seconds": round(self.query_seconds, 3),
+        }
+
+
+@st.cache_resource
+def get_archive() -> SeatLogArchive | None:
+    """DATASK_ARCHIVE_DIR を設定したときだけ使うアーカイブ（全セッション共有）"""
+    root = secret("DATASK_ARCHIVE_DIR")
+    if not root:
+        return None
+    try:
+        import_duckdb("アーカイブ（DATASK_ARCHIVE_DIR）")
+    except ImportError as e:
+        logger.warning("アーカイブを使わずに続行します: %s", e)
+        return None
+    return SeatLogArchive(root, grace_days=int(secret("ARCHIVE_GRACE_DAYS", "7")))
+
+
+# -------------------------------
+# 過去の期間だけを対象にする SQL の判定と振り分け
+# -------------------------------
+def _parse_bound(literal: str) -> tuple[datetime, bool] | None:
+    """'2025-01-01' / '2025-01-01 09:00' → (日時, 日付だけか)"""
+    text = literal.lstrip("Nn").strip("'")
+    try:
+        return datetime.fromisoformat(text), len(text) <= 10
+    except ValueError:
+        return None
+
+
+# 外側の WHERE 句の終わりを示すキーワード
+_WHERE_END = {"GROUP", "HAVING", "ORDER", "WINDOW", "QUALIFY", "LIMIT", "OFFSET", "FETCH", "OPTION", "FOR"}
+
+
+def _conjuncts(sig: list) -> list[list]:
+    """外側の WHERE 句を最上位の AND で分ける（BETWEEN … AND … の AND では分けない）"""
+    where = next((i for i, (k, t, _, d) in enumerate(sig) if d == 0 and k == "word" and t.upper() == "WHERE"), None)
+    if where is None:
+        return []
+    parts, current, between = [], [], False
+    for kind, text, pos, depth in sig[where + 1:]:
+        word = text.upper() if kind == "word" else None
+        if depth == 0 and word in _WHERE_END:
+            break
+        if depth == 0 and word == "BETWEEN":
+            between = True
+        elif depth == 0 and word == "AND":
+            if between:
+                between = False
+            else:
+                parts.append(current)
+                current = []
+                continue
+        current.append((kind, text, pos, depth))
+    parts.append(current)
+    return parts
+
+
+def _checkin_bound(conjunct: list) -> datetime | None:
+    """「[L.]CheckIn < / <= '…'」「[L.]CheckIn BETWEEN '…' AND '…'」だけの条件なら、その上限（含まない）"""
+    tokens = [(k, t.upper() if k == "word" else t) for k, t, _, _ in conjunct]
+    if len(tokens) >= 2 and tokens[1][1] == ".":
+        tokens = tokens[2:]
+    if not tokens or tokens[0][1].strip('[]"').upper() != "CHECKIN":
+        return None
+    rest = tokens[1:]
+    if [t for _, t in rest[:2]] == ["<", "="] and len(rest) == 3 and rest[2][0] == "string":
+        literal, inclusive = rest[2][1], True
+    elif len(rest) == 2 and rest[0][1] == "<" and rest[1][0] == "string":
+        literal, inclusive = rest[1][1], False
+    elif len(rest) == 4 and rest[0][1] == "BETWEEN" and rest[1][0] == "string" and rest[2][1] == "AND" \
+            and rest[3][0] == "string":
+        literal, inclusive = rest[3][1], True
+    else:
+        return None
+    parsed = _parse_bound(literal)
+    if parsed is None:
+        return None
+    bound, date_only = parsed
+    if inclusive:
+        bound += timedelta(days=1) if date_only else timedelta(seconds=1)
+    return bound
+
+
+def checkin_upper_bound(sql: str) -> datetime | None:
+    """
+    外側の FROM で SeatLog だけを1回参照し、外側の WHERE の最上位の AND 条件に CheckIn の上限がある SQL なら、
+    その上限（これより前だけを読む）。CASE・NOT・OR・サブクエリの中の比較は上限として扱わない。
+    集合演算を含む・上限がない・判定できない場合は None。
+    """
+    # sql_guard が core.db を import するため遅延
+    from core.sql_guard import SET_OPERATORS, from_references, significant_tokens
+
+    sig = significant_tokens(sql)
+    refs = from_references(sql)
+    tables = [name for name, _ in refs]
+    if tables.count("SEATLOG") != 1 or "SEATLOGMONTHLY" in tables or ("SEATLOG", 0) not in refs:
+        return None
+    if any(d == 0 and k == "word" and t.upper() in SET_OPERATORS for k, t, _, d in sig):
+        return None
+    bounds = [b for b in map(_checkin_bound, _conjuncts(sig)) if b is not None]
+    return min(bounds) if bounds else None
+
+
+def route_query(sql: str, max_rows: int, engine) -> pd.DataFrame | None:
+    """
+    過去の期間だけを読む SQL ならアーカイブで実行して返す（対象外・実行できなければ None）。
+    """
+    archive = get_archive()
+    cutoff = archive.cutoff() if archive is not None else None
+    if cutoff is None:
+        return None
+    bound = checkin_upper_bound(sql)
+    if bound is None or bound > cutoff:
+        return None
+
+    from core.sql_guard import govern_sql
+
+    try:
+        df = archive.query(govern_sql(sql, max_rows, "duckdb"), engine, max_rows=max_rows)
+    except Exception:
+        # T-SQL の構文など DuckDB で実行できない SQL は DB で実行する
+        archive.fallbacks += 1
+        return None
+    archive.routed += 1
+    df.attrs["source"] = "archive"
+    return df
+
+
+def main(argv: list[str] | None = None):
+    from core.db import build_engine
+
+    parser = argparse.ArgumentParser(description="SeatLog の月別 Parquet アーカイブ")
+    parser.add_argument("--dir", default=secret("DATASK_ARCHIVE_DIR"), help="保存先（既定 DATASK_ARCHIVE_DIR）")
+    parser.add_argument("--grace-days", type=int, default=int(secret("ARCHIVE_GRACE_DAYS", "7")))
+    sub = parser.add_subparsers(dest="command", required=True)
+    snap = sub.add_parser("snapshot", help="締まった月を書き出す")
+    snap.add_argument("--recheck", action="store_true", help="書き出し済みの月に後から入った行も確認")
+    snap.add_argument("--chunk-size", type=int, default=50_000)
+    sub.add_parser("verify", help="DB とアーカイブの件数を突き合わせ")
+    prune = sub.add_parser("prune", help="書き出し済みの行を DB から削除")
+    prune.add_argument("--before", required=True, help="この月（yyyy-MM）より前を削除")
+    prune.add_argument("--yes", action="store_true", help="確認なしで削除する")
+    query = sub.add_parser("query", help="アーカイブに SQL を実行")
+    query.add_argument("sql")
+    args = parser.parse_args(argv)
+    if not args.dir:
+        parser.error("--dir または DATASK_ARCHIVE_DIR を指定してください")
+
+    archive = SeatLogArchive(args.dir, grace_days=args.grace_days)
+    engine = build_engine()
+    if args.command == "snapshot":
+        started = time.perf_counter()
+        result = archive.snapshot(
+            engine, args.chunk_size, args.recheck,
+            progress=lambda month, part: print(f"  {month}: {part['rows']:,} rows, {part['bytes'] / 1024:,.0f} KB"),
+        )
+        print(f"{result}（{time.perf_counter() - started:.1f} 秒）")
+    elif args.command == "verify":
+        result = archive.verify(engine)
+        print(result.to_string(index=False))
+        return 1 if (result["Diff"] != 0).any() else 0
+    elif args.command == "prune":
+        if not args.yes:
+            parser.error("削除するには --yes を指定してください（先に verify で件数を確認）")
+        print(f"{archive.prune(engine, args.before):,} 行を削除しました")
+    else:
+        with pd.option_context("display.max_rows", 200, "display.width", 160):
+            print(archive.query(args.sql, engine).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
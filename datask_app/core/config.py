@@ -14,7 +14,6 @@
 
 import os
 import streamlit as st
-import requests
 
 def get_secret(key: str, default: str | None = None) -> str | None:
     """
@@ -37,26 +36,22 @@ def check_ai_search_connection() -> bool:
     Returns:
         bool: 成功なら True、失敗なら False
     """
-    endpoint = get_secret("AZURE_SEARCH_ENDPOINT")
-    key = get_secret("AZURE_SEARCH_API_KEY")
+    # 共有クライアント（接続の再利用・タイムアウト・リトライ付き）は確認のときだけ読み込む
+    from core.search_client import get_search_client
 
-    if not endpoint or not key:
+    client = get_search_client()
+    if client is None:
         st.warning("⚠ Azure AI Search の接続設定が見つかりません。secrets.toml を確認してください。")
         return False
 
-    try:
-        rsp = requests.get(
-            url=f"{endpoint}/indexes?api-version=2023-07-01-preview",
-            headers={"api-key": key}
-        )
-        if rsp.status_code == 200:
-            return True
-        else:
-            st.warning(f"Azure AI Search に接続できません（ステータス: {rsp.status_code}）")
-            return False
-    except Exception as e:
-        st.error(f"Azure AI Search 接続エラー: {e}")
-        return False
+    ok, status = client.ping()
+    if ok:
+        return True
+    elif isinstance(status, int):
+        st.warning(f"Azure AI Search に接続できません（ステータス: {status}）")
+    else:
+        st.error(f"Azure AI Search 接続エラー: {status}")
+    return False
 
 #  利便性のためのエイリアス（openai_sql などから使用される）
 secret = get_secret
@@ -2,10 +2,13 @@
 # db.py - データベース接続と操作
 # -----------------------------------------------------------------------------
 # SQL Server（Azure SQL）への接続を行い、データの取得やクエリ実行を行う関数をまとめたモジュールです。
+# DATASK_DB_URL を設定すると SQLite / DuckDB にも接続できます（core/dialect.py）。
 #
 # 主な機能：
-# - SQLAlchemyを使用してDBエンジンを構築
-# - Seat / Employee / SeatLog テーブルの一覧取得
+# - SQLAlchemyを使用してDBエンジンを構築（接続プールの設定・切断検知・クエリ計測付き）
+#   エンジンは get_engine() の初回呼び出し時に作成（import 時には接続・ドライバー読み込みをしない）
+# - DB接続の確認（check_db_connection）
+# - テーブルの一覧取得（core/schema_catalog.py のキャッシュから）
 # - 任意のテーブルデータ取得
 # - 任意のSQL文を実行し結果をDataFrameで返す
 # - 氏名から社員コードを検索（← NEW）
@@ -14,64 +17,114 @@
 #   df = load_table("Seat", 100)
 #   result = run_query("SELECT * FROM Employee")
 #   code = find_empcode_by_name("田中")
+#
+# 接続プールの設定（secrets / 環境変数）：
+#   DB_POOL_SIZE       : 常時保持する接続数（既定 5）
+#   DB_MAX_OVERFLOW    : 一時的に追加できる接続数（既定 10）
+#   DB_POOL_TIMEOUT    : 空き接続を待つ秒数（既定 30）
+#   DB_POOL_RECYCLE    : 接続を作り直すまでの秒数（既定 1800、Azure SQL のアイドル切断より短く）
+#   DB_POOL_PRE_PING   : 貸し出し前に接続を確認する（既定 true、切断済みの接続を自動で張り直す）
+# SQLite はファイル単位のロックのため、プールの大きさは既定のままにします。
+# 実行時間は core/metrics.py に呼び出し元（origin）ごとに記録されます。
 # =============================================================================
 
-import os
+import time
 import streamlit as st
 import pandas as pd
 import sqlalchemy as sa
-from urllib.parse import quote_plus
-from config import secret
+from core.config import secret
+from core.dialect import TABLES, backend_name, create_app_engine
+from core.metrics import db_origin, instrument_engine, record_rows
+
+def pool_options(dialect: str | None = None) -> dict:
+    """secrets / 環境変数から接続プールの設定を組み立てる"""
+    options = {
+        "pool_pre_ping": secret("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+        "pool_recycle": int(secret("DB_POOL_RECYCLE", "1800")),
+    }
+    if (dialect or backend_name()) != "sqlite":
+        options.update(
+            pool_size=int(secret("DB_POOL_SIZE", "5")),
+            max_overflow=int(secret("DB_MAX_OVERFLOW", "10")),
+            pool_timeout=int(secret("DB_POOL_TIMEOUT", "30")),
+        )
+    return options
 
 def build_engine() -> sa.Engine:
-    srv, db = secret("AZURE_SQL_SERVER"), secret("AZURE_SQL_DB")
-    usr, pwd = secret("AZURE_SQL_USER"), secret("AZURE_SQL_PASSWORD")
-    driver = secret("AZURE_SQL_DRIVER", "ODBC Driver 17 for SQL Server")
-    conn = f"mssql+pyodbc://{usr}:{quote_plus(pwd)}@{srv}/{db}?driver={driver.replace(' ', '+')}"
-    return sa.create_engine(conn, fast_executemany=True)
+    # DATASK_DB_URL、なければ AZURE_SQL_* の SQL Server（mssql では fast_executemany を有効化）
+    return instrument_engine(create_app_engine(**pool_options()))
 
-engine = build_engine()
+@st.cache_resource
+def get_engine() -> sa.Engine:
+    """全セッションで共有するエンジン（初回呼び出し時に作成）"""
+    return build_engine()
 
-@st.cache_data(ttl=60)
-def list_tables():
-    sql = """
-    SELECT TABLE_SCHEMA + '.' + TABLE_NAME AS FullName
-    FROM INFORMATION_SCHEMA.TABLES
-    WHERE TABLE_NAME IN ('Seat','Employee','SeatLog')
-    ORDER BY FullName
+def __getattr__(name: str):
+    # 互換のため core.db.engine も残す（参照した時点でエンジンを作る）
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def check_db_connection() -> tuple[bool, float | None]:
+    """
+    DB接続の確認（SELECT 1）
+
+    Returns:
+        (成功したか, 応答時間ミリ秒)
     """
-    with engine.connect() as c:
-        return [r[0] for r in c.execute(sa.text(sql))]
+    started = time.perf_counter()
+    try:
+        with db_origin("health"), get_engine().connect() as c:
+            c.execute(sa.select(sa.literal(1))).scalar()
+    except sa.exc.SQLAlchemyError as e:
+        st.error(f"DB接続エラー: {e}")
+        return False, None
+    return True, (time.perf_counter() - started) * 1000
+
+def list_tables():
+    """参照できるテーブル（スキーマ名付き）。スキーマが変わるまで DB には問い合わせない"""
+    from core.schema_catalog import get_schema_catalog  # schema_catalog が get_engine を使うため遅延
+
+    tables = get_schema_catalog().current()["tables"]
+    names = [t for t in tables if t in TABLES]
+    return sorted(f"{tables[t]['schema']}.{t}" if tables[t]["schema"] else t for t in names)
+
+def _table(tbl: str) -> sa.Table:
+    """'Seat' / 'dbo.Seat' などからテーブル定義を引く（定義済みのテーブルのみ）"""
+    name = tbl.split(".")[-1]
+    if name not in TABLES:
+        raise ValueError(f"参照できないテーブルです: {tbl}")
+    return TABLES[name]
 
 @st.cache_data(ttl=60)
+@db_origin("table_browse")
 def load_table(tbl: str, limit: int = 100) -> pd.DataFrame:
-    with engine.connect() as c:
-        return pd.read_sql(sa.text(f"SELECT TOP {limit} * FROM {tbl}"), c)
+    with get_engine().connect() as c:
+        df = pd.read_sql(sa.select(_table(tbl)).limit(limit), c)
+    record_rows(len(df))
+    return df
 
 def run_query(sql: str) -> pd.DataFrame:
-    with engine.connect() as c:
-        return pd.read_sql(sa.text(sql), c)
+    with get_engine().connect() as c:
+        df = pd.read_sql(sa.text(sql), c)
+    record_rows(len(df))
+    return df
 
 # NEW: 氏名から社員コードを検索する関数
 def find_empcode_by_name(name: str) -> tuple[str, str] | None:
     """
     氏名の一部（姓など）から該当する社員コードと氏名を返す。
-    完全一致・前方一致・部分一致の順で検索。
+    完全一致・前方一致・部分一致の順で検索（core/name_index.py のメモリ内索引を使用）。
+    候補が複数ある場合は社員コード順の先頭を返す。すべての候補が必要な場合は
+    get_name_index().resolve() を使用する。
 
     Returns:
         (EmpCode, Name) または None
     """
-    with engine.connect() as c:
-        # 完全一致 → 前方一致 → 部分一致
-        patterns = [name, f"{name}%", f"%{name}%"]
-        for pat in patterns:
-            sql = sa.text("SELECT TOP 1 EmpCode, Name FROM Employee WHERE Name LIKE :pat")
-            row = c.execute(sql, {"pat": pat}).fetchone()
-            if row:
-                return row[0], row[1]
-    return None
+    from core.name_index import get_name_index  # name_index が core.db を import するため遅延
 
-def load_table(tbl: str, limit: int = 100) -> pd.DataFrame:
-    with engine.connect() as c:
-        return pd.read_sql(sa.text(f"SELECT TOP {limit} * FROM {tbl}"), c)
+    candidates = get_name_index().resolve(name)
+    if candidates:
+        return candidates[0]["EmpCode"], candidates[0]["Name"]
+    return None
 
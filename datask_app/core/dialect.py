@@ -0,0 +1,318 @@
+# =============================================================================
+# dialect.py - DB方言の吸収（SQL Server / SQLite / DuckDB）
+# -----------------------------------------------------------------------------
+# アプリのクエリを SQLAlchemy Core の式で組み立て、接続先ごとの SQL に
+# コンパイルします。Azure SQL のほか、ローカルの SQLite や DuckDB
+# （レポート用レプリカ・ベンチマーク）でも同じクエリが動きます。
+#
+# 主な機能：
+# - テーブル定義（Seat / Employee / SeatLog / SeatLogMonthly / 集計の状態テーブル /
+#   座席の座標 SeatPosition）
+# - 方言ごとにコンパイルされる関数
+#     month_of(col)          : 'yyyy-MM'（SQL Server は CONVERT(char(7), col, 126)）
+#     minutes_between(a, b)  : 分単位の差（SQL Server は DATEDIFF(minute, a, b)）
+#     db_now()               : DBサーバーの現在時刻（SQL Server は GETDATE()）
+#     checksum_agg(*cols)    : 行内容のチェックサムの集約（変更検知用）
+# - 行数の制限は select().limit(n)（SQL Server では TOP n になる）
+# - 接続URLの決定：DATASK_DB_URL があればそれを使い、なければ AZURE_SQL_* から
+#   mssql+pyodbc の URL を組み立てる
+#
+# duckdb / duckdb-engine は任意の依存（requirements.txt には含めない）。
+# DuckDB に接続するときやアーカイブ（core/archive.py）を使うときに import し、
+# 入っていなければ入れ方を示す ImportError にする（import_duckdb）。
+#
+# 設定（secrets / 環境変数）：
+#   DATASK_DB_URL : 例 sqlite:///datask.sqlite, duckdb:///datask.duckdb（要 duckdb・duckdb-engine）
+# =============================================================================
+
+import zlib
+from urllib.parse import quote_plus
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import mssql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from core.config import secret
+
+# -------------------------------
+# テーブル定義
+# -------------------------------
+metadata = sa.MetaData()
+
+# SQLite は日時を文字列で保存するため、アプリのデータ（秒精度）と同じ形式で比較・保存する
+# SQL Server は既存の列（datetime2）と同じ型にする（一時テーブルも datetime ではなく datetime2）
+DateTime = sa.DateTime().with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite",
+).with_variant(mssql.DATETIME2(), "mssql")
+
+seat = sa.Table(
+    "Seat", metadata,
+    sa.Column("SeatId", sa.Integer, primary_key=True),
+    sa.Column("Label", sa.Unicode(20), nullable=False),
+    sa.Column("Area", sa.Unicode(30)),
+    sa.Column("SeatType", sa.Unicode(20)),
+)
+
+# 座席マップの座標（任意、visual/floor_layout.py。ない席は自動配置）
+seat_position = sa.Table(
+    "SeatPosition", metadata,
+    sa.Column("SeatId", sa.Integer, primary_key=True),
+    sa.Column("X", sa.Float, nullable=False),
+    sa.Column("Y", sa.Float, nullable=False),
+)
+
+employee = sa.Table(
+    "Employee", metadata,
+    sa.Column("EmpCode", sa.String(10), primary_key=True),
+    sa.Column("Name", sa.Unicode(50), nullable=False),
+    sa.Column("Dept", sa.Unicode(30)),
+)
+
+seatlog = sa.Table(
+    "SeatLog", metadata,
+    sa.Column("LogId", sa.Integer, primary_key=True),
+    sa.Column("SeatId", sa.Integer, nullable=False),
+    sa.Column("EmpCode", sa.String(10), nullable=False),
+    sa.Column("CheckIn", DateTime, nullable=False),
+    sa.Column("CheckOut", DateTime),
+)
+
+seatlog_monthly = sa.Table(
+    "SeatLogMonthly", metadata,
+    sa.Column("EmpCode", sa.String(10), primary_key=True),
+    sa.Column("Month", sa.String(7), primary_key=True),
+    sa.Column("SeatId", sa.Integer, primary_key=True),
+    sa.Column("Dept", sa.Unicode(30)),
+    sa.Column("UsageCount", sa.Integer, nullable=False),
+    sa.Column("TotalMinutes", sa.BigInteger, nullable=False),
+)
+
+rollup_state = sa.Table(
+    "SeatLogRollupState", metadata,
+    sa.Column("Id", sa.SmallInteger, primary_key=True),
+    sa.Column("LastLogId", sa.Integer, nullable=False),
+    sa.Column("UpdatedAt", DateTime, nullable=False),
+)
+
+rollup_pending = sa.Table(
+    "SeatLogRollupPending", metadata,
+    sa.Column("LogId", sa.Integer, primary_key=True),
+)
+
+# テーブル名 → Table（画面やエクスポートで名前から引くため）
+TABLES = {t.name: t for t in metadata.sorted_tables}
+
+
+# -------------------------------
+# 方言ごとの関数
+# -------------------------------
+class month_of(FunctionElement):
+    """日時列の 'yyyy-MM'"""
+    type = sa.String(7)
+    name = "month_of"
+    inherit_cache = True
+
+
+class minutes_between(FunctionElement):
+    """start から end までの分数（境界をまたいだ回数）"""
+    type = sa.Integer()
+    name = "minutes_between"
+    inherit_cache = True
+
+
+class db_now(FunctionElement):
+    """DBサーバーのローカル現在時刻"""
+    type = DateTime
+    name = "db_now"
+    inherit_cache = True
+
+
+class checksum_agg(FunctionElement):
+    """列の値から作ったチェックサムの集約（内容が変われば値が変わる）"""
+    type = sa.BigInteger()
+    name = "checksum_agg"
+    inherit_cache = True
+
+
+def _unsupported(element, compiler, **kw):
+    raise sa.exc.CompileError(f"{element.name} は {compiler.dialect.name} に未対応です")
+
+
+for _fn in (month_of, minutes_between, db_now, checksum_agg):
+    compiles(_fn)(_unsupported)
+
+
+def _args(element, compiler, **kw) -> list[str]:
+    return [compiler.process(arg, **kw) for arg in element.clauses]
+
+
+# SQL Server
+@compiles(month_of, "mssql")
+def _month_mssql(element, compiler, **kw):
+    return f"CONVERT(char(7), {_args(element, compiler, **kw)[0]}, 126)"
+
+
+@compiles(minutes_between, "mssql")
+def _minutes_mssql(element, compiler, **kw):
+    start, end = _args(element, compiler, **kw)
+    return f"DATEDIFF(minute, {start}, {end})"
+
+
+@compiles(db_now, "mssql")
+def _now_mssql(element, compiler, **kw):
+    return "GETDATE()"
+
+
+@compiles(checksum_agg, "mssql")
+def _checksum_mssql(element, compiler, **kw):
+    return f"CHECKSUM_AGG(BINARY_CHECKSUM({', '.join(_args(element, compiler, **kw))}))"
+
+
+# SQLite（チェックサムは接続時に登録する関数を使う）
+@compiles(month_of, "sqlite")
+def _month_sqlite(element, compiler, **kw):
+    return f"strftime('%Y-%m', {_args(element, compiler, **kw)[0]})"
+
+
+@compiles(minutes_between, "sqlite")
+def _minutes_sqlite(element, compiler, **kw):
+    start, end = _args(element, compiler, **kw)
+    return (f"(CAST(strftime('%s', {end}) AS INTEGER) / 60"
+            f" - CAST(strftime('%s', {start}) AS INTEGER) / 60)")
+
+
+@compiles(db_now, "sqlite")
+def _now_sqlite(element, compiler, **kw):
+    return "datetime('now', 'localtime')"
+
+
+@compiles(checksum_agg, "sqlite")
+def _checksum_sqlite(element, compiler, **kw):
+    return f"datask_checksum_agg(datask_checksum({', '.join(_args(element, compiler, **kw))}))"
+
+
+# DuckDB
+@compiles(month_of, "duckdb")
+def _month_duckdb(element, compiler, **kw):
+    return f"strftime({_args(element, compiler, **kw)[0]}, '%Y-%m')"
+
+
+@compiles(minutes_between, "duckdb")
+def _minutes_duckdb(element, compiler, **kw):
+    start, end = _args(element, compiler, **kw)
+    return f"date_diff('minute', {start}, {end})"
+
+
+@compiles(db_now, "duckdb")
+def _now_duckdb(element, compiler, **kw):
+    return "current_localtimestamp()"
+
+
+@compiles(checksum_agg, "duckdb")
+def _checksum_duckdb(element, compiler, **kw):
+    return f"bit_xor(hash({', '.join(_args(element, compiler, **kw))}))"
+
+
+class _XorAgg:
+    def __init__(self):
+        self.value = 0
+
+    def step(self, value):
+        if value is not None:
+            self.value ^= int(value)
+
+    def finalize(self):
+        return self.value
+
+
+def _register_sqlite_functions(dbapi_conn, _record):
+    dbapi_conn.create_function(
+        "datask_checksum", -1, lambda *values: zlib.crc32(repr(values).encode("utf-8")), deterministic=True
+    )
+    dbapi_conn.create_aggregate("datask_checksum_agg", 1, _XorAgg)
+
+
+# -------------------------------
+# 接続
+# -------------------------------
+def database_url() -> str:
+    """DATASK_DB_URL、なければ AZURE_SQL_* から組み立てた SQL Server の URL"""
+    url = secret("DATASK_DB_URL")
+    if url:
+        return url
+    srv, db = secret("AZURE_SQL_SERVER"), secret("AZURE_SQL_DB")
+    usr, pwd = secret("AZURE_SQL_USER"), secret("AZURE_SQL_PASSWORD")
+    driver = secret("AZURE_SQL_DRIVER", "ODBC Driver 17 for SQL Server")
+    return f"mssql+pyodbc://{usr}:{quote_plus(pwd or '')}@{srv}/{db}?driver={driver.replace(' ', '+')}"
+
+
+def backend_name(url: str | None = None) -> str:
+    """接続先の種類（mssql / sqlite / duckdb）。エンジンを作らずに判定する"""
+    if url is None:
+        url = secret("DATASK_DB_URL")
+        if not url:
+            return "mssql"
+    return sa.engine.make_url(url).get_backend_name()
+
+
+def import_duckdb(purpose: str, engine: bool = False):
+    """
+    任意の依存の duckdb（engine=True なら duckdb-engine も）を import して返す。
+    入っていなければ、何のために必要か・入れ方を示す ImportError を送出する。
+    """
+    packages = "duckdb duckdb-engine" if engine else "duckdb"
+    try:
+        import duckdb
+        if engine:
+            import duckdb_engine  # noqa: F401
+    except ImportError as e:
+        names = packages.replace(" ", " と ")
+        raise ImportError(f"{purpose}には {names} が必要です（pip install {packages}）。") from e
+    return duckdb
+
+
+def create_app_engine(url: str | None = None, **kwargs) -> sa.Engine:
+    """接続先に合わせたオプションでエンジンを作る"""
+    url = url or database_url()
+    if backend_name(url) == "duckdb":
+        import_duckdb("DuckDB への接続（DATASK_DB_URL）", engine=True)
+    if sa.engine.make_url(url).drivername == "mssql+pyodbc":
+        kwargs.setdefault("fast_executemany", True)
+    engine = sa.create_engine(url, **kwargs)
+    if engine.dialect.name == "sqlite":
+        sa.event.listen(engine, "connect", _register_sqlite_functions)
+    return engine
+
+
+# SQL 生成のヒント（LLM が接続先で動く SQL を書けるように）
+DIALECT_RULES = {
+    "mssql": {
+        "label": "T-SQL",
+        "rules": [
+            "Use T-SQL (SQL Server). Limit rows with SELECT TOP (n).",
+            "Month string: CONVERT(char(7), CheckIn, 126) -> 'yyyy-MM'. Current time: GETDATE().",
+            "Minutes between: DATEDIFF(minute, CheckIn, CheckOut).",
+        ],
+    },
+    "sqlite": {
+        "label": "SQLite",
+        "rules": [
+            "Use SQLite SQL. Limit rows with LIMIT n at the end (no TOP).",
+            "Month string: strftime('%Y-%m', CheckIn). Current time: datetime('now', 'localtime').",
+            "Minutes between: (strftime('%s', CheckOut) - strftime('%s', CheckIn)) / 60.",
+        ],
+    },
+    "duckdb": {
+        "label": "DuckDB SQL",
+        "rules": [
+            "Use DuckDB SQL. Limit rows with LIMIT n at the end (no TOP).",
+            "Month string: strftime(CheckIn, '%Y-%m'). Current time: current_localtimestamp().",
+            "Minutes between: date_diff('minute', CheckIn, CheckOut).",
+        ],
+    },
+}
+
+
+def dialect_rules(name: str | None = None) -> dict:
+    return DIALECT_RULES.get(name or backend_name(), DIALECT_RULES["mssql"])
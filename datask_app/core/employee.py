@@ -7,15 +7,17 @@
 # 主な使用箇所：
 # - 質問に含まれる氏名から対象の社員コードを特定し、
 #   社員ごとのグラフ表示やログ抽出に活用。
+# - openai_sql の高速判定（LLM を呼ばずに「○○さんの利用状況」を判定）。
+#
+# 検索は core/name_index.py のメモリ内インデックスで行い、DBへの LIKE 検索は行わない。
 # =============================================================================
 
-import sqlalchemy as sa
-import pandas as pd
-from core.db import engine
+from core.name_index import get_name_index
+from core.tracing import span
 
 def get_empcode_by_name(name: str) -> str | None:
     """
-    氏名からEmpCodeを取得（部分一致、最初の1件を返す）
+    氏名からEmpCodeを取得（完全一致 → 前方一致 → 部分一致、最初の1件を返す）
 
     Parameters:
         name (str): 氏名の一部（例: "田中"）
@@ -23,7 +25,21 @@ def get_empcode_by_name(name: str) -> str | None:
     Returns:
         EmpCode (str) or None
     """
-    sql = "SELECT EmpCode FROM Employee WHERE Name LIKE :name"
-    with engine.begin() as conn:
-        df = pd.read_sql(sa.text(sql), conn, params={"name": f"%{name}%"})
-    return df["EmpCode"].iloc[0] if not df.empty else None
+    with span("name_lookup", name=name) as s:
+        candidates = get_name_index().resolve(name)
+        s.set(candidates=len(candidates))
+    return candidates[0]["EmpCode"] if candidates else None
+
+
+def find_employees(name: str) -> list[tuple[str, str]]:
+    """
+    氏名で候補をすべて探す（DBアクセスなし）。
+    完全一致 → 前方一致 → 部分一致の順に、最初に見つかった段階の候補をすべて返す。
+
+    Returns:
+        [(EmpCode, Name), ...]（該当なしは空リスト）
+    """
+    with span("name_lookup", name=name) as s:
+        candidates = get_name_index().resolve(name)
+        s.set(candidates=len(candidates))
+    return [(c["EmpCode"], c["Name"]) for c in candidates]
@@ -0,0 +1,185 @@
+# =============================================================================
+# export.py - テーブル参照・エクスポートのストリーミング取得
+# -----------------------------------------------------------------------------
+# Seat / Employee / SeatLog を主キーのキーセット・ページング
+# （WHERE 主キー > 前ページの最終キー ORDER BY 主キー）で少しずつ取得します。
+# OFFSET を使わないため、後ろのページでも取得コストは一定です。
+#
+# 主な機能：
+# - fetch_page()          : 画面に表示する1ページ分だけを取得
+# - iter_table_chunks()   : chunk_size 行ずつ DataFrame を返すジェネレーター
+# - iter_csv_chunks()     : CSV（UTF-8 BOM付き、ヘッダーは最初だけ）のバイト列を順に返す
+# - iter_parquet_chunks() : Parquet（チャンクごとに row group、型はテーブル定義から）のバイト列を順に返す
+# - export_table_to_file(): 上記をファイルに書き出す（メモリ使用量はチャンク分だけ）
+#
+# 使用例：
+#   df, last_key = fetch_page("SeatLog", after=None, page_size=100)
+#   export_table_to_file("SeatLog", "/tmp/SeatLog.csv", fmt="csv")
+# =============================================================================
+
+import io
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Iterator
+
+import pandas as pd
+import sqlalchemy as sa
+from core.db import get_engine
+from core.dialect import TABLES
+from core.metrics import db_origin, record_rows
+
+# テーブル名 → キーセット・ページングに使う主キー（ここにあるテーブルだけ参照可能）
+TABLE_KEYS = {
+    "Seat": "SeatId",
+    "Employee": "EmpCode",
+    "SeatLog": "LogId",
+}
+
+
+def _key_column(table: str) -> str:
+    if table not in TABLE_KEYS:
+        raise ValueError(f"参照できないテーブルです: {table}")
+    return TABLE_KEYS[table]
+
+
+def fetch_page(table: str, after=None, page_size: int = 100, conn=None) -> tuple[pd.DataFrame, object]:
+    """
+    主キーが after より大きい行を page_size 件取得する（after=None なら先頭から）。
+
+    Returns:
+        (DataFrame, このページの最終キー（次ページの after に渡す）／行がなければ None)
+    """
+    key = _key_column(table)
+    t = TABLES[table]
+    query = sa.select(t).order_by(t.c[key]).limit(int(page_size))
+    if after is not None:
+        query = query.where(t.c[key] > after)
+    if conn is None:
+        with get_engine().connect() as c:
+            df = pd.read_sql(query, c)
+    else:
+        df = pd.read_sql(query, conn)
+    record_rows(len(df))
+    last = df[key].iloc[-1] if not df.empty else None
+    if hasattr(last, "item"):  # numpy の数値は Python の数値に戻す
+        last = last.item()
+    return df, last
+
+
+def iter_table_chunks(table: str, chunk_size: int = 5000, max_rows: int | None = None) -> Iterator[pd.DataFrame]:
+    """テーブル全体（max_rows 指定時はその件数まで）を chunk_size 行ずつ返す"""
+    after = None
+    remaining = max_rows
+    with get_engine().connect() as conn:
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            df, after = fetch_page(table, after, size, conn=conn)
+            if df.empty:
+                return
+            yield df
+            if remaining is not None:
+                remaining -= len(df)
+            if len(df) < size:
+                return
+
+
+def iter_csv_chunks(table: str, chunk_size: int = 5000, max_rows: int | None = None,
+                    encoding: str = "utf-8-sig") -> Iterator[bytes]:
+    """CSV をチャンクごとのバイト列で返す（BOM とヘッダーは最初のチャンクだけ）"""
+    first = True
+    for df in iter_table_chunks(table, chunk_size, max_rows):
+        text = df.to_csv(index=False, header=first)
+        yield text.encode(encoding if first else encoding.replace("-sig", ""))
+        first = False
+
+
+class _ChunkSink(io.RawIOBase):
+    """書き込まれたバイト列を溜めておき、drain() で取り出す（位置は累計で保持）"""
+
+    def __init__(self):
+        self._parts: list[bytes] = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        data = bytes(b)
+        self._parts.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def arrow_schema(table: str):
+    """
+    core/dialect.py のテーブル定義から Parquet のスキーマを作る。
+    チャンクの内容（全て NULL の列など）に左右されず、どのチャンクも同じ型で書ける。
+    """
+    import pyarrow as pa
+
+    types = {int: pa.int64(), float: pa.float64(), Decimal: pa.float64(), bool: pa.bool_(),
+             datetime: pa.timestamp("us"), date: pa.date32(), str: pa.string()}
+    fields = []
+    for col in TABLES[table].columns:
+        try:
+            python_type = col.type.python_type
+        except NotImplementedError:
+            python_type = str
+        fields.append(pa.field(col.name, types.get(python_type, pa.string()), nullable=col.nullable))
+    return pa.schema(fields)
+
+
+def iter_parquet_chunks(table: str, chunk_size: int = 50_000, max_rows: int | None = None) -> Iterator[bytes]:
+    """Parquet をチャンク（row group）ごとのバイト列で返す。連結すると1つの Parquet ファイルになる"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    _key_column(table)
+    sink = _ChunkSink()
+    writer = None
+    schema = arrow_schema(table)
+    try:
+        for df in iter_table_chunks(table, chunk_size, max_rows):
+            if writer is None:
+                writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema, compression="zstd")
+            writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        if writer is not None:
+            writer.close()
+    data = sink.drain()
+    if data:
+        yield data
+
+
+@db_origin("export")
+def export_table_to_file(table: str, path: str, fmt: str = "csv", chunk_size: int = 5000,
+                         max_rows: int | None = None) -> int:
+    """
+    テーブルを CSV / Parquet ファイルに書き出す。
+
+    Returns:
+        書き出したバイト数
+    """
+    if fmt == "csv":
+        chunks = iter_csv_chunks(table, chunk_size, max_rows)
+    elif fmt == "parquet":
+        chunks = iter_parquet_chunks(table, max(chunk_size, 10_000), max_rows)
+    else:
+        raise ValueError(f"未対応の形式です: {fmt}")
+    written = 0
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+            written += len(chunk)
+    return written
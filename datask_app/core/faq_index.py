@@ -0,0 +1,467 @@
+# =============================================================================
+# faq_index.py - FAQ のローカル検索インデックス（BM25 ＋ 任意でベクトル検索）
+# -----------------------------------------------------------------------------
+# FAQ 検索のたびに Azure AI Search へ HTTP で問い合わせる代わりに、
+# プロセス内のインデックスで検索します（Azure AI Search は同期先として任意）。
+#
+# 主な機能：
+# - 文字 n-gram（既定 1〜2 文字、nl_cache.normalize_question で正規化）による BM25
+# - 任意：埋め込みベクトル（AZURE_OPENAI_EMBEDDING_DEPLOYMENT を設定した場合）との
+#   ハイブリッド検索（BM25 とコサイン類似度の順位を Reciprocal Rank Fusion で統合）
+# - ディスクへの保存：転置インデックスを CSR 形式の .npy に書き、読み込み時は mmap で開く
+# - 差分更新：add / update / delete はメモリ上の差分に反映して即検索対象にし、
+#   save() で差分をまとめた新しい世代を書き出す（CURRENT の置き換えで切り替え）
+# - sync()：FAQ ファイル（data/faq.jsonl）と内容のハッシュを比べ、変わった文書だけ反映
+#
+# 保存形式（FAQ_INDEX_DIR 以下）：
+#   CURRENT              : 使用中の世代名
+#   gen-000001/meta.json : 文書ID・本文・ハッシュ・語彙・設定
+#   gen-000001/*.npy     : offsets / slots / tf / doc_len / embeddings
+#
+# 設定（secrets / 環境変数）：
+#   FAQ_DOCS_PATH                     : FAQ ファイル（JSONL、1行 {"id", "content"}。既定 data/faq.jsonl）
+#   FAQ_INDEX_DIR                     : インデックスの保存先（既定 一時ディレクトリの datask_faq_index）
+#   AZURE_OPENAI_EMBEDDING_DEPLOYMENT : 埋め込みモデルのデプロイ名（未設定なら BM25 のみ）
+#
+# コマンド（datask_app ディレクトリで実行）：
+#   python -m core.faq_index sync              # FAQ ファイルの変更をインデックスに反映して保存
+#   python -m core.faq_index sync --azure      # あわせて Azure AI Search にも反映
+#   python -m core.faq_index search "空いてる席"
+#   python -m core.faq_index stats
+# =============================================================================
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+import streamlit as st
+from core.config import secret
+from core.nl_cache import normalize_question
+
+FORMAT_VERSION = 1
+NGRAM_SIZES = (1, 2)
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+DEFAULT_DOCS_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "faq.jsonl")
+
+
+def char_ngrams(text: str, sizes: tuple[int, ...] = NGRAM_SIZES) -> Counter:
+    """正規化した文字列の文字 n-gram と出現回数"""
+    text = normalize_question(text)
+    grams = Counter()
+    for n in sizes:
+        grams.update(text[i:i + n] for i in range(len(text) - n + 1))
+    return grams
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+def read_faq_docs(path: str) -> list[dict]:
+    """FAQ ファイル（JSONL）を [{"id", "content"}] で読む"""
+    docs = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                doc = json.loads(line)
+                docs.append({"id": str(doc["id"]), "content": doc["content"]})
+    return docs
+
+
+class FaqIndex:
+    """
+    BM25 の転置インデックス。保存済みの部分（mmap の CSR 配列）と、
+    その後の追加分（dict）を合わせて検索する。削除は保存済みの部分ではスロットを無効にするだけ。
+    """
+
+    def __init__(self, sizes: tuple[int, ...] = NGRAM_SIZES, embedder=None):
+        self.sizes = tuple(sizes)
+        self.embedder = embedder
+        self._lock = threading.RLock()
+        # スロット（文書の通し番号）ごとの情報
+        self.ids: list[str] = []
+        self.contents: list[str] = []
+        self.hashes: list[str] = []
+        self.slot_of: dict[str, int] = {}
+        self.deleted: set[int] = set()
+        self.doc_len = np.zeros(0, dtype=np.float32)
+        # 保存済みの部分（CSR）
+        self.vocab: dict[str, int] = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.post_slots = np.zeros(0, dtype=np.int32)
+        self.post_tf = np.zeros(0, dtype=np.float32)
+        # 保存後の追加分：語 → {スロット: 出現回数}
+        self.delta: dict[str, dict[int, int]] = {}
+        self.df = Counter()
+        self.total_len = 0.0
+        # 埋め込み（正規化済み、スロット順）
+        self.base_vectors = None
+        self.delta_vectors: list = []
+        self.generation = 0
+        self.dirty = False
+
+    # ---------------------------------
+    # 更新
+    # ---------------------------------
+    def __len__(self) -> int:
+        return len(self.ids) - len(self.deleted)
+
+    def add(self, doc_id: str, content: str, vector=None):
+        """文書を追加する（同じ ID があれば置き換え）"""
+        with self._lock:
+            if doc_id in self.slot_of:
+                self.delete(doc_id)
+            slot = len(self.ids)
+            grams = char_ngrams(content, self.sizes)
+            self.ids.append(doc_id)
+            self.contents.append(content)
+            self.hashes.append(content_hash(content))
+            self.slot_of[doc_id] = slot
+            length = sum(grams.values())
+            self.doc_len = np.append(self.doc_len, np.float32(length))
+            self.total_len += length
+            for gram, tf in grams.items():
+                self.delta.setdefault(gram, {})[slot] = tf
+                self.df[gram] += 1
+            if vector is None and self.embedder is not None:
+                vector = self._embed([content])[0]
+            if self.embedder is not None or self.base_vectors is not None:
+                self.delta_vectors.append(vector)
+            self.dirty = True
+
+    def update(self, doc_id: str, content: str, vector=None):
+        self.add(doc_id, content, vector)
+
+    def delete(self, doc_id: str) -> bool:
+        with self._lock:
+            slot = self.slot_of.pop(doc_id, None)
+            if slot is None:
+                return False
+            self.deleted.add(slot)
+            grams = char_ngrams(self.contents[slot], self.sizes)
+            for gram in grams:
+                self.df[gram] -= 1
+            self.total_len -= float(self.doc_len[slot])
+            self.dirty = True
+            return True
+
+    def sync(self, docs: list[dict]) -> dict:
+        """
+        docs（[{"id", "content"}]）と同じ内容になるよう、変わった文書だけ反映する。
+
+        Returns:
+            {"added": [...], "updated": [...], "deleted": [...]}（文書ID）
+        """
+        with self._lock:
+            wanted = {d["id"]: d["content"] for d in docs}
+            changes = {"added": [], "updated": [], "deleted": []}
+            for doc_id in [i for i in self.slot_of if i not in wanted]:
+                self.delete(doc_id)
+                changes["deleted"].append(doc_id)
+            pending = []
+            for doc_id, content in wanted.items():
+                slot = self.slot_of.get(doc_id)
+                if slot is None:
+                    changes["added"].append(doc_id)
+                elif self.hashes[slot] != content_hash(content):
+                    changes["updated"].append(doc_id)
+                else:
+                    continue
+                pending.append((doc_id, content))
+            vectors = self._embed([c for _, c in pending]) if pending else None
+            for i, (doc_id, content) in enumerate(pending):
+                self.add(doc_id, content, None if vectors is None else vectors[i])
+            return changes
+
+    def _embed(self, texts: list[str]):
+        if self.embedder is None:
+            return None
+        vectors = np.asarray(self.embedder(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    # ---------------------------------
+    # 検索
+    # ---------------------------------
+    def bm25_scores(self, query: str) -> np.ndarray:
+        """全スロットの BM25 スコア（削除済みは -inf）"""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        n = len(self)
+        if n == 0:
+            return scores
+        avgdl = self.total_len / n or 1.0
+        for gram, qtf in char_ngrams(query, self.sizes).items():
+            df = self.df.get(gram, 0)
+            if df <= 0:
+                continue
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            term = self.vocab.get(gram)
+            if term is not None:
+                start, end = self.offsets[term], self.offsets[term + 1]
+                slots = self.post_slots[start:end]
+                tf = self.post_tf[start:end]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[slots] / avgdl)
+                scores[slots] += qtf * idf * tf * (BM25_K1 + 1) / (tf + norm)
+            for slot, tf in self.delta.get(gram, {}).items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[slot] / avgdl)
+                scores[slot] += qtf * idf * tf * (BM25_K1 + 1) / (tf + norm)
+        if self.deleted:
+            scores[list(self.deleted)] = -np.inf
+        return scores
+
+    def vector_scores(self, query: str) -> np.ndarray | None:
+        """全スロットのコサイン類似度（埋め込みがなければ None）"""
+        if self.embedder is None:
+            return None
+        matrix = self._vectors()
+        if matrix is None:
+            return None
+        scores = matrix @ self._embed([query])[0]
+        if self.deleted:
+            scores[list(self.deleted)] = -np.inf
+        return scores
+
+    def _vectors(self) -> np.ndarray | None:
+        rows = []
+        if self.base_vectors is not None:
+            rows.append(np.asarray(self.base_vectors))
+        delta = [v for v in self.delta_vectors if v is not None]
+        if len(delta) != len(self.delta_vectors) or (self.base_vectors is None and not delta):
+            return None  # 埋め込みのない文書がある
+        if delta:
+            rows.append(np.vstack(delta))
+        return np.vstack(rows) if len(rows) > 1 else rows[0]
+
+    def search(self, query: str, top_k: int = 3, mode: str = "auto") -> list[dict]:
+        """
+        上位 top_k 件を [{"id", "content", "score"}] で返す（スコアが 0 以下の文書は返さない）。
+        mode: "bm25" / "hybrid" / "auto"（埋め込みがあれば hybrid）
+        """
+        with self._lock:
+            scores = self.bm25_scores(query)
+            vector = self.vector_scores(query) if mode in ("auto", "hybrid") else None
+            if vector is not None:
+                # 順位の逆数で統合（BM25 で 1 語も一致しない文書もベクトル側で拾う）
+                fused = np.zeros(len(scores), dtype=np.float32)
+                for ranked in (scores, vector):
+                    order = np.argsort(-ranked, kind="stable")
+                    fused[order] += 1.0 / (RRF_K + np.arange(1, len(order) + 1))
+                fused[~np.isfinite(vector)] = -np.inf
+                scores = fused
+            k = min(top_k, len(scores))
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [
+                {"id": self.ids[s], "content": self.contents[s], "score": float(scores[s])}
+                for s in top if scores[s] > 0
+            ]
+
+    # ---------------------------------
+    # 保存・読み込み
+    # ---------------------------------
+    def _build(self) -> dict:
+        """有効な文書だけで CSR の配列を作り直す"""
+        live = [s for s in range(len(self.ids)) if s not in self.deleted]
+        postings: dict[str, list[tuple[int, int]]] = {}
+        lengths = np.zeros(len(live), dtype=np.float32)
+        for new_slot, slot in enumerate(live):
+            grams = char_ngrams(self.contents[slot], self.sizes)
+            lengths[new_slot] = sum(grams.values())
+            for gram, tf in grams.items():
+                postings.setdefault(gram, []).append((new_slot, tf))
+        vocab = sorted(postings)
+        counts = np.array([len(postings[g]) for g in vocab], dtype=np.int64)
+        pairs = [p for g in vocab for p in postings[g]]
+        vectors = self._vectors()
+        return {
+            "ids": [self.ids[s] for s in live],
+            "contents": [self.contents[s] for s in live],
+            "hashes": [self.hashes[s] for s in live],
+            "vocab": vocab,
+            "offsets": np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            "slots": np.array([p[0] for p in pairs], dtype=np.int32),
+            "tf": np.array([p[1] for p in pairs], dtype=np.float32),
+            "doc_len": lengths,
+            "embeddings": None if vectors is None else vectors[live].astype(np.float32),
+        }
+
+    def _adopt(self, built: dict, base_vectors=None):
+        """作り直した配列に切り替え、メモリ上の差分と削除済みのスロットを捨てる"""
+        self.ids, self.contents, self.hashes = built["ids"], built["contents"], built["hashes"]
+        self.slot_of = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        self.deleted = set()
+        self.vocab = {gram: i for i, gram in enumerate(built["vocab"])}
+        self.offsets, self.post_slots, self.post_tf = built["offsets"], built["slots"], built["tf"]
+        self.doc_len = np.array(built["doc_len"], dtype=np.float32)
+        self.total_len = float(self.doc_len.sum())
+        self.df = Counter(dict(zip(built["vocab"], np.diff(self.offsets).tolist())))
+        self.delta = {}
+        self.base_vectors = base_vectors
+        self.delta_vectors = []
+
+    def compact(self):
+        """保存せずに、メモリ上の差分を CSR にまとめる（追加が続く用途向け）"""
+        with self._lock:
+            built = self._build()
+            self._adopt(built, built["embeddings"])
+
+    def save(self, root: str):
+        """有効な文書だけで CSR を作り直し、新しい世代として書き出す"""
+        with self._lock:
+            built = self._build()
+            generation = self.generation + 1
+            name = f"gen-{generation:06d}"
+            directory = os.path.join(root, name)
+            os.makedirs(directory, exist_ok=True)
+            for key in ("offsets", "slots", "tf", "doc_len"):
+                np.save(os.path.join(directory, f"{key}.npy"), built[key])
+            if built["embeddings"] is not None:
+                np.save(os.path.join(directory, "embeddings.npy"), built["embeddings"])
+            meta = {
+                "version": FORMAT_VERSION,
+                "sizes": list(self.sizes),
+                **{key: built[key] for key in ("ids", "contents", "hashes", "vocab")},
+                "saved_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+
+            # CURRENT を置き換えて切り替え、古い世代を消す
+            tmp = os.path.join(root, "CURRENT.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(name)
+            os.replace(tmp, os.path.join(root, "CURRENT"))
+            for old in os.listdir(root):
+                if old.startswith("gen-") and old != name:
+                    shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+            # 書き出した世代（mmap）に切り替え、メモリ上の差分を捨てる
+            saved = FaqIndex.load(root, self.embedder)
+            for key, value in vars(saved).items():
+                if key != "_lock":
+                    setattr(self, key, value)
+
+    @classmethod
+    def load(cls, root: str, embedder=None) -> "FaqIndex":
+        """保存済みの世代を読み込む（配列は mmap で開く）。なければ空のインデックス"""
+        current = os.path.join(root, "CURRENT")
+        if not os.path.exists(current):
+            return cls(embedder=embedder)
+        with open(current, encoding="utf-8") as f:
+            name = f.read().strip()
+        directory = os.path.join(root, name)
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != FORMAT_VERSION:
+            return cls(embedder=embedder)
+
+        index = cls(tuple(meta["sizes"]), embedder)
+        index.generation = int(name.split("-")[1])
+        built = {key: meta[key] for key in ("ids", "contents", "hashes", "vocab")}
+        for key in ("offsets", "slots", "tf", "doc_len"):
+            built[key] = np.load(os.path.join(directory, f"{key}.npy"), mmap_mode="r")
+        vectors_path = os.path.join(directory, "embeddings.npy")
+        # 文書長だけは追加で伸ばすため _adopt() でメモリにコピーされる
+        index._adopt(built, np.load(vectors_path, mmap_mode="r") if os.path.exists(vectors_path) else None)
+        return index
+
+    def stats(self) -> dict:
+        return {
+            "documents": len(self),
+            "slots": len(self.ids),
+            "deleted": len(self.deleted),
+            "terms": sum(1 for v in self.df.values() if v > 0),
+            "delta_terms": len(self.delta),
+            "embeddings": self._vectors() is not None,
+            "generation": self.generation,
+            "dirty": self.dirty,
+        }
+
+
+# -------------------------------
+# 埋め込み（任意）
+# -------------------------------
+def azure_embedder():
+    """AZURE_OPENAI_EMBEDDING_DEPLOYMENT があれば埋め込み関数、なければ None"""
+    deployment = secret("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+    if not deployment:
+        return None
+    from core.llm_backend import AzureOpenAIBackend
+
+    backend = AzureOpenAIBackend(timeout=float(secret("AZURE_OPENAI_TIMEOUT", "30")))
+
+    def embed(texts: list[str]) -> list[list[float]]:
+        rsp = backend.client.embeddings.create(model=deployment, input=texts)
+        return [item.embedding for item in rsp.data]
+
+    return embed
+
+
+def index_dir() -> str:
+    return secret("FAQ_INDEX_DIR") or os.path.join(tempfile.gettempdir(), "datask_faq_index")
+
+
+def load_synced_index(embedder=None) -> tuple[FaqIndex, dict]:
+    """保存済みのインデックスを読み、FAQ ファイルの変更を反映する（変更があれば保存）"""
+    root = index_dir()
+    index = FaqIndex.load(root, embedder)
+    changes = index.sync(read_faq_docs(secret("FAQ_DOCS_PATH", DEFAULT_DOCS_PATH)))
+    if index.dirty:
+        os.makedirs(root, exist_ok=True)
+        index.save(root)
+    return index, changes
+
+
+@st.cache_resource
+def get_faq_index() -> FaqIndex:
+    """FAQ インデックス（全セッション共有。初回に FAQ ファイルと同期）"""
+    return load_synced_index(azure_embedder())[0]
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="FAQ のローカル検索インデックス")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sync = sub.add_parser("sync", help="FAQ ファイルの変更を反映して保存")
+    sync.add_argument("--azure", action="store_true", help="Azure AI Search にも反映")
+    search = sub.add_parser("search", help="検索")
+    search.add_argument("query")
+    search.add_argument("--top", type=int, default=3)
+    search.add_argument("--mode", choices=("auto", "bm25", "hybrid"), default="auto")
+    sub.add_parser("stats", help="インデックスの状態")
+    args = parser.parse_args(argv)
+
+    index, changes = load_synced_index(azure_embedder())
+    if args.command == "sync":
+        print({k: len(v) for k, v in changes.items()}, index.stats())
+        if args.azure:
+            from tools.upload_faq import upload_faq
+
+            docs = [{"id": i, "content": index.contents[index.slot_of[i]]} for i in index.slot_of]
+            ok, message = upload_faq(docs, deleted_ids=changes["deleted"])
+            print(message)
+            return 0 if ok else 1
+    elif args.command == "search":
+        started = time.perf_counter()
+        hits = index.search(args.query, args.top, args.mode)
+        elapsed = (time.perf_counter() - started) * 1000
+        for hit in hits:
+            print(f"{hit['score']:8.4f}  [{hit['id']}] {hit['content']}")
+        print(f"{len(hits)} 件（{elapsed:.3f} ms）")
+    else:
+        print(json.dumps(index.stats(), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
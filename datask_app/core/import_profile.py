@@ -0,0 +1,162 @@
+# =============================================================================
+# import_profile.py - 起動時の import 時間の計測
+# -----------------------------------------------------------------------------
+# コールドスタートでどのモジュールの import に時間がかかっているかを調べます。
+# sys.meta_path の先頭にローダーを包む finder を入れ、モジュールごとに
+# 累計時間（子の import を含む）と自身の時間（子を除く）を記録します。
+#
+# 使い方：
+# - アプリ：環境変数 DATASK_PROFILE_IMPORTS=1 で streamlit run すると、
+#   app.py の import を計測して標準エラーに上位を出力し、サイドバーにも表示
+# - コマンド（datask_app ディレクトリで実行）：app.py が import するモジュールを計測
+#     python -m core.import_profile --top 30
+#
+# streamlit 本体は app.py の実行前に読み込まれるため計測に含まれません
+# （表示されるのはアプリ側で増える分だけです）。
+# 設定は secrets ではなく環境変数で読みます（secrets の読み込み前に計測を始めるため）。
+# =============================================================================
+
+import argparse
+import ast
+import importlib
+import os
+import sys
+import time
+
+_timings: dict[str, dict] = {}
+_stack: list[float] = []
+_finder = None
+
+
+class _TimedLoader:
+    """元のローダーに委譲し、モジュールの生成・実行にかかった時間を記録する"""
+
+    def __init__(self, loader, name: str):
+        self.loader = loader
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(self.loader, attr)
+
+    def _timed(self, fn, module_or_spec):
+        started = time.perf_counter()
+        _stack.append(0.0)
+        try:
+            return fn(module_or_spec)
+        finally:
+            elapsed = time.perf_counter() - started
+            children = _stack.pop()
+            if _stack:
+                _stack[-1] += elapsed
+            entry = _timings.setdefault(self.name, {"cumulative": 0.0, "self": 0.0})
+            entry["cumulative"] += elapsed
+            entry["self"] += elapsed - children
+
+    def create_module(self, spec):
+        return self._timed(self.loader.create_module, spec)
+
+    def exec_module(self, module):
+        # 読み込み後のモジュールからは元のローダーが見えるように戻しておく
+        module.__loader__ = self.loader
+        if getattr(module, "__spec__", None) is not None:
+            module.__spec__.loader = self.loader
+        return self._timed(self.loader.exec_module, module)
+
+
+class _TimingFinder:
+    """後ろの finder で見つけた spec のローダーを _TimedLoader で包む"""
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, name)
+                return spec
+        return None
+
+
+def enabled() -> bool:
+    return os.getenv("DATASK_PROFILE_IMPORTS", "").lower() in ("1", "true", "yes")
+
+
+def start(force: bool = False) -> bool:
+    """
+    計測を始める。DATASK_PROFILE_IMPORTS が無効な場合と、計測済みの場合
+    （Streamlit の再実行ではモジュールが読み込み済みのため）は何もしない。
+    """
+    global _finder
+    if _finder is not None or not (force or (enabled() and not _timings)):
+        return False
+    _timings.clear()
+    _finder = _TimingFinder()
+    sys.meta_path.insert(0, _finder)
+    return True
+
+
+def stop() -> list[dict]:
+    """計測を止めて、累計時間の長い順の結果を返す"""
+    global _finder
+    if _finder is not None:
+        sys.meta_path.remove(_finder)
+        _finder = None
+    return report()
+
+
+def active() -> bool:
+    return _finder is not None
+
+
+def report(top: int | None = None) -> list[dict]:
+    rows = [
+        {"module": name, "cumulative_ms": round(t["cumulative"] * 1000, 2), "self_ms": round(t["self"] * 1000, 2)}
+        for name, t in _timings.items()
+    ]
+    rows.sort(key=lambda r: r["cumulative_ms"], reverse=True)
+    return rows[:top] if top else rows
+
+
+def format_report(rows: list[dict]) -> str:
+    lines = [f"{'cumulative ms':>14} {'self ms':>10}  module"]
+    lines += [f"{r['cumulative_ms']:>14.1f} {r['self_ms']:>10.1f}  {r['module']}" for r in rows]
+    return "\n".join(lines)
+
+
+def app_imports(path: str) -> list[str]:
+    """app.py のトップレベルの import 文からモジュール名を集める"""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.append(node.module)
+    return list(dict.fromkeys(m for m in modules if m != __name__))
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="app.py が import するモジュールの読み込み時間を計測")
+    parser.add_argument("--app", default=os.path.join(os.path.dirname(__file__), "..", "app.py"))
+    parser.add_argument("--top", type=int, default=30)
+    parser.add_argument("--include-streamlit", action="store_true",
+                        help="streamlit 本体の読み込みも計測に含める（既定は先に読み込んでおく）")
+    args = parser.parse_args(argv)
+
+    modules = app_imports(args.app)
+    if not args.include_streamlit:
+        importlib.import_module("streamlit")
+    start(force=True)
+    started = time.perf_counter()
+    for name in modules:
+        importlib.import_module(name)
+    wall = (time.perf_counter() - started) * 1000
+    rows = stop()
+    print(format_report(rows[:args.top]))
+    print(f"\n{len(rows)} modules, {wall:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
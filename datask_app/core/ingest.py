@@ -0,0 +1,254 @@
+# =============================================================================
+# ingest.py - SeatLog / Seat / Employee の一括取り込み
+# -----------------------------------------------------------------------------
+# 1行ずつ INSERT するとデータ量に比例して往復が増えるため、chunk_size 行ごとに
+# 一時テーブル（SQL Server では #IngestStage）へ executemany（pyodbc の fast_executemany）で
+# 送り、1文の INSERT ... SELECT で本テーブルへ反映します。
+# 文は SQLAlchemy Core で組み立てるため、SQLite / DuckDB にも取り込めます。
+#
+# 主な機能：
+# - 入力：DataFrame / CSVファイル / dict のイテレーター（チェックインのイベントなど）
+# - 自然キーで重複を除外
+#     SeatLog  : (SeatId, EmpCode, CheckIn)
+#     Seat     : Label
+#     Employee : EmpCode
+#   チャンク内の重複は後勝ち、既にテーブルにある行はスキップ
+#   （on_conflict="update" ならキー以外の列を更新。例：後から届いた CheckOut）
+# - 既存の行との突き合わせ（NOT EXISTS / UPDATE の結合）が自然キーのシークになるよう、
+#   自然キーのインデックスを確認し、なければ作成（ensure_key_index）
+#   本番のテーブルにインデックスを作るのは DDL のため、明示したときだけ行う
+#   （ensure_index=True / コマンドの --create-index。既定では作らない）
+#     SeatLog : IX_SeatLog_NaturalKey (EmpCode, CheckIn, SeatId)
+#     Seat    : IX_Seat_Label (Label)
+#   先頭の列が自然キーの列だけのインデックス・主キーがあれば作らない（Employee は主キー）
+# - チャンクごとに別トランザクション（大量でもロックを長く持たない）
+# - 件数・所要時間・rows/s を返す
+#
+# コマンド（datask_app ディレクトリで実行）：
+#   python -m core.ingest SeatLog seatlog.csv --chunk-size 10000
+#   python -m core.ingest Employee employees.csv --on-conflict update
+#   python -m core.ingest SeatLog seatlog.csv --create-index   # 先に自然キーのインデックスを作成
+# =============================================================================
+
+import argparse
+import os
+import time
+from collections.abc import Iterable, Iterator
+
+import pandas as pd
+import sqlalchemy as sa
+from core.dialect import TABLES as SCHEMA_TABLES
+from core.metrics import db_origin
+
+# テーブル名 → 取り込む列・自然キー（列の型は core/dialect.py のテーブル定義に従う）
+TABLES = {
+    "SeatLog": {
+        "columns": ["SeatId", "EmpCode", "CheckIn", "CheckOut"],
+        "key": ["SeatId", "EmpCode", "CheckIn"],
+        "datetime": ["CheckIn", "CheckOut"],
+        # 社員ごとの検索（EmpCode, CheckIn）にも使えるよう EmpCode を先頭にする
+        "index": ("IX_SeatLog_NaturalKey", ["EmpCode", "CheckIn", "SeatId"]),
+    },
+    "Seat": {
+        "columns": ["Label", "Area", "SeatType"],
+        "key": ["Label"],
+        "datetime": [],
+        "index": ("IX_Seat_Label", ["Label"]),
+    },
+    "Employee": {
+        "columns": ["EmpCode", "Name", "Dept"],
+        "key": ["EmpCode"],
+        "datetime": [],
+    },
+}
+
+
+def _spec(table: str) -> dict:
+    if table not in TABLES:
+        raise ValueError(f"取り込みできないテーブルです: {table}")
+    return TABLES[table]
+
+
+def iter_frames(source, chunk_size: int = 5000) -> Iterator[pd.DataFrame]:
+    """DataFrame / CSVファイルのパス / dict のイテレーターを chunk_size 行ずつの DataFrame にする"""
+    if isinstance(source, pd.DataFrame):
+        for start in range(0, len(source), chunk_size):
+            yield source.iloc[start:start + chunk_size]
+    elif isinstance(source, (str, os.PathLike)):
+        yield from pd.read_csv(source, chunksize=chunk_size)
+    elif isinstance(source, Iterable):
+        batch = []
+        for record in source:
+            batch.append(record)
+            if len(batch) >= chunk_size:
+                yield pd.DataFrame.from_records(batch)
+                batch = []
+        if batch:
+            yield pd.DataFrame.from_records(batch)
+    else:
+        raise TypeError(f"未対応の入力です: {type(source).__name__}")
+
+
+def prepare_frame(table: str, df: pd.DataFrame) -> tuple[pd.DataFrame, int]:
+    """
+    取り込む列だけに絞って型を揃え、自然キーの重複を除く（後勝ち）。
+
+    Returns:
+        (整形後の DataFrame, 除外した重複件数)
+    """
+    spec = _spec(table)
+    missing = [c for c in spec["key"] if c not in df.columns]
+    if missing:
+        raise ValueError(f"{table} に必要な列がありません: {', '.join(missing)}")
+    df = df.reindex(columns=spec["columns"])
+    for col in spec["datetime"]:
+        df[col] = pd.to_datetime(df[col])
+    df = df.dropna(subset=spec["key"])
+    before = len(df)
+    df = df.drop_duplicates(subset=spec["key"], keep="last")
+    return df, before - len(df)
+
+
+def _records(df: pd.DataFrame) -> list[dict]:
+    """executemany 用に Python の値（NaN/NaT は None、日時は datetime）の dict リストへ変換"""
+    columns = []
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            values = [None if pd.isna(v) else v.to_pydatetime() for v in df[col]]
+        else:
+            values = [None if pd.isna(v) else v for v in df[col].astype(object)]
+        columns.append(values)
+    return [dict(zip(df.columns, row)) for row in zip(*columns)]
+
+
+def ensure_key_index(engine, table: str) -> str | None:
+    """
+    自然キーで突き合わせるためのインデックスがなければ作成する。
+
+    Returns:
+        作成したインデックス名（既にあれば None）
+    """
+    spec = _spec(table)
+    if "index" not in spec:
+        return None
+    name, columns = spec["index"]
+    key = set(spec["key"])
+    leading = min(2, len(key))
+    with engine.connect() as conn:
+        inspector = sa.inspect(conn)
+        existing = [ix["column_names"] for ix in inspector.get_indexes(table)]
+        existing.append(inspector.get_pk_constraint(table)["constrained_columns"])
+    # 先頭の列（2列まで）がすべて自然キーの列なら、突き合わせはそのインデックスでシークできる
+    if any(len(cols) >= leading and set(cols[:leading]) <= key for cols in existing):
+        return None
+    target = SCHEMA_TABLES[table]
+    with engine.begin() as conn:
+        sa.Index(name, *[target.c[c] for c in columns]).create(conn, checkfirst=True)
+    return name
+
+
+def _statements(table: str, on_conflict: str, dialect: str) -> dict:
+    """一時テーブルと、取り込みに使う文（接続先の方言でコンパイルされる）"""
+    spec = _spec(table)
+    target = SCHEMA_TABLES[table]
+    cols = spec["columns"]
+    # SQL Server は #名前 が一時テーブル、それ以外は CREATE TEMPORARY TABLE
+    stage = sa.Table(
+        "#IngestStage" if dialect == "mssql" else "IngestStage",
+        sa.MetaData(),
+        *[sa.Column(c, target.c[c].type, nullable=c not in spec["key"]) for c in cols],
+        prefixes=[] if dialect == "mssql" else ["TEMPORARY"],
+    )
+    match = sa.and_(*[target.c[k] == stage.c[k] for k in spec["key"]])
+    statements = {
+        "table": stage,
+        "insert": target.insert().from_select(
+            cols, sa.select(*[stage.c[c] for c in cols]).where(~sa.exists().where(match))
+        ),
+        "truncate": sa.text("TRUNCATE TABLE #IngestStage") if dialect == "mssql" else stage.delete(),
+    }
+    others = [c for c in cols if c not in spec["key"]]
+    if on_conflict == "update" and others:
+        statements["update"] = sa.update(target).values({c: stage.c[c] for c in others}).where(match)
+    return statements
+
+
+@db_origin("ingest")
+def ingest(engine, table: str, source, chunk_size: int = 5000, on_conflict: str = "skip",
+           progress=None, ensure_index: bool = False) -> dict:
+    """
+    source を table に一括で取り込む。
+
+    Args:
+        source: DataFrame / CSVファイルのパス / dict のイテレーター
+        on_conflict: 既にある行（自然キーが一致）を "skip"（既定）か "update" する
+        progress: チャンクごとに途中経過の dict を受け取る関数（任意）
+        ensure_index: 自然キーのインデックスがなければ作成する（ensure_key_index、既定は作らない）
+
+    Returns:
+        {"table", "received", "duplicates", "inserted", "updated", "existing",
+         "chunks", "seconds", "rows_per_sec", "index_created"}
+    """
+    if on_conflict not in ("skip", "update"):
+        raise ValueError(f"on_conflict は skip / update のいずれかです: {on_conflict}")
+    sql = _statements(table, on_conflict, engine.dialect.name)
+    stage = sql["table"]
+    report = {"table": table, "received": 0, "duplicates": 0, "inserted": 0, "updated": 0,
+              "existing": 0, "chunks": 0, "seconds": 0.0, "rows_per_sec": 0.0, "index_created": None}
+    if ensure_index:
+        report["index_created"] = ensure_key_index(engine, table)
+    started = time.perf_counter()
+
+    with engine.connect() as conn:
+        with conn.begin():
+            stage.create(conn)
+        try:
+            for frame in iter_frames(source, chunk_size):
+                df, duplicates = prepare_frame(table, frame)
+                report["received"] += len(frame)
+                report["duplicates"] += duplicates
+                if not df.empty:
+                    with conn.begin():
+                        conn.execute(stage.insert(), _records(df))
+                        if "update" in sql:
+                            report["updated"] += conn.execute(sql["update"]).rowcount
+                        inserted = conn.execute(sql["insert"]).rowcount
+                        conn.execute(sql["truncate"])
+                    report["inserted"] += inserted
+                    if "update" not in sql:
+                        report["existing"] += len(df) - inserted
+                report["chunks"] += 1
+                elapsed = time.perf_counter() - started
+                report["seconds"] = round(elapsed, 3)
+                report["rows_per_sec"] = round(report["received"] / elapsed, 1) if elapsed else 0.0
+                if progress is not None:
+                    progress(dict(report))
+        finally:
+            with conn.begin():
+                stage.drop(conn)
+    return report
+
+
+def main(argv: list[str] | None = None):
+    from core.db import get_engine
+
+    parser = argparse.ArgumentParser(description="CSV を Seat / Employee / SeatLog に一括で取り込む")
+    parser.add_argument("table", choices=list(TABLES))
+    parser.add_argument("csv", help="取り込む CSV ファイル（ヘッダーに列名）")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--on-conflict", choices=["skip", "update"], default="skip")
+    parser.add_argument("--create-index", action="store_true", help="自然キーのインデックスがなければ作成する")
+    args = parser.parse_args(argv)
+    engine = get_engine()
+
+    report = ingest(
+        engine, args.table, args.csv, chunk_size=args.chunk_size, on_conflict=args.on_conflict,
+        ensure_index=args.create_index,
+        progress=lambda r: print(f"  {r['received']:,} 行 / {r['rows_per_sec']:,.0f} rows/s"),
+    )
+    print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,199 @@
+# =============================================================================
+# llm_async.py - LLM 呼び出しの非同期ゲートウェイ
+# -----------------------------------------------------------------------------
+# Streamlit のスクリプト実行が遅い補完に巻き込まれないよう、LLM 呼び出しを
+# 専用スレッド上の asyncio イベントループに集約して実行します。
+#
+# 主な機能：
+# - リクエストごとのタイムアウト（asyncio.wait_for）
+# - 429 / 5xx / タイムアウト / 接続エラー時のジッター付き指数バックオフ
+#   （Retry-After / retry-after-ms ヘッダーがあればそれを優先）
+# - セマフォによる同時実行数の上限（全セッション共通）
+# - 同じ質問が同時に来た場合は1回の補完を共有（リクエスト合流）
+# - 主バックエンドがリトライし尽くしても失敗したら副バックエンド（DATASK_LLM_FALLBACK）で応答
+#   （リトライの外側で切り替え、副バックエンドには別に LLM_TIMEOUT 秒を割り当てる）
+#
+# 使用例：
+#   gateway = get_llm_gateway()
+#   reply = gateway.complete_sync(key, messages, functions)      # 同期コードから
+#   reply = await gateway.complete(key, messages, functions)     # 非同期コードから
+#
+# 設定（secrets / 環境変数）：
+#   LLM_MAX_CONCURRENCY : 同時に実行する補完の上限（既定 8）
+#   LLM_TIMEOUT         : 1回の補完のタイムアウト秒（既定 30）
+#   LLM_MAX_RETRIES     : リトライ回数（既定 3）
+#   LLM_RETRY_BASE      : バックオフの初期待ち秒（既定 0.5）
+#   LLM_RETRY_MAX       : バックオフの最大待ち秒（既定 8）
+# =============================================================================
+
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from email.utils import parsedate_to_datetime
+
+import streamlit as st
+from core.config import secret
+from core.llm_backend import (
+    LLMBackend, LLMReply, build_fallback_backend, get_llm_backend, is_retryable,
+)
+
+
+def retry_after_seconds(exc: Exception) -> float | None:
+    """レスポンスヘッダーの Retry-After（秒 or HTTP日付）/ retry-after-ms を読む"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class LLMGateway:
+    """
+    LLM バックエンドへの呼び出しを1つのイベントループで管理するゲートウェイ。
+
+    セマフォ・合流用の辞書はすべて専用ループ上でのみ触るため、
+    Streamlit の複数セッション（スレッド）から同時に呼び出しても安全。
+    """
+
+    def __init__(self, backend: LLMBackend, max_concurrency: int = 8, timeout: float = 30.0,
+                 max_retries: int = 3, retry_base: float = 0.5, retry_max: float = 8.0,
+                 fallback: LLMBackend | None = None):
+        self.backend = backend
+        self.fallback = fallback
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.stats_counter = {
+            "requests": 0,
+            "coalesced": 0,
+            "completions": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "failures": 0,
+            "fallbacks": 0,
+            "in_flight": 0,
+        }
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._semaphore: asyncio.Semaphore | None = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="llm-gateway", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._loop.run_forever()
+
+    @property
+    def deadline(self) -> float:
+        """リトライ（と副バックエンド）を含めた最大待ち時間の目安"""
+        primary = (self.timeout + self.retry_max) * (self.max_retries + 1)
+        return primary + (self.timeout if self.fallback is not None else 0)
+
+    # ---------------------------------
+    # 公開 API
+    # ---------------------------------
+    def complete_sync(self, key: str, messages: list[dict], functions: list[dict]) -> LLMReply:
+        """同期コード（Streamlit スクリプト）から呼び出す"""
+        fut = asyncio.run_coroutine_threadsafe(self._complete_or_fallback(key, messages, functions), self._loop)
+        try:
+            return fut.result(timeout=self.deadline)
+        except FutureTimeoutError:
+            fut.cancel()
+            raise TimeoutError("LLM の応答がタイムアウトしました。")
+
+    async def complete(self, key: str, messages: list[dict], functions: list[dict]) -> LLMReply:
+        """任意のイベントループから await で呼び出す"""
+        fut = asyncio.run_coroutine_threadsafe(self._complete_or_fallback(key, messages, functions), self._loop)
+        return await asyncio.wrap_future(fut)
+
+    def stats(self) -> dict:
+        return {**self.stats_counter, "max_concurrency": self.max_concurrency}
+
+    # ---------------------------------
+    # ゲートウェイ内部（専用ループ上で実行）
+    # ---------------------------------
+    async def _complete_or_fallback(self, key: str, messages: list[dict], functions: list[dict]) -> LLMReply:
+        """主バックエンド（合流・リトライ込み）が失敗したら副バックエンドで応答する"""
+        try:
+            return await self._complete(key, messages, functions)
+        except Exception:
+            if self.fallback is None:
+                raise
+        self.stats_counter["fallbacks"] += 1
+        reply = await asyncio.wait_for(self.fallback.acomplete(messages, functions), timeout=self.timeout)
+        reply.fallback = True
+        return reply
+
+    async def _complete(self, key: str, messages: list[dict], functions: list[dict]) -> LLMReply:
+        self.stats_counter["requests"] += 1
+        shared = self._inflight.get(key)
+        if shared is not None:
+            self.stats_counter["coalesced"] += 1
+            return await asyncio.shield(shared)
+
+        task = asyncio.ensure_future(self._complete_with_retries(messages, functions))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _complete_with_retries(self, messages: list[dict], functions: list[dict]) -> LLMReply:
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    self.stats_counter["in_flight"] += 1
+                    try:
+                        reply = await asyncio.wait_for(
+                            self.backend.acomplete(messages, functions), timeout=self.timeout
+                        )
+                    finally:
+                        self.stats_counter["in_flight"] -= 1
+                self.stats_counter["completions"] += 1
+                return reply
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self.stats_counter["timeouts"] += 1
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self.stats_counter["failures"] += 1
+                    raise
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    # フルジッター付き指数バックオフ
+                    delay = random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))
+                attempt += 1
+                self.stats_counter["retries"] += 1
+                await asyncio.sleep(min(delay, self.retry_max))
+
+
+@st.cache_resource
+def get_llm_gateway() -> LLMGateway:
+    """全セッションで共有するゲートウェイ"""
+    return LLMGateway(
+        get_llm_backend(),
+        max_concurrency=int(secret("LLM_MAX_CONCURRENCY", "8")),
+        timeout=float(secret("LLM_TIMEOUT", "30")),
+        max_retries=int(secret("LLM_MAX_RETRIES", "3")),
+        retry_base=float(secret("LLM_RETRY_BASE", "0.5")),
+        retry_max=float(secret("LLM_RETRY_MAX", "8")),
+        fallback=build_fallback_backend(),
+    )
@@ -0,0 +1,370 @@
+# =============================================================================
+# llm_backend.py - 質問判定に使う LLM バックエンドの切り替え
+# -----------------------------------------------------------------------------
+# generate_semantic_sql() は Function Calling の結果（関数名＋引数 or 通常応答）
+# だけを必要とするため、その呼び出し部分をバックエンドとして差し替え可能にします。
+#
+# 提供バックエンド：
+# - AzureOpenAIBackend : Azure OpenAI（本番用、クライアントは初回呼び出し時に生成）
+# - LocalRuleBackend   : 正規表現による意図判定＋定型SQLテンプレート（ネットワーク不要）
+#                        記録済みレスポンス（JSONL）の再生と疑似レイテンシにも対応
+# - RecordingBackend   : 別バックエンドの応答を JSONL に記録（再生用フィクスチャ作成）
+#
+# 各バックエンドは同期版 complete() と非同期版 acomplete() を持ちます。
+# 非同期版のタイムアウト・リトライ・同時実行数制御は core/llm_async.py が行います。
+# 副バックエンド（build_fallback_backend）への切り替えも、リトライし尽くした後に
+# ゲートウェイが行います（応答には fallback=True が付き、判定結果のキャッシュには保存しない）。
+#
+# 設定（secrets / 環境変数）：
+#   DATASK_LLM_BACKEND    : "azure"（既定） / "local"
+#   DATASK_LLM_FALLBACK   : "local" を指定すると Azure がリトライしても失敗したときにローカル判定で応答
+#   LLM_FIXTURES_PATH     : LocalRuleBackend が再生する JSONL
+#   LLM_LOCAL_LATENCY_MS  : LocalRuleBackend の疑似レイテンシ（ミリ秒）
+#   LLM_RECORD_PATH       : 指定すると応答を JSONL に追記記録
+#   AZURE_OPENAI_TIMEOUT  : Azure 呼び出しのタイムアウト秒（既定 30）
+# =============================================================================
+
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+
+import streamlit as st
+from core.config import secret
+from core.nl_cache import normalize_question
+
+
+class LLMReply:
+    """
+    Function Calling の応答を表す共通形式。
+
+    - function_name / arguments : 関数呼び出しされた場合
+    - content                   : 通常のメッセージ応答の場合
+    - usage                     : トークン使用量（取得できた場合）
+    - fallback                  : 副バックエンド（build_fallback_backend）の応答なら True
+    """
+
+    def __init__(self, function_name: str | None = None, arguments: dict | None = None,
+                 content: str | None = None, usage: dict | None = None, fallback: bool = False):
+        self.function_name = function_name
+        self.arguments = arguments or {}
+        self.content = content
+        self.usage = usage or {}
+        self.fallback = fallback
+
+    def to_dict(self) -> dict:
+        if self.function_name:
+            return {"function_call": {"name": self.function_name, "arguments": self.arguments}}
+        return {"content": self.content}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LLMReply":
+        call = data.get("function_call")
+        if call:
+            args = call.get("arguments") or {}
+            if isinstance(args, str):
+                args = json.loads(args)
+            return cls(function_name=call["name"], arguments=args)
+        return cls(content=data.get("content"))
+
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def _status_code(exc: Exception) -> int | None:
+    status = getattr(exc, "status_code", None)
+    if status is None and getattr(exc, "response", None) is not None:
+        status = getattr(exc.response, "status_code", None)
+    return status
+
+
+def is_retryable(exc: Exception) -> bool:
+    """リトライ対象の例外か（タイムアウト・接続エラー・429/5xx）"""
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    try:
+        import openai
+        if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError)):
+            return True
+    except ImportError:
+        pass
+    return _status_code(exc) in RETRYABLE_STATUS
+
+
+class LLMBackend:
+    """バックエンドの基底クラス"""
+
+    name = "base"
+
+    def complete(self, messages: list[dict], functions: list[dict]) -> LLMReply:
+        raise NotImplementedError
+
+    async def acomplete(self, messages: list[dict], functions: list[dict]) -> LLMReply:
+        """非同期版（既定ではスレッドで同期版を実行）"""
+        return await asyncio.to_thread(self.complete, messages, functions)
+
+
+# -------------------------------
+# Azure OpenAI
+# -------------------------------
+class AzureOpenAIBackend(LLMBackend):
+    name = "azure"
+
+    def __init__(self, timeout: float = 30.0):
+        self.timeout = timeout
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """AzureOpenAI クライアント（初回アクセス時に生成）"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from openai import AzureOpenAI
+                    self._client = AzureOpenAI(
+                        api_version="2024-05-01-preview",
+                        azure_endpoint=secret("AZURE_OPENAI_ENDPOINT"),
+                        api_key=secret("AZURE_OPENAI_API_KEY"),
+                        timeout=self.timeout,
+                    )
+        return self._client
+
+    @property
+    def async_client(self):
+        """AsyncAzureOpenAI クライアント（リトライは llm_async 側で行うため max_retries=0）"""
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    from openai import AsyncAzureOpenAI
+                    self._async_client = AsyncAzureOpenAI(
+                        api_version="2024-05-01-preview",
+                        azure_endpoint=secret("AZURE_OPENAI_ENDPOINT"),
+                        api_key=secret("AZURE_OPENAI_API_KEY"),
+                        timeout=self.timeout,
+                        max_retries=0,
+                    )
+        return self._async_client
+
+    def complete(self, messages: list[dict], functions: list[dict]) -> LLMReply:
+        rsp = self.client.chat.completions.create(**self._request(messages, functions))
+        return self._to_reply(rsp)
+
+    async def acomplete(self, messages: list[dict], functions: list[dict]) -> LLMReply:
+        rsp = await self.async_client.chat.completions.create(**self._request(messages, functions))
+        return self._to_reply(rsp)
+
+    @staticmethod
+    def _request(messages: list[dict], functions: list[dict]) -> dict:
+        return {
+            "model": secret("AZURE_OPENAI_DEPLOYMENT"),
+            "messages": messages,
+            "functions": functions,
+            "function_call": "auto",
+            "temperature": 0,
+        }
+
+    @staticmethod
+    def _to_reply(rsp) -> LLMReply:
+        message = rsp.choices[0].message
+        usage = {}
+        if getattr(rsp, "usage", None):
+            usage = {
+                "prompt_tokens": rsp.usage.prompt_tokens,
+                "completion_tokens": rsp.usage.completion_tokens,
+            }
+        if message.function_call:
+            return LLMReply(
+                function_name=message.function_call.name,
+                arguments=json.loads(message.function_call.arguments),
+                usage=usage,
+            )
+        return LLMReply(content=message.content, usage=usage)
+
+
+# -------------------------------
+# ローカル（ルール＋フィクスチャ再生）
+# -------------------------------
+SEATMAP_RE = re.compile(r"(座席|席).*(マップ|地図|配置|状況)|空(席|いて|き)|マップ|座って|着席")
+WITH_NAMES_RE = re.compile(r"誰|だれ|名前|氏名")
+EMP_USAGE_RE = re.compile(r"(?P<name>[^\s、。「」の]{1,10}?)(さん|様|さま)の?(利用状況|利用履歴|利用回数|利用|グラフ)")
+UTILIZATION_RE = re.compile(r"利用率|稼働率|混雑|混む|ピーク|時間帯|曜日|(部署|エリア)別の利用")
+GREETING_RE = re.compile(r"こんにちは|こんばんは|おはよう|ありがとう|なにが聞ける|何が聞ける|できること")
+
+# 意図 → (定型SQL, 行数の上限)。上限は接続先に合わせて TOP / LIMIT で付ける
+SQL_TEMPLATES = [
+    (re.compile(r"部署"), """
+SELECT E.Dept, COUNT(*) AS UsageCount
+FROM SeatLog L
+JOIN Employee E ON E.EmpCode = L.EmpCode
+GROUP BY E.Dept
+ORDER BY UsageCount DESC
+""".strip(), None),
+    (re.compile(r"(使われていない|利用されていない|人気のない)"), """
+SELECT S.Label, COUNT(L.LogId) AS UsageCount
+FROM Seat S
+LEFT JOIN SeatLog L ON L.SeatId = S.SeatId
+GROUP BY S.Label
+ORDER BY UsageCount ASC, S.Label
+""".strip(), None),
+    (re.compile(r"(よく使われ|人気|ランキング|利用回数)"), """
+SELECT S.Label, COUNT(*) AS UsageCount
+FROM SeatLog L
+JOIN Seat S ON S.SeatId = L.SeatId
+GROUP BY S.Label
+ORDER BY UsageCount DESC
+""".strip(), 10),
+    (re.compile(r"社員"), "SELECT EmpCode, Name, Dept FROM Employee ORDER BY EmpCode", 100),
+    (re.compile(r"(座席|席)(一覧|リスト)"), "SELECT SeatId, Label, Area, SeatType FROM Seat ORDER BY Label", 100),
+]
+
+
+class LocalRuleBackend(LLMBackend):
+    """
+    ネットワークを使わない判定バックエンド。
+
+    1. フィクスチャ（記録済み応答）に同じ質問があればそれを再生
+    2. なければ正規表現で意図を判定し、定型SQLや関数呼び出しを返す
+    latency / jitter を指定すると、その分だけ待ってから応答する（負荷試験用）。
+    """
+
+    name = "local"
+
+    def __init__(self, fixtures_path: str | None = None, latency: float = 0.0,
+                 jitter: float = 0.0, seed: int | None = None):
+        self.latency = latency
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self.fixtures: dict[str, LLMReply] = {}
+        if fixtures_path:
+            self.load_fixtures(fixtures_path)
+
+    def load_fixtures(self, path: str):
+        """{"question": ..., "function_call" or "content": ...} 形式の JSONL を読み込む"""
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                rec = json.loads(line)
+                self.fixtures[normalize_question(rec["question"])] = LLMReply.from_dict(rec)
+
+    def complete(self, messages: list[dict], functions: list[dict]) -> LLMReply:
+        if self.latency or self.jitter:
+            time.sleep(self._delay())
+        return self._answer(messages)
+
+    async def acomplete(self, messages: list[dict], functions: list[dict]) -> LLMReply:
+        if self.latency or self.jitter:
+            await asyncio.sleep(self._delay())
+        return self._answer(messages)
+
+    def _delay(self) -> float:
+        return max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+
+    def _answer(self, messages: list[dict]) -> LLMReply:
+        question = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        fixture = self.fixtures.get(normalize_question(question))
+        if fixture is not None:
+            return fixture
+        return self.route(question)
+
+    @staticmethod
+    def route(question: str) -> LLMReply:
+        """正規表現による意図判定"""
+        m = EMP_USAGE_RE.search(question)
+        if m:
+            return LLMReply(function_name="show_emp_usage_chart", arguments={"name": m.group("name")})
+
+        if UTILIZATION_RE.search(question):
+            by = "dept" if "部署" in question else "seat" if re.search(r"席別|座席別|席ごと", question) else "area"
+            grain = "hour_weekday" if "時間帯" in question and "曜日" in question \
+                else "weekday" if "曜日" in question else "hour"
+            return LLMReply(function_name="show_utilization", arguments={"by": by, "grain": grain})
+
+        if SEATMAP_RE.search(question):
+            args = {"detail": "with_names"} if WITH_NAMES_RE.search(question) else {}
+            return LLMReply(function_name="show_seatmap", arguments=args)
+
+        for pattern, sql, limit in SQL_TEMPLATES:
+            if pattern.search(question):
+                if limit is not None:
+                    # sql_guard は engine を import するため遅延
+                    from core.dialect import backend_name
+                    from core.sql_guard import apply_row_limit
+                    sql = apply_row_limit(sql, limit, backend_name())
+                return LLMReply(function_name="to_sql", arguments={"sql": sql})
+
+        if GREETING_RE.search(question):
+            return LLMReply(content="座席マップ、社員ごとの利用状況グラフ、座席や部署の集計などを質問できます。")
+        return LLMReply(content="（ローカル判定）質問の意図を判定できませんでした。言い換えてお試しください。")
+
+
+# -------------------------------
+# 記録
+# -------------------------------
+class RecordingBackend(LLMBackend):
+    """別バックエンドの応答を JSONL に追記する（LocalRuleBackend で再生可能）"""
+
+    def __init__(self, inner: LLMBackend, path: str):
+        self.inner = inner
+        self.path = path
+        self.name = f"{inner.name}+record"
+        self._lock = threading.Lock()
+
+    def complete(self, messages: list[dict], functions: list[dict]) -> LLMReply:
+        reply = self.inner.complete(messages, functions)
+        self._record(messages, reply)
+        return reply
+
+    async def acomplete(self, messages: list[dict], functions: list[dict]) -> LLMReply:
+        reply = await self.inner.acomplete(messages, functions)
+        self._record(messages, reply)
+        return reply
+
+    def _record(self, messages: list[dict], reply: LLMReply):
+        question = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        rec = {"question": question, **reply.to_dict()}
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+
+def _local_backend() -> LocalRuleBackend:
+    return LocalRuleBackend(
+        fixtures_path=secret("LLM_FIXTURES_PATH"),
+        latency=float(secret("LLM_LOCAL_LATENCY_MS", "0")) / 1000,
+    )
+
+
+def build_fallback_backend(kind: str | None = None) -> LLMBackend | None:
+    """主バックエンドが失敗したときの副バックエンド（DATASK_LLM_FALLBACK、なければ None）"""
+    kind = (kind or secret("DATASK_LLM_BACKEND", "azure")).lower()
+    if kind != "local" and (secret("DATASK_LLM_FALLBACK") or "").lower() == "local":
+        return _local_backend()
+    return None
+
+
+def build_backend(kind: str | None = None) -> LLMBackend:
+    """設定からバックエンドを組み立てる"""
+    kind = (kind or secret("DATASK_LLM_BACKEND", "azure")).lower()
+
+    if kind == "local":
+        backend: LLMBackend = _local_backend()
+    elif kind == "azure":
+        backend = AzureOpenAIBackend(timeout=float(secret("AZURE_OPENAI_TIMEOUT", "30")))
+    else:
+        raise ValueError(f"未対応の LLM バックエンドです: {kind}")
+
+    record_path = secret("LLM_RECORD_PATH")
+    if record_path:
+        backend = RecordingBackend(backend, record_path)
+    return backend
+
+
+@st.cache_resource
+def get_llm_backend() -> LLMBackend:
+    """全セッションで共有するバックエンド"""
+    return build_backend()
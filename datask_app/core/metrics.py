@@ -0,0 +1,215 @@
+# =============================================================================
+# metrics.py - DBクエリの計測（呼び出し元ごとの遅延・件数・エラー）
+# -----------------------------------------------------------------------------
+# エンジンのイベント（before/after_cursor_execute, handle_error）で全 SQL の実行時間を測り、
+# 「どの画面・処理から呼ばれたか（origin）」ごとにプロセス内で集計します。
+# どの呼び出し元が DB 時間を占めているかを確認するためのものです。
+#
+# 使い方：
+#   with db_origin("chart"):          # または @db_origin("chart") で関数を修飾
+#       df = pd.read_sql(query, engine)
+#       record_rows(len(df))          # 取得件数（SELECT はドライバーから取れないため明示）
+#
+# origin：seatmap / chart / llm_sql / table_browse / export / name_index / cache_probe /
+#         ingest / analytics / archive / schema / rollup / health（指定がなければ other）。コンテキスト変数なのでスレッドごとに独立。
+#
+# 実行中のトレースのスパン（core/tracing.py）にも DB 時間・クエリ数・件数を加算します。
+#
+# 出力：
+# - DB_METRICS.to_prometheus() : Prometheus のテキスト形式（ヒストグラム＋カウンタ）
+# - DB_METRICS.snapshot()      : JSON 用の dict（origin 別・時間の長い SQL 上位）
+# =============================================================================
+
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import sqlalchemy as sa
+from core import tracing
+
+_origin: ContextVar[str] = ContextVar("datask_db_origin", default="other")
+
+# 遅延ヒストグラムの境界（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_WS_RE = re.compile(r"\s+")
+
+
+@contextmanager
+def db_origin(name: str):
+    """この中で実行された SQL を origin=name として集計する（デコレーターとしても使える）"""
+    token = _origin.set(name)
+    try:
+        yield
+    finally:
+        _origin.reset(token)
+
+
+def current_origin() -> str:
+    return _origin.get()
+
+
+def _statement_key(statement: str, max_len: int = 160) -> str:
+    return _WS_RE.sub(" ", statement).strip()[:max_len]
+
+
+class DbMetrics:
+    """origin 別の遅延ヒストグラム・件数・エラー数と、SQL 文ごとの累計時間"""
+
+    def __init__(self, max_statements: int = 200):
+        self.max_statements = max_statements
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._origins: dict[str, dict] = {}
+            self._statements: dict[tuple[str, str], dict] = {}
+            self._started_at = time.time()
+
+    def _series(self, origin: str) -> dict:
+        series = self._origins.get(origin)
+        if series is None:
+            series = self._origins[origin] = {
+                "count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0, "rows": 0,
+                "buckets": [0] * len(BUCKETS),
+            }
+        return series
+
+    def observe(self, origin: str, seconds: float, statement: str = "", rows: int | None = None,
+                error: bool = False):
+        """SQL 1回分の実行を記録する"""
+        with self._lock:
+            s = self._series(origin)
+            s["count"] += 1
+            s["seconds"] += seconds
+            s["max_seconds"] = max(s["max_seconds"], seconds)
+            s["errors"] += int(error)
+            s["rows"] += rows or 0
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    s["buckets"][i] += 1
+                    break
+
+            key = (origin, _statement_key(statement))
+            stmt = self._statements.get(key)
+            if stmt is None:
+                if len(self._statements) >= self.max_statements:
+                    # 累計時間の最も短い SQL を捨てて上位だけを残す
+                    del self._statements[min(self._statements, key=lambda k: self._statements[k]["seconds"])]
+                stmt = self._statements[key] = {"count": 0, "seconds": 0.0, "max_seconds": 0.0}
+            stmt["count"] += 1
+            stmt["seconds"] += seconds
+            stmt["max_seconds"] = max(stmt["max_seconds"], seconds)
+
+    def add_rows(self, origin: str, rows: int):
+        with self._lock:
+            self._series(origin)["rows"] += rows
+
+    def snapshot(self, top: int = 20) -> dict:
+        """JSON にできる集計結果（origin は DB 時間の長い順）"""
+        with self._lock:
+            origins = {k: {**v, "buckets": list(v["buckets"])} for k, v in self._origins.items()}
+            statements = sorted(self._statements.items(), key=lambda kv: kv[1]["seconds"], reverse=True)[:top]
+            started_at = self._started_at
+        total = sum(s["seconds"] for s in origins.values()) or 1.0
+        return {
+            "since": started_at,
+            "origins": {
+                name: {
+                    "count": s["count"],
+                    "errors": s["errors"],
+                    "rows": s["rows"],
+                    "total_ms": round(s["seconds"] * 1000, 1),
+                    "avg_ms": round(s["seconds"] / s["count"] * 1000, 2) if s["count"] else 0.0,
+                    "max_ms": round(s["max_seconds"] * 1000, 1),
+                    "share": round(s["seconds"] / total, 3),
+                }
+                for name, s in sorted(origins.items(), key=lambda kv: kv[1]["seconds"], reverse=True)
+            },
+            "top_statements": [
+                {"origin": origin, "sql": sql, "count": s["count"],
+                 "total_ms": round(s["seconds"] * 1000, 1), "max_ms": round(s["max_seconds"] * 1000, 1)}
+                for (origin, sql), s in statements
+            ],
+        }
+
+    def to_prometheus(self, pool: dict | None = None) -> str:
+        """Prometheus のテキスト形式（pool を渡すと接続プールの状態も出力）"""
+        with self._lock:
+            origins = {k: {**v, "buckets": list(v["buckets"])} for k, v in self._origins.items()}
+        lines = [
+            "# HELP datask_db_query_seconds Time spent executing SQL statements.",
+            "# TYPE datask_db_query_seconds histogram",
+        ]
+        for name, s in sorted(origins.items()):
+            cumulative = 0
+            for bound, n in zip(BUCKETS, s["buckets"]):
+                cumulative += n
+                lines.append(f'datask_db_query_seconds_bucket{{origin="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'datask_db_query_seconds_bucket{{origin="{name}",le="+Inf"}} {s["count"]}')
+            lines.append(f'datask_db_query_seconds_sum{{origin="{name}"}} {s["seconds"]:.6f}')
+            lines.append(f'datask_db_query_seconds_count{{origin="{name}"}} {s["count"]}')
+        for metric, field, help_text in (
+            ("datask_db_query_errors_total", "errors", "SQL statements that raised an error."),
+            ("datask_db_rows_total", "rows", "Rows returned or affected."),
+        ):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for name, s in sorted(origins.items()):
+                lines.append(f'{metric}{{origin="{name}"}} {s[field]}')
+        for key, value in (pool or {}).items():
+            if isinstance(value, (int, float)):
+                lines.append(f"# TYPE datask_db_pool_{key} gauge")
+                lines.append(f"datask_db_pool_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# プロセス全体で共有するレジストリ
+DB_METRICS = DbMetrics()
+
+
+def record_rows(rows: int, origin: str | None = None):
+    """取得した件数を現在の origin に加算する"""
+    DB_METRICS.add_rows(origin or _origin.get(), rows)
+    tracing.current_span().add("rows", rows)
+
+
+def instrument_engine(engine: sa.Engine, registry: DbMetrics = DB_METRICS) -> sa.Engine:
+    """エンジンの全 SQL の実行時間を registry に記録する"""
+
+    @sa.event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("datask_started", []).append(time.perf_counter())
+
+    @sa.event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["datask_started"].pop()
+        # SELECT の件数はフェッチ前には分からないため、更新系の rowcount だけを数える
+        rows = cursor.rowcount if cursor.description is None and cursor.rowcount > 0 else None
+        elapsed = time.perf_counter() - started
+        registry.observe(_origin.get(), elapsed, statement, rows)
+        tracing.add_db_time(elapsed, rows)
+
+    @sa.event.listens_for(engine, "handle_error")
+    def _error(context):
+        conn = context.connection
+        stack = conn.info.get("datask_started") if conn is not None else None
+        if stack:
+            registry.observe(_origin.get(), time.perf_counter() - stack.pop(),
+                             context.statement or "", error=True)
+
+    return engine
+
+
+def pool_stats(engine: sa.Engine) -> dict:
+    """接続プールの状態（QueuePool 以外では取れる項目だけ）"""
+    pool = engine.pool
+    stats = {"class": type(pool).__name__}
+    for key in ("size", "checkedin", "checkedout", "overflow"):
+        fn = getattr(pool, key, None)
+        if callable(fn):
+            stats[key] = fn()
+    return stats
@@ -0,0 +1,308 @@
+# =============================================================================
+# name_index.py - 社員名 → 社員コードのメモリ内インデックス
+# -----------------------------------------------------------------------------
+# Employee（EmpCode, Name, Dept）を一度だけ読み込み、メモリ上の索引で
+# 氏名から社員コードを解決します。LIKE 検索の繰り返しを置き換えるものです。
+#
+# 索引の種類：
+# - 完全一致     : 正規化したフルネーム、および空白で区切った姓・名 → EmpCode
+# - 前方一致     : トライ木（各ノードに配下の EmpCode を保持）
+# - 部分一致     : 1文字・2文字 n-gram の転置インデックス（候補を絞ってから照合）
+#
+# 正規化：NFKC（全角/半角の統一）・空白除去・カタカナ→ひらがな・大文字小文字の統一
+#
+# 更新：TTL ごとに Employee のチェックサムを確認し、変化があった行だけ差し替え。
+#       確認はバックグラウンドで行い、検索は常に現在の索引で即座に返す。
+#       読み込みに失敗したときはログに残して errors を数え、直前の索引で検索を続ける
+#       （初回の読み込みの失敗も例外にせず、空の索引のまま retry_seconds 後に再試行）。
+#       最後の読み込みから max_staleness 秒を超えたら、その場で読み直しを試みる。
+#
+# 設定（secrets / 環境変数）：
+#   NAME_INDEX_TTL           : チェックサムを確認する間隔（秒、既定 300）
+#   NAME_INDEX_MAX_STALENESS : 索引の許容する古さ（秒、既定 3600）
+#   NAME_INDEX_RETRY_SECONDS : 読み込みに失敗したときの再試行までの秒数（既定 30）
+#
+# 使用例：
+#   index = get_name_index()
+#   index.resolve("田中")   # → [{"EmpCode": "E10001", "Name": "田中 太郎", ...}, ...]
+# =============================================================================
+
+import logging
+import threading
+import time
+import unicodedata
+
+import sqlalchemy as sa
+import streamlit as st
+from core.config import secret
+from core.db import get_engine
+from core.dialect import checksum_agg, employee
+from core.metrics import db_origin, record_rows
+
+logger = logging.getLogger(__name__)
+
+_END = "$codes"
+
+
+def normalize_name(text: str) -> str:
+    """氏名の表記ゆれを吸収する（NFKC・空白除去・カタカナ→ひらがな）"""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    out = []
+    for ch in text:
+        if ch.isspace():
+            continue
+        code = ord(ch)
+        if 0x30A1 <= code <= 0x30F6:  # カタカナ → ひらがな
+            ch = chr(code - 0x60)
+        out.append(ch)
+    return "".join(out)
+
+
+def _name_parts(name: str) -> list[str]:
+    """「田中 太郎」→ ["田中", "太郎"]（全角空白も区切りとして扱う）"""
+    text = unicodedata.normalize("NFKC", name or "")
+    return [normalize_name(p) for p in text.split() if p]
+
+
+def _grams(text: str) -> set[str]:
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+class NameIndex:
+    """
+    社員名のメモリ内インデックス。
+
+    resolve() は完全一致 → 前方一致 → 部分一致の順に検索し、
+    最初に見つかった段階の候補をすべて返す（同姓の社員がいれば複数件）。
+    """
+
+    def __init__(self, engine, ttl: float = 300, max_staleness: float = 3600, retry_seconds: float = 30):
+        self.engine = engine
+        self.ttl = ttl
+        self.max_staleness = max_staleness
+        self.retry_seconds = retry_seconds
+        self._lock = threading.RLock()
+        self._refreshing = False
+        self._checked_at = 0.0
+        self._retry_at = 0.0
+        self._signature = None
+        self.errors = 0
+        self.last_error: str | None = None
+        self.rows: dict[str, tuple[str, str, str]] = {}  # EmpCode → (Name, Dept, 正規化名)
+        self._exact: dict[str, set[str]] = {}
+        self._trie: dict = {}
+        self._grams: dict[str, set[str]] = {}
+
+    # ---------------------------------
+    # 検索
+    # ---------------------------------
+    def resolve(self, name: str) -> list[dict]:
+        """氏名から候補を返す（最も確度の高い段階の候補のみ）"""
+        self.ensure_fresh()
+        key = normalize_name(name)
+        if not key:
+            return []
+        with self._lock:
+            for match, codes in (
+                ("exact", self._exact.get(key, set())),
+                ("prefix", self._prefix_codes(key)),
+                ("substring", self._substring_codes(key)),
+            ):
+                if codes:
+                    return [self._candidate(code, match) for code in sorted(codes)]
+        return []
+
+    def search(self, name: str, limit: int = 20) -> list[dict]:
+        """完全一致・前方一致・部分一致をすべて、確度の高い順に返す"""
+        self.ensure_fresh()
+        key = normalize_name(name)
+        if not key:
+            return []
+        seen, result = set(), []
+        with self._lock:
+            for match, codes in (
+                ("exact", self._exact.get(key, set())),
+                ("prefix", self._prefix_codes(key)),
+                ("substring", self._substring_codes(key)),
+            ):
+                for code in sorted(codes - seen):
+                    seen.add(code)
+                    result.append(self._candidate(code, match))
+        return result[:limit]
+
+    def _candidate(self, code: str, match: str) -> dict:
+        name, dept, _ = self.rows[code]
+        return {"EmpCode": code, "Name": name, "Dept": dept, "match": match}
+
+    def _prefix_codes(self, key: str) -> set[str]:
+        node = self._trie
+        for ch in key:
+            node = node.get(ch)
+            if node is None:
+                return set()
+        return set(node[_END])
+
+    def _substring_codes(self, key: str) -> set[str]:
+        grams = [key[i:i + 2] for i in range(len(key) - 1)] or [key]
+        postings = [self._grams.get(g) for g in grams]
+        if not all(postings):
+            return set()
+        codes = set.intersection(*postings)
+        return {c for c in codes if key in self.rows[c][2]}
+
+    # ---------------------------------
+    # 索引の更新
+    # ---------------------------------
+    def _add(self, code: str, name: str, dept: str):
+        norm = normalize_name(name)
+        self.rows[code] = (name, dept, norm)
+        for key in {norm, *_name_parts(name)}:
+            self._exact.setdefault(key, set()).add(code)
+        for key in {norm, *_name_parts(name)}:
+            node = self._trie
+            for ch in key:
+                node = node.setdefault(ch, {_END: set()})
+                node[_END].add(code)
+        for g in _grams(norm):
+            self._grams.setdefault(g, set()).add(code)
+
+    def _remove(self, code: str):
+        name, _, norm = self.rows.pop(code)
+        for key in {norm, *_name_parts(name)}:
+            codes = self._exact.get(key)
+            if codes is not None:
+                codes.discard(code)
+                if not codes:
+                    del self._exact[key]
+            node = self._trie
+            path = []
+            for ch in key:
+                child = node.get(ch)
+                if child is None:
+                    break
+                child[_END].discard(code)
+                path.append((node, ch, child))
+                node = child
+            for parent, ch, child in reversed(path):
+                if not child[_END]:
+                    del parent[ch]
+        for g in _grams(norm):
+            codes = self._grams.get(g)
+            if codes is not None:
+                codes.discard(code)
+                if not codes:
+                    del self._grams[g]
+
+    def apply_rows(self, rows: list[tuple[str, str, str]]) -> dict:
+        """
+        Employee の全行を受け取り、差分だけ索引に反映する。
+
+        Returns:
+            {"added": n, "updated": n, "removed": n}
+        """
+        incoming = {code: (name or "", dept or "") for code, name, dept in rows}
+        added = updated = removed = 0
+        with self._lock:
+            for code in list(self.rows):
+                if code not in incoming:
+                    self._remove(code)
+                    removed += 1
+            for code, (name, dept) in incoming.items():
+                current = self.rows.get(code)
+                if current is None:
+                    self._add(code, name, dept)
+                    added += 1
+                elif current[:2] != (name, dept):
+                    self._remove(code)
+                    self._add(code, name, dept)
+                    updated += 1
+        return {"added": added, "updated": updated, "removed": removed}
+
+    def _probe(self, conn):
+        """Employee が変わったかを安価に判定するためのチェックサム"""
+        query = sa.select(sa.func.count(), checksum_agg(employee.c.EmpCode, employee.c.Name, employee.c.Dept))
+        return tuple(conn.execute(query).fetchone())
+
+    def refresh(self, force: bool = False) -> dict | None:
+        """チェックサムが変わっていれば Employee を読み直して差分を反映する"""
+        with db_origin("name_index"), self.engine.connect() as conn:
+            signature = self._probe(conn)
+            if not force and signature == self._signature:
+                self._checked_at = time.time()
+                return None
+            rows = conn.execute(sa.select(employee.c.EmpCode, employee.c.Name, employee.c.Dept)).fetchall()
+        record_rows(len(rows), origin="name_index")
+        diff = self.apply_rows([tuple(r) for r in rows])
+        self._signature = signature
+        self._checked_at = time.time()
+        return diff
+
+    def _try_refresh(self, force: bool = False) -> bool:
+        """refresh() を実行し、失敗したらログと errors に残して直前の索引を使い続ける"""
+        try:
+            self.refresh(force=force)
+            self.last_error = None
+            return True
+        except Exception as e:
+            self.errors += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            self._retry_at = time.time() + self.retry_seconds
+            logger.warning("社員名インデックスを更新できませんでした（%s 件の索引で継続）: %s", len(self.rows), e)
+            return False
+
+    def age(self) -> float:
+        """最後に Employee を確認できてからの秒数（未読み込みなら inf）"""
+        return time.time() - self._checked_at if self._checked_at else float("inf")
+
+    def ready(self) -> bool:
+        """一度でも Employee を読み込めたか"""
+        return self._signature is not None
+
+    def ensure_fresh(self):
+        """
+        初回と max_staleness 超過時は同期で読み込み、以降は TTL 経過時にバックグラウンドで更新する。
+        失敗しても例外にせず、retry_seconds の間は再試行しない。
+        """
+        now = time.time()
+        if now < self._retry_at:
+            return
+        if self._signature is None or self.age() > self.max_staleness:
+            with self._lock:
+                if time.time() >= self._retry_at and (self._signature is None or self.age() > self.max_staleness):
+                    self._try_refresh(force=self._signature is None)
+            return
+        if now - self._checked_at < self.ttl or self._refreshing:
+            return
+        self._refreshing = True
+
+        def run():
+            try:
+                self._try_refresh()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="name-index-refresh", daemon=True).start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "employees": len(self.rows),
+                "exact_keys": len(self._exact),
+                "grams": len(self._grams),
+                "age_seconds": time.time() - self._checked_at if self._checked_at else None,
+                "errors": self.errors,
+                "last_error": self.last_error,
+            }
+
+
+@st.cache_resource
+def get_name_index() -> NameIndex:
+    """全セッションで共有する社員名インデックス"""
+    return NameIndex(
+        get_engine(),
+        ttl=float(secret("NAME_INDEX_TTL", "300")),
+        max_staleness=float(secret("NAME_INDEX_MAX_STALENESS", "3600")),
+        retry_seconds=float(secret("NAME_INDEX_RETRY_SECONDS", "30")),
+    )
@@ -0,0 +1,212 @@
+# =============================================================================
+# nl_cache.py - 質問文 → AI判定結果のキャッシュ
+# -----------------------------------------------------------------------------
+# generate_semantic_sql() の前段に置き、同じ質問に対する Azure OpenAI 呼び出しを
+# 省略するためのキャッシュです。
+#
+# 主な機能：
+# - 質問文の正規化（Unicode NFKC・空白/装飾の記号の除去・敬称を「さん」に統一）
+#   比較・範囲の記号（< > = - % など）と数字に挟まれた記号は残す（意味が変わるため）
+# - SCHEMA_HINT のフィンガープリントをキーに含める（スキーマが変われば別キー）
+# - LRU + TTL によるメモリ上の追い出し
+# - SQLite ファイルへの永続化（NL_CACHE_PATH を設定した場合のみ）
+# - ヒット/ミス数の取得（stats）と無効化（invalidate）
+#
+# 使用例：
+#   cache = get_nl_cache()
+#   result = cache.get("田中さんの利用状況", SCHEMA_HINT)
+#   if result is None:
+#       result = ...  # AIで判定
+#       cache.put("田中さんの利用状況", SCHEMA_HINT, result)
+# =============================================================================
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import streamlit as st
+from core.config import secret
+
+# 「様」「さま」は「さん」に寄せる（助詞・文末の直前のみ）
+_HONORIFIC_RE = re.compile(r"(様|さま|殿)(?=の|は|が|を|に|と|$)")
+
+
+def _is_digit(ch: str) -> bool:
+    return unicodedata.category(ch) == "Nd"
+
+
+def normalize_question(text: str) -> str:
+    """
+    キャッシュキー用に質問文を正規化する。
+
+    - Unicode NFKC（全角英数・半角カナの統一）
+    - 大文字小文字の統一
+    - 空白・句読点・装飾の記号の除去
+      ただし意味の変わる記号は残す：数学記号（< > = + など）・「-」・「%」、
+      数字に挟まれた記号・空白（10:30、1,000、2024/01/01、10 20 など。空白は1つにまとめる）
+    - 敬称（様/さま/殿）を「さん」に統一
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    out = []
+    for i, ch in enumerate(text):
+        category = unicodedata.category(ch)
+        if not category.startswith(("P", "Z", "S", "C")) or category == "Sm" or ch in "-%":
+            out.append(ch)
+        elif out and _is_digit(out[-1]):
+            # 数字の後の記号は次が数字のときだけ、空白は（続く空白を飛ばして）次が数字のときだけ残す
+            if category.startswith("Z"):
+                rest = text[i + 1:].lstrip()
+                if rest and _is_digit(rest[0]):
+                    out.append(" ")
+            elif not category.startswith("C") and _is_digit(text[i + 1:i + 2] or " "):
+                out.append(ch)
+    return _HONORIFIC_RE.sub("さん", "".join(out))
+
+
+def schema_fingerprint(schema_hint: str) -> str:
+    """SCHEMA_HINT のフィンガープリント（空白の差は無視）"""
+    canonical = " ".join(schema_hint.split())
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+class NLCache:
+    """
+    質問文 → 判定結果 dict（sql/chart/seatmap/chat）のキャッシュ。
+
+    メモリ上は LRU + TTL、path を指定した場合は SQLite にも書き込み、
+    プロセス再起動後もヒットするようにする。
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 3600, path: str | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self._lock = threading.Lock()
+        self._mem: OrderedDict[str, tuple[float, str, dict]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS nl_cache ("
+                " key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL,"
+                " created REAL NOT NULL, result TEXT NOT NULL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(question: str, schema_hint: str) -> tuple[str, str]:
+        fp = schema_fingerprint(schema_hint)
+        return f"{fp}:{normalize_question(question)}", fp
+
+    def get(self, question: str, schema_hint: str) -> dict | None:
+        key, _ = self.make_key(question, schema_hint)
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                created, _, result = entry
+                if now - created <= self.ttl:
+                    self._mem.move_to_end(key)
+                    self.hits += 1
+                    return dict(result)
+                del self._mem[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT created, fingerprint, result FROM nl_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row and now - row[0] <= self.ttl:
+                    result = json.loads(row[2])
+                    self._remember(key, row[0], row[1], result)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return dict(result)
+                if row:
+                    self._db.execute("DELETE FROM nl_cache WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def put(self, question: str, schema_hint: str, result: dict):
+        """判定結果を保存する（error と、副バックエンドによる代わりの応答は保存しない）"""
+        if result.get("type") == "error" or result.get("fallback"):
+            return
+        key, fp = self.make_key(question, schema_hint)
+        created = time.time()
+        result = json.loads(json.dumps(result, ensure_ascii=False))
+        with self._lock:
+            self._remember(key, created, fp, result)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO nl_cache (key, fingerprint, created, result) VALUES (?, ?, ?, ?)",
+                    (key, fp, created, json.dumps(result, ensure_ascii=False)),
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, created: float, fp: str, result: dict):
+        self._mem[key] = (created, fp, result)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.maxsize:
+            self._mem.popitem(last=False)
+
+    def invalidate(self, schema_hint: str | None = None) -> int:
+        """
+        キャッシュを無効化する。
+
+        Parameters:
+        - schema_hint: 指定した場合はそのスキーマで作られたエントリだけを削除。
+                       省略時はすべて削除。
+
+        Returns:
+        - 削除したメモリ上のエントリ数
+        """
+        fp = schema_fingerprint(schema_hint) if schema_hint is not None else None
+        with self._lock:
+            if fp is None:
+                removed = len(self._mem)
+                self._mem.clear()
+            else:
+                keys = [k for k, (_, f, _) in self._mem.items() if f == fp]
+                for k in keys:
+                    del self._mem[k]
+                removed = len(keys)
+            if self._db is not None:
+                if fp is None:
+                    self._db.execute("DELETE FROM nl_cache")
+                else:
+                    self._db.execute("DELETE FROM nl_cache WHERE fingerprint = ?", (fp,))
+                self._db.commit()
+        return removed
+
+    def stats(self) -> dict:
+        """ヒット/ミス数などの統計"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._mem),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+            }
+
+
+@st.cache_resource
+def get_nl_cache() -> NLCache:
+    """全セッションで共有するキャッシュ（設定は secrets / 環境変数から）"""
+    return NLCache(
+        maxsize=int(secret("NL_CACHE_MAXSIZE", "512")),
+        ttl=float(secret("NL_CACHE_TTL", "3600")),
+        path=secret("NL_CACHE_PATH"),
+    )
@@ -0,0 +1,260 @@
+# =============================================================================
+# occupancy.py - 現在の座席使用状況スナップショット（全セッション共有）
+# -----------------------------------------------------------------------------
+# 座席マップの描画ごとに SeatLog を全件走査しないよう、現在の使用状況
+# （Label → 使用中か・EmpCode・Name）をプロセス内メモリに保持します。
+#
+# 仕組み：
+# - 初回：Seat 全件と、CheckOut が NULL の SeatLog を読み込む
+# - 以降：バックグラウンドのポーラーが poll_interval 秒ごとに、
+#         LogId > 最大LogId（新規チェックイン）の行と、
+#         スナップショットで使用中の LogId のうちチェックアウト済みになった行だけを取得して反映
+#         （どちらも主キーのシーク。CheckOut の値で探さないため、過去の時刻でのチェックアウトも漏れない）
+# - CheckIn が未来の行も保持し、参照時に「CheckIn <= 現在時刻」で判定
+#   （現在時刻はDBサーバーの時刻に合わせて補正、db_now() は接続先ごとの現在時刻関数）
+# - resync_interval 秒ごとに全件を読み直し、削除や座席マスタの変更も反映
+# - チェックアウトを見つけたら add_listener() で登録した関数を呼ぶ
+#   （core/result_cache.py が SeatLog のキャッシュを無効化するのに使う）
+#
+# 座席マップの表示はこのスナップショットから返すため、DBアクセスは発生しません。
+# ポーラーが止まるなどして max_staleness 秒より古くなった場合のみ、その場で更新します。
+#
+# 設定（secrets / 環境変数）：
+#   OCCUPANCY_POLL_SECONDS   : ポーリング間隔（既定 5）
+#   OCCUPANCY_MAX_STALENESS  : 許容する最大の古さ（秒、既定 30）
+#   OCCUPANCY_RESYNC_SECONDS : 全件読み直しの間隔（既定 600）
+#   OCCUPANCY_POLL_BATCH     : 使用中の LogId を 1 回の IN で確認する件数（既定 500）
+# =============================================================================
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+import streamlit as st
+from core.config import secret
+from core.db import get_engine
+from core.dialect import db_now, employee, seat, seatlog
+from core.metrics import db_origin, record_rows
+
+logger = logging.getLogger(__name__)
+
+SEATS_QUERY = sa.select(seat.c.SeatId, seat.c.Label).order_by(seat.c.Label)
+
+# SeatLog の行＋社員名（LogId, SeatId, EmpCode, Name, CheckIn, CheckOut）
+_LOGS = sa.select(
+    seatlog.c.LogId, seatlog.c.SeatId, seatlog.c.EmpCode, employee.c.Name,
+    seatlog.c.CheckIn, seatlog.c.CheckOut,
+).select_from(seatlog.outerjoin(employee, employee.c.EmpCode == seatlog.c.EmpCode))
+
+OPEN_LOGS_QUERY = _LOGS.where(seatlog.c.CheckOut.is_(None))
+
+NEW_LOGS_QUERY = _LOGS.where(seatlog.c.LogId > sa.bindparam("max_id"))
+
+# 使用中として保持している LogId のうち、チェックアウト済みになったもの（主キーで検索）
+CLOSED_LOGS_QUERY = sa.select(seatlog.c.LogId).where(
+    seatlog.c.LogId.in_(sa.bindparam("log_ids", expanding=True)), seatlog.c.CheckOut.is_not(None)
+)
+
+WATERMARK_QUERY = sa.select(sa.func.max(seatlog.c.LogId), db_now())
+
+NOW_QUERY = sa.select(db_now())
+
+
+def _as_datetime(value) -> datetime | None:
+    """ドライバーによって文字列で返る日時を datetime に揃える"""
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+class OccupancySnapshot:
+    """現在の座席使用状況をメモリに保持し、差分ポーリングで更新する"""
+
+    def __init__(self, engine, poll_interval: float = 5, max_staleness: float = 30,
+                 resync_interval: float = 600, poll_batch: int = 500):
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self.max_staleness = max_staleness
+        self.resync_interval = resync_interval
+        self.poll_batch = poll_batch
+        self._lock = threading.RLock()
+        self._labels: list[str] = []
+        self._seat_label: dict[int, str] = {}
+        self._open: dict[int, tuple[int, str, str | None, datetime]] = {}  # LogId → (SeatId, EmpCode, Name, CheckIn)
+        self._max_id = 0
+        self._clock_offset = timedelta(0)
+        self._refreshed_at = 0.0
+        self._resynced_at = 0.0
+        self.polls = 0
+        self.rows_fetched = 0
+        self.last_error: str | None = None
+        self._listeners: list = []
+        self._poller: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    # ---------------------------------
+    # 更新
+    # ---------------------------------
+    def resync(self):
+        """Seat と使用中の SeatLog を全件読み直す"""
+        with db_origin("seatmap"), self.engine.connect() as conn:
+            max_id, now = conn.execute(WATERMARK_QUERY).fetchone()
+            seats = conn.execute(SEATS_QUERY).fetchall()
+            rows = conn.execute(OPEN_LOGS_QUERY).fetchall()
+        with self._lock:
+            # 前回の使用中の行がなくなっていれば、チェックアウト（または削除）があった
+            closed = bool(self._resynced_at) and not set(self._open) <= {r[0] for r in rows}
+            self._labels = [r[1] for r in seats]
+            self._seat_label = {r[0]: r[1] for r in seats}
+            self._open = {r[0]: (r[1], r[2], r[3], _as_datetime(r[4])) for r in rows}
+            self._max_id = max_id or 0
+            self._set_clock(now)
+            self._refreshed_at = self._resynced_at = time.time()
+        self.rows_fetched += len(rows) + len(seats)
+        record_rows(len(rows) + len(seats), origin="seatmap")
+        if closed:
+            self._notify()
+
+    def poll(self):
+        """前回以降に追加された行と、使用中の行のうちチェックアウトされたものだけを反映する"""
+        if not self._resynced_at or time.time() - self._resynced_at >= self.resync_interval:
+            self.resync()
+            return
+        with self._lock:
+            open_ids = sorted(self._open)
+        closed = []
+        with db_origin("seatmap"), self.engine.connect() as conn:
+            rows = conn.execute(NEW_LOGS_QUERY, {"max_id": self._max_id}).fetchall()
+            for i in range(0, len(open_ids), self.poll_batch):
+                batch = open_ids[i:i + self.poll_batch]
+                closed += conn.execute(CLOSED_LOGS_QUERY, {"log_ids": batch}).scalars().all()
+            now = conn.execute(NOW_QUERY).scalar()
+        with self._lock:
+            for log_id, seat_id, emp, name, check_in, check_out in rows:
+                if check_out is None:
+                    self._open[log_id] = (seat_id, emp, name, _as_datetime(check_in))
+                self._max_id = max(self._max_id, log_id)
+            for log_id in closed:
+                self._open.pop(log_id, None)
+            self._set_clock(now)
+            self._refreshed_at = time.time()
+        self.polls += 1
+        self.rows_fetched += len(rows) + len(closed)
+        record_rows(len(rows) + len(closed), origin="seatmap")
+        if closed:
+            self._notify()
+
+    def add_listener(self, callback):
+        """チェックアウトを見つけたときに呼ぶ関数（引数なし）を登録する"""
+        self._listeners.append(callback)
+
+    def _notify(self):
+        for callback in list(self._listeners):
+            try:
+                callback()
+            except Exception as e:
+                logger.warning("occupancy listener failed: %s", e)
+
+    def _set_clock(self, now: datetime | None):
+        now = _as_datetime(now)
+        if now is not None:
+            self._clock_offset = now - datetime.now()
+
+    def start(self):
+        """バックグラウンドのポーラーを開始する"""
+        if self._poller is not None and self._poller.is_alive():
+            return
+        self._stop.clear()
+        self._poller = threading.Thread(target=self._run, name="occupancy-poller", daemon=True)
+        self._poller.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning("occupancy poll failed: %s", e)
+
+    def ensure_fresh(self):
+        """max_staleness より古ければその場で更新する（初回は全件読み込み）"""
+        if not self._refreshed_at:
+            with self._lock:
+                if not self._refreshed_at:
+                    self.resync()
+        elif self.age() > self.max_staleness:
+            try:
+                self.poll()
+                self.last_error = None
+            except Exception as e:
+                # 更新できなくても直前のスナップショットで表示は続ける
+                self.last_error = str(e)
+                logger.warning("occupancy refresh failed: %s", e)
+
+    # ---------------------------------
+    # 参照（DBアクセスなし）
+    # ---------------------------------
+    def age(self) -> float:
+        """最後に更新してからの秒数"""
+        return time.time() - self._refreshed_at if self._refreshed_at else float("inf")
+
+    def labels(self) -> list[str]:
+        """すべての Seat.Label（昇順）"""
+        self.ensure_fresh()
+        with self._lock:
+            return list(self._labels)
+
+    def state(self) -> dict[str, tuple[bool, str | None, str | None]]:
+        """Label → (使用中か, EmpCode, Name)"""
+        self.ensure_fresh()
+        now = datetime.now() + self._clock_offset
+        with self._lock:
+            result = {label: (False, None, None) for label in self._labels}
+            for seat_id, emp, name, check_in in self._open.values():
+                label = self._seat_label.get(seat_id)
+                if label is not None and check_in is not None and check_in <= now:
+                    result[label] = (True, emp, name)
+        return result
+
+    def used_labels(self) -> list[str]:
+        """使用中の Seat.Label（seatmap.get_used_labels と同じ内容）"""
+        return [label for label, (used, _, _) in self.state().items() if used]
+
+    def used_label_name_dict(self) -> dict[str, str]:
+        """使用中の Label → Name（seatmap.get_used_label_name_dict と同じ内容）"""
+        return {
+            label: name
+            for label, (used, _, name) in self.state().items()
+            if used and name is not None
+        }
+
+    def stats(self) -> dict:
+        return {
+            "seats": len(self._labels),
+            "open_logs": len(self._open),
+            "age_seconds": round(self.age(), 1),
+            "polls": self.polls,
+            "rows_fetched": self.rows_fetched,
+            "max_log_id": self._max_id,
+            "last_error": self.last_error,
+        }
+
+
+@st.cache_resource
+def get_occupancy_snapshot() -> OccupancySnapshot:
+    """全セッションで共有するスナップショット（ポーラーも1つだけ起動）"""
+    snapshot = OccupancySnapshot(
+        get_engine(),
+        poll_interval=float(secret("OCCUPANCY_POLL_SECONDS", "5")),
+        max_staleness=float(secret("OCCUPANCY_MAX_STALENESS", "30")),
+        resync_interval=float(secret("OCCUPANCY_RESYNC_SECONDS", "600")),
+        poll_batch=int(secret("OCCUPANCY_POLL_BATCH", "500")),
+    )
+    snapshot.start()
+    return snapshot
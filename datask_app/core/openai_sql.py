@@ -5,29 +5,73 @@
 # - SQL文の生成（type: 'sql'）
 # - グラフ表示（type: 'chart'）
 # - 座席マップ（type: 'seatmap'）
+# - 利用率の分析（type: 'utilization'、core/analytics.py）
 # - 雑談応答（type: 'chat'）
+#
+# 同じ質問（正規化後）の判定結果は core/nl_cache.py にキャッシュされ、
+# 2回目以降は Azure OpenAI を呼び出さずに返します。
+#
+# LLM の呼び出し自体は core/llm_backend.py のバックエンド経由で行うため、
+# import 時にクライアントは生成されず、ローカル判定への切り替えも可能です。
+#
+# さらに、座席マップ・「○○さんの利用状況」のような定型の質問は
+# classify_fast() がルールで判定し、LLM を呼ばずに同じ形式の結果を返します
+# （ヒット率とレイテンシは fast_path_stats() で確認できます）。
+#
+# LLM 呼び出しは core/llm_async.py のゲートウェイ経由で、タイムアウト・リトライ・
+# 同時実行数の上限・同一質問の合流が適用されます。非同期コードからは
+# generate_semantic_sql_async() を使用できます（戻り値は同じ dict）。
+#
+# 実行に成功した質問と SQL は core/sql_examples.py に記録され、似た質問の例を
+# プロンプトに追加します。同じ質問なら記録済みの SQL を LLM なしで返します
+# （結果に "reused": True が付き、実行に失敗したら app.py がその例を削除します）。
+#
+# 判定は core/tracing.py の classify スパン（path: fast / cache / example / llm）、
+# LLM の呼び出しは llm スパン（トークン使用量を含む）として記録されます。
 # =============================================================================
 
-import json
-from openai import AzureOpenAI
-from core.config import secret
-from core.schema import SCHEMA_HINT
-from core.db import find_empcode_by_name
-
-# OpenAIクライアント設定
-client = AzureOpenAI(
-    api_version="2024-05-01-preview",
-    azure_endpoint=secret("AZURE_OPENAI_ENDPOINT"),
-    api_key=secret("AZURE_OPENAI_API_KEY"),
+import asyncio
+import re
+import threading
+import time
+
+from core.schema import get_schema_hint
+from core.analytics import BY, GRAINS
+from core.dialect import backend_name, dialect_rules
+from core.employee import find_employees
+from core.name_index import get_name_index
+from core.nl_cache import NLCache, get_nl_cache
+from core.sql_examples import get_sql_examples
+from core.llm_async import get_llm_gateway
+from core.tracing import current_span, span
+from core.llm_backend import (
+    EMP_USAGE_RE,
+    SEATMAP_RE,
+    WITH_NAMES_RE,
+    LLMReply,
+)
+
+# 集計・条件付きの質問は高速判定せず LLM に任せる
+ANALYTIC_RE = re.compile(
+    r"一覧|件数|何件|何回|集計|合計|平均|ランキング|順位|比較|推移|割合|率|"
+    r"部署|エリア|以上|以下|多い|少ない|最も|一番|昨日|先週|先月|今月|今週|年|日別|週別"
 )
-deployment = secret("AZURE_OPENAI_DEPLOYMENT")
+
+_stats_lock = threading.Lock()
+_fast_stats = {
+    "fast_hits": 0,
+    "fast_misses": 0,
+    "fast_seconds": 0.0,
+    "llm_calls": 0,
+    "llm_seconds": 0.0,
+}
 
 
 def get_functions():
     return [
         {
             "name": "to_sql",
-            "description": "自然言語から読み取り専用のT-SQL SELECT文を生成します。",
+            "description": f"自然言語から読み取り専用の{dialect_rules()['label']} SELECT文を生成します。",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -58,6 +102,33 @@ def get_functions():
                         "type": "string",
                         "enum": ["with_names"],
                         "description": "社員名を表示したい場合は 'with_names' を指定"
+                    },
+                    "area": {
+                        "type": "string",
+                        "description": "特定のエリア（フロア・島など）の座席マップを見たい場合のエリア名"
+                    }
+                }
+            }
+        },
+        {
+            "name": "show_utilization",
+            "description": "席・エリア・部署ごとの利用率（時間帯・曜日別）、同時在席数のピーク、使われていない席を表示します。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "by": {
+                        "type": "string",
+                        "enum": list(BY),
+                        "description": "集計の単位（席 / エリア / 部署）"
+                    },
+                    "grain": {
+                        "type": "string",
+                        "enum": list(GRAINS),
+                        "description": "期間合計 / 時間帯別 / 曜日別 / 時間帯×曜日"
+                    },
+                    "days": {
+                        "type": "integer",
+                        "description": "直近何日分を集計するか（既定 28）"
                     }
                 }
             }
@@ -69,68 +140,226 @@ def generate_semantic_sql(nl: str) -> dict:
     """
     自然言語の質問をFunction Callingまたは通常出力で解析し、
     SQL/グラフ/マップ/雑談のいずれかを返す。
+    定型の質問はルールで判定し、それ以外の判定結果はキャッシュして
+    同じ質問には即座に同じ結果を返す。
     """
-    system = (
-        "あなたは社内データに関するAIアシスタントです。\n"
-        "次のように処理を分類してください：\n"
-        "- 座席に関する質問 → show_seatmap\n"
-        "- ○○さんの利用状況 → show_emp_usage_chart\n"
-        "- データ参照や集計 → to_sql\n"
-        "- 雑談（天気・挨拶など） → 通常のメッセージとして返答\n"
-        "SELECT以外のSQL（INSERT/UPDATE/DELETE）は絶対に生成しないでください。"
-    )
-
-    messages = [
-        {"role": "system", "content": system + "\n\n" + SCHEMA_HINT},
-        {"role": "user", "content": nl}
-    ]
+    with span("classify") as s:
+        early = _classify_without_llm(nl)
+        if early is not None:
+            s.set(result=early["type"])
+            return early
+
+        started = time.perf_counter()
+        result = _classify_with_llm(nl)
+        _finish_llm(nl, result, started)
+        s.set(path="llm", result=result["type"])
+    return result
 
+
+async def generate_semantic_sql_async(nl: str) -> dict:
+    """generate_semantic_sql() の非同期版（イベントループを止めずに LLM を待つ）"""
+    early = _classify_without_llm(nl)
+    if early is not None:
+        return early
+
+    started = time.perf_counter()
     try:
-        rsp = client.chat.completions.create(
-            model=deployment,
-            messages=messages,
-            functions=get_functions(),
-            function_call="auto",
-            temperature=0
+        reply = await get_llm_gateway().complete(
+            NLCache.make_key(nl, get_schema_hint())[0], build_messages(nl), get_functions()
         )
+        # 社員名の解決で DB を参照するため、ループ外のスレッドで変換する
+        result = await asyncio.to_thread(parse_reply, reply)
+    except Exception as e:
+        result = {"type": "error", "message": str(e) or type(e).__name__}
+    _finish_llm(nl, result, started)
+    return result
+
+
+def _classify_without_llm(nl: str) -> dict | None:
+    """高速判定 → キャッシュの順に、LLM を使わずに返せる結果を探す"""
+    started = time.perf_counter()
+    fast = classify_fast(nl)
+    elapsed = time.perf_counter() - started
+    with _stats_lock:
+        _fast_stats["fast_hits" if fast else "fast_misses"] += 1
+        _fast_stats["fast_seconds"] += elapsed
+    if fast is not None:
+        current_span().set(path="fast")
+        return fast
+    cached = get_nl_cache().get(nl, get_schema_hint())
+    if cached is not None:
+        current_span().set(path="cache")
+        return cached
+    example = get_sql_examples().reusable(nl, backend_name(), get_schema_hint())
+    if example is not None:
+        current_span().set(path="example")
+        return {"type": "sql", "sql": example["sql"], "reused": True}
+    return None
+
+
+def _finish_llm(nl: str, result: dict, started: float):
+    """LLM 判定の統計を記録し、結果をキャッシュする"""
+    with _stats_lock:
+        _fast_stats["llm_calls"] += 1
+        _fast_stats["llm_seconds"] += time.perf_counter() - started
+    get_nl_cache().put(nl, get_schema_hint(), result)
+
+
+def classify_fast(nl: str) -> dict | None:
+    """
+    LLM を使わずに判定できる質問ならその結果を返す（できなければ None）。
+
+    - 「○○さんの利用状況」: 社員一覧から氏名を照合し、1名に特定できた場合のみ chart
+    - 座席マップ系の質問 : seatmap（「誰」「名前」を含めば with_names）
+    集計・条件付きの質問や、社員が特定できない場合は None（LLM に任せる）。
+    社員名インデックスを一度も読み込めていない場合も、候補がないため None（LLM に任せる）。
+    """
+    if ANALYTIC_RE.search(nl):
+        return None
+
+    m = EMP_USAGE_RE.search(nl)
+    if m:
+        candidates = find_employees(m.group("name"))
+        if len(candidates) != 1:
+            return None
+        emp_code, name = candidates[0]
+        return {"type": "chart", "emp_code": emp_code, "name": name}
 
-        message = rsp.choices[0].message
+    if SEATMAP_RE.search(nl):
+        if WITH_NAMES_RE.search(nl):
+            return {"type": "seatmap", "detail": "with_names"}
+        return {"type": "seatmap"}
 
-        # 関数呼び出しされた場合
-        if message.function_call:
-            func_name = message.function_call.name
-            args = json.loads(message.function_call.arguments)
+    return None
 
-            if func_name == "to_sql":
-                return {"type": "sql", "sql": args["sql"]}
 
-            elif func_name == "show_emp_usage_chart":
-                emp_code = args.get("emp_code")
-                name = args.get("name", "")
-                if not emp_code and name:
-                    found = find_empcode_by_name(name)
-                    if found:
-                        emp_code, name = found
-                    else:
-                        return {"type": "error", "message": f"該当する社員が見つかりません（{name}）"}
+def fast_path_stats() -> dict:
+    """
+    高速判定の統計。
+
+    - fast_hit_ratio : 高速判定で返せた割合
+    - fast_avg_ms    : 高速判定1回あたりの平均時間
+    - llm_avg_ms     : LLM 判定1回あたりの平均時間
+    - saved_seconds  : 高速判定で省略できた LLM 時間の推定値
+    """
+    with _stats_lock:
+        s = dict(_fast_stats)
+    total = s["fast_hits"] + s["fast_misses"]
+    llm_avg = s["llm_seconds"] / s["llm_calls"] if s["llm_calls"] else 0.0
+    return {
+        **s,
+        "fast_hit_ratio": s["fast_hits"] / total if total else 0.0,
+        "fast_avg_ms": s["fast_seconds"] / total * 1000 if total else 0.0,
+        "llm_avg_ms": llm_avg * 1000,
+        "saved_seconds": s["fast_hits"] * llm_avg,
+    }
 
-                # nameが空ならemp_codeを補完表示
-                if not name and emp_code:
-                    name = emp_code
 
-                return {"type": "chart", "emp_code": emp_code, "name": name}
+SYSTEM_PROMPT = (
+    "あなたは社内データに関するAIアシスタントです。\n"
+    "次のように処理を分類してください：\n"
+    "- 座席に関する質問 → show_seatmap\n"
+    "- ○○さんの利用状況 → show_emp_usage_chart\n"
+    "- 部署別・エリア別・席別の利用率、混雑する時間帯や曜日、使われていない席 → show_utilization\n"
+    "- データ参照や集計 → to_sql\n"
+    "- 雑談（天気・挨拶など） → 通常のメッセージとして返答\n"
+    "SELECT以外のSQL（INSERT/UPDATE/DELETE）は絶対に生成しないでください。"
+)
 
-            elif func_name == "show_seatmap":
-                detail = args.get("detail")
-                if detail == "with_names":
-                    return {"type": "seatmap", "detail": "with_names"}
-                return {"type": "seatmap"}
 
-        # 関数呼び出しが無く、通常の応答（=雑談）
-        if message.content:
-            return {"type": "chat", "message": message.content}
+def build_messages(nl: str) -> list[dict]:
+    """LLM に渡すメッセージを組み立てる（似た質問の SQL の例があれば追加）"""
+    system = SYSTEM_PROMPT + "\n\n" + get_schema_hint()
+    examples = get_sql_examples().prompt_section(nl, backend_name())
+    if examples:
+        system += "\n\n" + examples
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": nl}
+    ]
 
-        return {"type": "error", "message": "AIが正しく応答できませんでした。"}
 
+def _classify_with_llm(nl: str) -> dict:
+    """LLM ゲートウェイ経由で問い合わせて判定する（キャッシュなし）"""
+    try:
+        # ゲートウェイは別スレッドのイベントループで動くため、スパンは呼び出し側で計測する
+        with span("llm") as s:
+            reply = get_llm_gateway().complete_sync(
+                NLCache.make_key(nl, get_schema_hint())[0], build_messages(nl), get_functions()
+            )
+            s.set(**reply.usage)
+        return parse_reply(reply)
     except Exception as e:
-        return {"type": "error", "message": str(e)}
+        return {"type": "error", "message": str(e) or type(e).__name__}
+
+
+def parse_reply(reply: LLMReply) -> dict:
+    """
+    バックエンドの応答を app.py 用の結果 dict に変換する
+    （副バックエンドの応答には "fallback": True を付け、キャッシュ・例の記録の対象外にする）
+    """
+    result = _parse_reply(reply)
+    if reply.fallback:
+        result["fallback"] = True
+    return result
+
+
+def _parse_reply(reply: LLMReply) -> dict:
+    # 関数呼び出しされた場合
+    if reply.function_name:
+        func_name = reply.function_name
+        args = reply.arguments
+
+        if func_name == "to_sql":
+            return {"type": "sql", "sql": args["sql"]}
+
+        elif func_name == "show_emp_usage_chart":
+            emp_code = args.get("emp_code")
+            name = args.get("name", "")
+            if not emp_code and name:
+                found = find_employees(name)
+                if not found and not get_name_index().ready():
+                    return {"type": "error", "message": f"社員一覧を読み込めないため、社員を特定できません（{name}）。"}
+                if not found:
+                    return {"type": "error", "message": f"該当する社員が見つかりません（{name}）"}
+                if len(found) > 1:
+                    listed = "、".join(f"{n}（{c}）" for c, n in found[:10])
+                    return {
+                        "type": "error",
+                        "message": f"「{name}」に該当する社員が複数います：{listed}。フルネームで指定してください。",
+                    }
+                emp_code, name = found[0]
+
+            # nameが空ならemp_codeを補完表示
+            if not name and emp_code:
+                name = emp_code
+
+            return {"type": "chart", "emp_code": emp_code, "name": name}
+
+        elif func_name == "show_seatmap":
+            result = {"type": "seatmap"}
+            if args.get("detail") == "with_names":
+                result["detail"] = "with_names"
+            if args.get("area"):
+                result["area"] = args["area"]
+            return result
+
+        elif func_name == "show_utilization":
+            # enum 以外の値が返ることもあるため、画面で使う前にここで確かめる
+            by = args.get("by") or "area"
+            grain = args.get("grain") or "hour"
+            if by not in BY or grain not in GRAINS:
+                return {"type": "error", "message": f"利用率の集計単位・期間の指定が正しくありません（by={by}, grain={grain}）。"}
+            try:
+                days = int(args.get("days") or 28)
+            except (TypeError, ValueError):
+                return {"type": "error", "message": f"利用率の集計日数が正しくありません（days={args.get('days')}）。"}
+            if days <= 0:
+                return {"type": "error", "message": f"利用率の集計日数は 1 以上を指定してください（days={days}）。"}
+            return {"type": "utilization", "by": by, "grain": grain, "days": days}
+
+    # 関数呼び出しが無く、通常の応答（=雑談）
+    if reply.content:
+        return {"type": "chat", "message": reply.content}
+
+    return {"type": "error", "message": "AIが正しく応答できませんでした。"}
@@ -0,0 +1,249 @@
+# =============================================================================
+# result_cache.py - SQL実行結果のキャッシュ（データ更新の検知で無効化）
+# -----------------------------------------------------------------------------
+# 同じ SQL（例：部署別の集計）をユーザーごとに再実行しないよう、結果を
+# 圧縮したバイト列としてプロセス内に保持します。
+#
+# 主な機能：
+# - キー：正規化した SQL（コメント除去・空白の統一・キーワードの大文字化）＋パラメータ
+#   参照テーブルは core/sql_guard.py の字句解析で集める（FROM A, B のカンマ結合も含む）
+#   GETDATE() / NEWID() など実行のたびに結果が変わる SQL はキャッシュしない
+# - 保存形式：Arrow IPC（zstd 圧縮、pyarrow がない環境では圧縮 pickle）
+#   列名の重複や型の混在した列などで変換できない結果は、キャッシュせずにそのまま返す
+# - 容量（バイト数）上限付きの LRU
+# - 無効化：TTL ではなく、参照テーブルごとのデータバージョン
+#   （SeatLog は MAX(LogId)（主キーのシーク）、マスタは件数＋チェックサム、
+#     SeatLogMonthly は集計ウォーターマーク）を確認し、変わっていればミス扱い
+#   バージョン確認自体も probe_interval 秒はキャッシュする
+#   既存行の更新（チェックアウト）は MAX(LogId) に現れないため、core/occupancy.py の
+#   ポーラーがチェックアウトを見つけたときに invalidate("SEATLOG") で明示的に無効化する
+# - 統計：件数・サイズ・ヒット率・節約したバイト数
+#
+# 設定（secrets / 環境変数）：
+#   RESULT_CACHE_MAX_MB       : キャッシュ全体の上限（既定 64MB）
+#   RESULT_CACHE_PROBE_SECONDS: データバージョン確認の間隔（既定 5秒）
+# =============================================================================
+
+import hashlib
+import io
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import sqlalchemy as sa
+import streamlit as st
+from core.config import secret
+from core.db import get_engine
+from core.dialect import checksum_agg, employee, rollup_state, seat, seatlog
+from core.metrics import db_origin
+from core.occupancy import get_occupancy_snapshot
+from core.sql_guard import table_references, tokenize
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow がなければ pickle で保存
+    pa = None
+
+# 保存形式に変換できない結果（列名の重複・無名列・型の混在した列など）で出る例外
+SERIALIZE_ERRORS = (ValueError, TypeError) + ((pa.ArrowException,) if pa is not None else ())
+
+# テーブル名（大文字）→ データバージョン確認用クエリ
+VERSION_PROBES = {
+    "SEATLOG": sa.select(sa.func.max(seatlog.c.LogId)),
+    "SEAT": sa.select(sa.func.count(), checksum_agg(*seat.c)),
+    "EMPLOYEE": sa.select(sa.func.count(), checksum_agg(*employee.c)),
+    "SEATLOGMONTHLY": sa.select(rollup_state.c.LastLogId, rollup_state.c.UpdatedAt).where(rollup_state.c.Id == 1),
+}
+
+# 実行のたびに結果が変わる関数（含む SQL はキャッシュしない）。SQLite の date('now') は文字列で判定
+NONDETERMINISTIC = {
+    "GETDATE", "GETUTCDATE", "SYSDATETIME", "SYSUTCDATETIME", "SYSDATETIMEOFFSET", "CURRENT_TIMESTAMP",
+    "CURRENT_DATE", "CURRENT_TIME", "NOW", "NEWID", "NEWSEQUENTIALID", "RAND", "RANDOM", "CRYPT_GEN_RANDOM",
+}
+
+
+def canonicalize_sql(sql: str) -> tuple[str, set[str], bool]:
+    """
+    キャッシュキー用に SQL を正規化し、参照しているテーブル名も返す。
+    文字列リテラル・[識別子] はそのまま残す。
+
+    Returns:
+        (正規化したSQL, 参照テーブル名の集合（大文字）,
+         キャッシュ可能か（参照先がすべて既知のテーブルか CTE で、現在時刻・乱数の関数を使っていない）)
+    """
+    parts = []
+    sig = []
+    for kind, text, _ in tokenize(sql):
+        if kind in ("ws", "comment"):
+            continue
+        if kind == "word":
+            text = text.upper()
+        parts.append(text)
+        name = text[1:-1].upper() if kind == "ident" else text
+        sig.append((kind, name))
+
+    ctes = set()
+    volatile = False
+    for i, (kind, text) in enumerate(sig):
+        # WITH x AS ( ... ) / , y AS ( ... ) の CTE 名
+        if text == "AS" and i >= 1 and i + 1 < len(sig) and sig[i + 1][1] == "(" \
+                and i >= 2 and sig[i - 2][1] in ("WITH", ","):
+            ctes.add(sig[i - 1][1])
+        if (kind == "word" and text in NONDETERMINISTIC) or (kind == "string" and text.lower() == "'now'"):
+            volatile = True
+    tables, unknown = set(), set()
+    for name in table_references(sql):
+        (tables if name in VERSION_PROBES else unknown).add(name)
+    unknown -= ctes
+    return " ".join(parts).rstrip(" ;"), tables, bool(tables) and not unknown and not volatile
+
+
+def _dumps(df: pd.DataFrame) -> bytes:
+    if pa is not None:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = io.BytesIO()
+        options = pa.ipc.IpcWriteOptions(compression="zstd")
+        with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+        return sink.getvalue()
+    buf = io.BytesIO()
+    df.to_pickle(buf, compression="gzip")
+    return buf.getvalue()
+
+
+def _loads(blob: bytes) -> pd.DataFrame:
+    if pa is not None:
+        return pa.ipc.open_stream(blob).read_all().to_pandas()
+    return pd.read_pickle(io.BytesIO(blob), compression="gzip")
+
+
+class ResultCache:
+    """SQL結果のキャッシュ（容量上限付き LRU・データバージョンで無効化）"""
+
+    def __init__(self, engine, max_bytes: int = 64 * 1024 * 1024, probe_interval: float = 5.0):
+        self.engine = engine
+        self.max_bytes = max_bytes
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        # key → (圧縮データ, バージョン, 圧縮後サイズ, 展開後サイズ, attrs)
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        self._versions: dict[str, tuple[float, tuple]] = {}
+        self._generations: dict[str, int] = {}  # invalidate() の回数（バージョンの一部）
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.bytes_saved = 0
+        self.raw_bytes = 0
+
+    def data_version(self, tables: set[str]) -> tuple:
+        """参照テーブルのデータバージョン（probe_interval 秒はキャッシュ）"""
+        now = time.time()
+        versions = []
+        for table in sorted(tables):
+            cached = self._versions.get(table)
+            if cached is None or now - cached[0] > self.probe_interval:
+                with db_origin("cache_probe"), self.engine.connect() as conn:
+                    row = tuple(str(v) for v in conn.execute(VERSION_PROBES[table]).fetchone() or ())
+                cached = (now, row)
+                self._versions[table] = cached
+            versions.append((table, self._generations.get(table, 0), cached[1]))
+        return tuple(versions)
+
+    def invalidate(self, *tables: str):
+        """
+        確認用クエリに現れない更新（チェックアウトなど）があったテーブルのキャッシュを無効にする。
+        該当テーブルを参照するエントリは、次の参照時にミス扱いになる。
+        """
+        with self._lock:
+            for table in tables:
+                table = table.upper()
+                self._generations[table] = self._generations.get(table, 0) + 1
+                self._versions.pop(table, None)
+
+    def get_or_run(self, sql: str, run, params: dict | None = None) -> pd.DataFrame:
+        """
+        キャッシュにあればそれを返し、なければ run() を実行して保存する。
+        既知のテーブル（Seat/Employee/SeatLog/SeatLogMonthly）だけを参照する SQL が対象。
+        """
+        canonical, tables, cacheable = canonicalize_sql(sql)
+        if not cacheable:
+            return run()
+        key = hashlib.sha256(
+            (canonical + "\n" + json.dumps(params or {}, sort_keys=True, default=str)).encode("utf-8")
+        ).hexdigest()
+        version = self.data_version(tables)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.bytes_saved += entry[3]
+                blob, attrs = entry[0], entry[4]
+            else:
+                if entry is not None:
+                    self.stale += 1
+                    self._drop(key)
+                self.misses += 1
+                blob = None
+        if blob is not None:
+            df = _loads(blob)
+            df.attrs.update(attrs)
+            return df
+
+        df = run()
+        try:
+            blob = _dumps(df)
+        except SERIALIZE_ERRORS:  # 保存できない結果はキャッシュせずそのまま返す
+            return df
+        raw = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            if len(blob) <= self.max_bytes:
+                self._entries[key] = (blob, version, len(blob), raw, dict(df.attrs))
+                self.bytes += len(blob)
+                self.raw_bytes += raw
+                while self.bytes > self.max_bytes:
+                    self._drop(next(iter(self._entries)))
+        return df
+
+    def _drop(self, key: str):
+        blob, _, size, raw, _ = self._entries.pop(key)
+        self.bytes -= size
+        self.raw_bytes -= raw
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self.bytes = self.raw_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "compression_ratio": self.raw_bytes / self.bytes if self.bytes else 0.0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_rate": self.hits / total if total else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "format": "arrow-ipc+zstd" if pa is not None else "pickle+gzip",
+            }
+
+
+@st.cache_resource
+def get_result_cache() -> ResultCache:
+    """全セッションで共有する結果キャッシュ（チェックアウトの検知で SeatLog を無効化）"""
+    cache = ResultCache(
+        get_engine(),
+        max_bytes=int(float(secret("RESULT_CACHE_MAX_MB", "64")) * 1024 * 1024),
+        probe_interval=float(secret("RESULT_CACHE_PROBE_SECONDS", "5")),
+    )
+    get_occupancy_snapshot().add_listener(lambda: cache.invalidate("SEATLOG"))
+    return cache
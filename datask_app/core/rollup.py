@@ -0,0 +1,473 @@
+# =============================================================================
+# rollup.py - SeatLog の月次集計テーブル（SeatLogMonthly）の増分メンテナンス
+# -----------------------------------------------------------------------------
+# 月別グラフや部署別集計のたびに SeatLog 全体を FORMAT(...) で集計しないよう、
+# (EmpCode, Month, SeatId) 単位の集計を SeatLogMonthly に保持します。
+#
+# テーブル：
+# - dbo.SeatLogMonthly       : EmpCode, Month('yyyy-MM'), SeatId, Dept, UsageCount, TotalMinutes
+# - dbo.SeatLogRollupState   : 集計済みの最大 LogId（ウォーターマーク）
+# - dbo.SeatLogRollupPending : 集計時点でチェックアウト前だった LogId
+#                              （チェックアウト後に TotalMinutes を加算するため）
+#
+# 増分更新（refresh）：
+#   1. Pending のうちチェックアウト済みになった行の利用時間を加算
+#   2. ウォーターマークより新しい SeatLog を集計して MERGE、未チェックアウト行は Pending へ
+#   3. ウォーターマークを進める
+# 同時実行への対策：
+# - 更新するトランザクションは先頭でアプリケーションロック（sp_getapplock 'datask_rollup'）を取り、
+#   ウォーターマークの読み取り（UPDLOCK, HOLDLOCK）・MERGE・ウォーターマークの更新を直列にする
+#   （複数のアプリのプロセスや CLI から同時に refresh しても二重に加算しない）
+# - LogId（IDENTITY）は採番順にコミットされるとは限らないため、最大 LogId から
+#   ROLLUP_SAFETY_ROWS（既定 1000）件手前までだけを集計し、SeatLog は READCOMMITTEDLOCK で読む
+#   （コミット前の行を飛ばしてウォーターマークを進めない。残りは次回の refresh で集計し、
+#     それまでグラフはウォーターマーク以降を SeatLog から集計する）
+# 集計は CheckIn の月（CONVERT(char(7), CheckIn, 126)）単位。
+# MERGE・一時テーブルを使うため SQL Server 専用（SQLite / DuckDB では bench.datagen が集計を作成）。
+#
+# アプリからの更新：
+#   get_rollup_refresher().maybe_refresh() を質問の処理ごとに呼ぶと、前回から ROLLUP_REFRESH_SECONDS
+#   （既定 300）以上たっていれば、バックグラウンドのスレッドで refresh_rollup を実行する
+#   （SQL Server で、集計テーブルが作成済みの場合のみ。作成は init / backfill で行う）。
+# rollup_status() は集計テーブルの有無と最終更新からの経過秒数を返す（ROLLUP_STATUS_SECONDS ごとに確認）。
+# スキーマヒントは、最終更新が ROLLUP_MAX_AGE_MINUTES（既定 30）以内のときだけ SeatLogMonthly を案内し、
+# グラフは集計テーブルがなければ SeatLog だけから集計する。
+#
+# コマンド（datask_app ディレクトリで実行）：
+#   python -m core.rollup init                         # テーブル作成
+#   python -m core.rollup backfill                     # 全件を集計し直す
+#   python -m core.rollup refresh                      # 増分更新
+#   python -m core.rollup refresh --safety-rows 0      # 最大 LogId まで集計（書き込みが止まっているとき）
+#   python -m core.rollup rebuild --from 2025-01 --to 2025-05   # 指定月だけ集計し直す
+#   python -m core.rollup reconcile                    # 生ログとの突き合わせ
+# =============================================================================
+
+import argparse
+import logging
+import threading
+import time
+from datetime import date, datetime
+
+import pandas as pd
+import sqlalchemy as sa
+import streamlit as st
+from core.config import secret
+from core.dialect import rollup_state, seatlog_monthly
+from core.metrics import db_origin
+
+logger = logging.getLogger(__name__)
+
+MONTH_EXPR = "CONVERT(char(7), {col}, 126)"
+
+LOCK_RESOURCE = "datask_rollup"
+
+# トランザクションの間だけ保持するアプリケーションロック（取れなければ負の値）
+APPLOCK_SQL = """
+SET NOCOUNT ON;
+DECLARE @result int;
+EXEC @result = sp_getapplock @Resource = :resource, @LockMode = 'Exclusive',
+                             @LockOwner = 'Transaction', @LockTimeout = :timeout_ms;
+SELECT @result;
+"""
+
+DDL = [
+    """
+    IF OBJECT_ID('dbo.SeatLogMonthly') IS NULL
+    CREATE TABLE dbo.SeatLogMonthly (
+        EmpCode      varchar(10)  NOT NULL,
+        Month        char(7)      NOT NULL,
+        SeatId       int          NOT NULL,
+        Dept         nvarchar(30) NULL,
+        UsageCount   int          NOT NULL,
+        TotalMinutes bigint       NOT NULL,
+        CONSTRAINT PK_SeatLogMonthly PRIMARY KEY (EmpCode, Month, SeatId)
+    )
+    """,
+    """
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_SeatLogMonthly_Month')
+    CREATE INDEX IX_SeatLogMonthly_Month ON dbo.SeatLogMonthly (Month)
+        INCLUDE (Dept, UsageCount, TotalMinutes)
+    """,
+    """
+    IF OBJECT_ID('dbo.SeatLogRollupState') IS NULL
+    CREATE TABLE dbo.SeatLogRollupState (
+        Id        tinyint   NOT NULL PRIMARY KEY,
+        LastLogId int       NOT NULL,
+        UpdatedAt datetime2 NOT NULL
+    )
+    """,
+    """
+    IF OBJECT_ID('dbo.SeatLogRollupPending') IS NULL
+    CREATE TABLE dbo.SeatLogRollupPending (LogId int NOT NULL PRIMARY KEY)
+    """,
+    """
+    IF NOT EXISTS (SELECT 1 FROM dbo.SeatLogRollupState WHERE Id = 1)
+    INSERT INTO dbo.SeatLogRollupState (Id, LastLogId, UpdatedAt) VALUES (1, 0, SYSUTCDATETIME())
+    """,
+]
+
+# 集計対象の行（#RollupSource）を月次集計に MERGE する
+MERGE_SQL = f"""
+MERGE dbo.SeatLogMonthly AS T
+USING (
+    SELECT R.EmpCode, {MONTH_EXPR.format(col="R.CheckIn")} AS Month, R.SeatId,
+           MAX(E.Dept) AS Dept,
+           SUM(R.Counted) AS UsageCount,
+           SUM(CASE WHEN R.CheckOut IS NULL THEN 0
+                    ELSE DATEDIFF(minute, R.CheckIn, R.CheckOut) END) AS TotalMinutes
+    FROM #RollupSource R
+    LEFT JOIN dbo.Employee E ON E.EmpCode = R.EmpCode
+    GROUP BY R.EmpCode, {MONTH_EXPR.format(col="R.CheckIn")}, R.SeatId
+) AS S
+ON T.EmpCode = S.EmpCode AND T.Month = S.Month AND T.SeatId = S.SeatId
+WHEN MATCHED THEN UPDATE SET
+    UsageCount = T.UsageCount + S.UsageCount,
+    TotalMinutes = T.TotalMinutes + S.TotalMinutes,
+    Dept = COALESCE(S.Dept, T.Dept)
+WHEN NOT MATCHED THEN
+    INSERT (EmpCode, Month, SeatId, Dept, UsageCount, TotalMinutes)
+    VALUES (S.EmpCode, S.Month, S.SeatId, S.Dept, S.UsageCount, S.TotalMinutes);
+"""
+
+CREATE_SOURCE_SQL = """
+CREATE TABLE #RollupSource (
+    LogId int NOT NULL, EmpCode varchar(10) NOT NULL, SeatId int NOT NULL,
+    CheckIn datetime2 NOT NULL, CheckOut datetime2 NULL, Counted int NOT NULL
+)
+"""
+
+
+def init_rollup(engine):
+    """集計用テーブルを作成する（既にあれば何もしない）"""
+    with engine.begin() as conn:
+        for ddl in DDL:
+            conn.execute(sa.text(ddl))
+
+
+def lock_rollup(conn, timeout_ms: int | None = None):
+    """
+    集計を更新するトランザクションの先頭で呼び、アプリケーションロックを取る
+    （コミット・ロールバックで解放。timeout_ms 以内に取れなければ RuntimeError）
+    """
+    if timeout_ms is None:
+        timeout_ms = int(float(secret("ROLLUP_LOCK_TIMEOUT_SECONDS", "60")) * 1000)
+    result = conn.execute(sa.text(APPLOCK_SQL), {"resource": LOCK_RESOURCE, "timeout_ms": timeout_ms}).scalar()
+    if result is None or result < 0:
+        raise RuntimeError(f"月次集計のロックを取得できませんでした（sp_getapplock={result}）")
+
+
+def get_watermark(conn, for_update: bool = False) -> int:
+    """集計済みの最大 LogId（for_update=True ならトランザクションの終わりまで更新ロックを保持）"""
+    hint = " WITH (UPDLOCK, HOLDLOCK)" if for_update else ""
+    return conn.execute(sa.text(f"SELECT LastLogId FROM dbo.SeatLogRollupState{hint} WHERE Id = 1")).scalar() or 0
+
+
+def _merge_source(conn):
+    """#RollupSource の内容を SeatLogMonthly に反映して空にする"""
+    conn.execute(sa.text(MERGE_SQL))
+    conn.execute(sa.text("TRUNCATE TABLE #RollupSource"))
+
+
+def refresh_rollup(engine, batch_size: int = 200_000, safety_rows: int | None = None) -> dict:
+    """
+    ウォーターマーク以降の SeatLog を月次集計に反映する（増分更新）。
+    batch_size 件ずつ別トランザクションで処理するため、大量のバックフィルでも
+    ロックを長時間保持しない。
+    最大 LogId から safety_rows 件（既定 ROLLUP_SAFETY_ROWS）手前までを集計する。
+
+    Returns:
+        {"new_rows": n, "closed_rows": n, "last_log_id": n, "seconds": s}
+    """
+    if safety_rows is None:
+        safety_rows = int(secret("ROLLUP_SAFETY_ROWS", "1000"))
+    started = time.perf_counter()
+    new_rows = closed_rows = 0
+
+    # 1. 集計時にチェックアウト前だった行の利用時間を加算
+    with engine.begin() as conn:
+        lock_rollup(conn)
+        conn.execute(sa.text(CREATE_SOURCE_SQL))
+        closed_rows = conn.execute(sa.text("""
+            INSERT INTO #RollupSource (LogId, EmpCode, SeatId, CheckIn, CheckOut, Counted)
+            SELECT L.LogId, L.EmpCode, L.SeatId, L.CheckIn, L.CheckOut, 0
+            FROM dbo.SeatLogRollupPending P
+            JOIN dbo.SeatLog L WITH (READCOMMITTEDLOCK) ON L.LogId = P.LogId
+            WHERE L.CheckOut IS NOT NULL
+        """)).rowcount
+        if closed_rows:
+            conn.execute(sa.text(
+                "DELETE P FROM dbo.SeatLogRollupPending P JOIN #RollupSource R ON R.LogId = P.LogId"
+            ))
+            _merge_source(conn)
+        conn.execute(sa.text("DROP TABLE #RollupSource"))
+
+    # 2. 新しい行をバッチごとに集計
+    with engine.connect() as conn:
+        high = conn.execute(sa.text("SELECT MAX(LogId) FROM dbo.SeatLog")).scalar() or 0
+    high = max(0, high - safety_rows)
+    while True:
+        with engine.begin() as conn:
+            lock_rollup(conn)
+            last = get_watermark(conn, for_update=True)
+            if last >= high:
+                break
+            upper = min(high, last + batch_size)
+            conn.execute(sa.text(CREATE_SOURCE_SQL))
+            # 一度一時テーブルに取り出し、集計と Pending 登録で同じ行集合を使う
+            new_rows += conn.execute(sa.text("""
+                INSERT INTO #RollupSource (LogId, EmpCode, SeatId, CheckIn, CheckOut, Counted)
+                SELECT LogId, EmpCode, SeatId, CheckIn, CheckOut, 1
+                FROM dbo.SeatLog WITH (READCOMMITTEDLOCK)
+                WHERE LogId > :last AND LogId <= :upper
+            """), {"last": last, "upper": upper}).rowcount
+            conn.execute(sa.text("""
+                INSERT INTO dbo.SeatLogRollupPending (LogId)
+                SELECT LogId FROM #RollupSource WHERE CheckOut IS NULL
+            """))
+            _merge_source(conn)
+            conn.execute(sa.text("DROP TABLE #RollupSource"))
+            conn.execute(sa.text(
+                "UPDATE dbo.SeatLogRollupState SET LastLogId = :upper, UpdatedAt = SYSUTCDATETIME() WHERE Id = 1"
+            ), {"upper": upper})
+
+    return {
+        "new_rows": new_rows,
+        "closed_rows": closed_rows,
+        "last_log_id": high,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def backfill_rollup(engine, batch_size: int = 200_000, safety_rows: int | None = None) -> dict:
+    """月次集計を空にして SeatLog 全件から作り直す"""
+    init_rollup(engine)
+    with engine.begin() as conn:
+        lock_rollup(conn)
+        conn.execute(sa.text("TRUNCATE TABLE dbo.SeatLogMonthly"))
+        conn.execute(sa.text("TRUNCATE TABLE dbo.SeatLogRollupPending"))
+        conn.execute(sa.text(
+            "UPDATE dbo.SeatLogRollupState SET LastLogId = 0, UpdatedAt = SYSUTCDATETIME() WHERE Id = 1"
+        ))
+    return refresh_rollup(engine, batch_size=batch_size, safety_rows=safety_rows)
+
+
+def _month_bounds(start_month: str, end_month: str) -> tuple[date, date]:
+    """'2025-01', '2025-05' → (2025-01-01, 2025-06-01)（終端は翌月1日、含まない）"""
+    y1, m1 = map(int, start_month.split("-"))
+    y2, m2 = map(int, end_month.split("-"))
+    end = date(y2 + (m2 == 12), m2 % 12 + 1, 1)
+    return date(y1, m1, 1), end
+
+
+def rebuild_rollup_range(engine, start_month: str, end_month: str) -> dict:
+    """
+    指定した月の範囲（両端を含む）だけ集計し直す。
+    ウォーターマーク以前の行が対象（それ以降は次回の refresh で反映）。
+    """
+    start, end = _month_bounds(start_month, end_month)
+    params = {"start": start, "end": end, "m1": start_month, "m2": end_month}
+    with engine.begin() as conn:
+        lock_rollup(conn)
+        last = get_watermark(conn, for_update=True)
+        params["last"] = last
+        deleted = conn.execute(sa.text(
+            "DELETE FROM dbo.SeatLogMonthly WHERE Month >= :m1 AND Month <= :m2"
+        ), params).rowcount
+        conn.execute(sa.text("""
+            DELETE P FROM dbo.SeatLogRollupPending P
+            JOIN dbo.SeatLog L ON L.LogId = P.LogId
+            WHERE L.CheckIn >= :start AND L.CheckIn < :end
+        """), params)
+        conn.execute(sa.text(CREATE_SOURCE_SQL))
+        rows = conn.execute(sa.text("""
+            INSERT INTO #RollupSource (LogId, EmpCode, SeatId, CheckIn, CheckOut, Counted)
+            SELECT LogId, EmpCode, SeatId, CheckIn, CheckOut, 1
+            FROM dbo.SeatLog WITH (READCOMMITTEDLOCK)
+            WHERE CheckIn >= :start AND CheckIn < :end AND LogId <= :last
+        """), params).rowcount
+        conn.execute(sa.text("""
+            INSERT INTO dbo.SeatLogRollupPending (LogId)
+            SELECT LogId FROM #RollupSource WHERE CheckOut IS NULL
+        """))
+        _merge_source(conn)
+        conn.execute(sa.text("DROP TABLE #RollupSource"))
+    return {"deleted_groups": deleted, "source_rows": rows, "months": f"{start_month}..{end_month}"}
+
+
+def reconcile_rollup(engine) -> pd.DataFrame:
+    """
+    月次集計と生ログ（ウォーターマーク以前）を月ごとに突き合わせる。
+    利用時間は、チェックアウト済みかつ Pending に残っていない行同士で比較する。
+
+    Returns:
+        Month, RollupCount, LogCount, RollupMinutes, LogMinutes, Ok の DataFrame
+    """
+    sql = f"""
+    DECLARE @last int = (SELECT LastLogId FROM dbo.SeatLogRollupState WHERE Id = 1);
+    WITH R AS (
+        SELECT Month, SUM(UsageCount) AS RollupCount, SUM(TotalMinutes) AS RollupMinutes
+        FROM dbo.SeatLogMonthly
+        GROUP BY Month
+    ), L AS (
+        SELECT {MONTH_EXPR.format(col="L.CheckIn")} AS Month,
+               COUNT(*) AS LogCount,
+               SUM(CASE WHEN L.CheckOut IS NOT NULL AND P.LogId IS NULL
+                        THEN CAST(DATEDIFF(minute, L.CheckIn, L.CheckOut) AS bigint) ELSE 0 END) AS LogMinutes
+        FROM dbo.SeatLog L
+        LEFT JOIN dbo.SeatLogRollupPending P ON P.LogId = L.LogId
+        WHERE L.LogId <= @last
+        GROUP BY {MONTH_EXPR.format(col="L.CheckIn")}
+    )
+    SELECT COALESCE(R.Month, L.Month) AS Month,
+           COALESCE(R.RollupCount, 0) AS RollupCount, COALESCE(L.LogCount, 0) AS LogCount,
+           COALESCE(R.RollupMinutes, 0) AS RollupMinutes, COALESCE(L.LogMinutes, 0) AS LogMinutes
+    FROM R FULL OUTER JOIN L ON L.Month = R.Month
+    ORDER BY Month
+    """
+    with engine.connect() as conn:
+        df = pd.read_sql(sa.text(sql), conn)
+    df["Ok"] = (df["RollupCount"] == df["LogCount"]) & (df["RollupMinutes"] == df["LogMinutes"])
+    return df
+
+
+# -------------------------------
+# 状態の確認・アプリからの定期更新
+# -------------------------------
+_status_lock = threading.Lock()
+_status: dict[str, tuple[float, dict]] = {}
+
+
+def rollup_status(engine, max_age_seconds: float | None = None) -> dict:
+    """
+    集計テーブルの状態（ROLLUP_STATUS_SECONDS ごとに確認、既定 60 秒）。
+
+    Returns:
+        {"available": 集計テーブルがあるか, "updated_at": 最終更新（UTC）,
+         "age_seconds": 最終更新からの秒数, "fresh": ROLLUP_MAX_AGE_MINUTES 以内に更新されたか}
+    """
+    url = str(engine.url)
+    now = time.monotonic()
+    with _status_lock:
+        cached = _status.get(url)
+    if cached is None or now - cached[0] > float(secret("ROLLUP_STATUS_SECONDS", "60")):
+        status = {"available": False, "updated_at": None, "age_seconds": None}
+        try:
+            with db_origin("schema"), engine.connect() as conn:
+                inspector = sa.inspect(conn)
+                if inspector.has_table(seatlog_monthly.name) and inspector.has_table(rollup_state.name):
+                    updated = conn.execute(
+                        sa.select(rollup_state.c.UpdatedAt).where(rollup_state.c.Id == 1)
+                    ).scalar()
+                    status["available"] = True
+                    if updated is not None:
+                        updated = pd.Timestamp(updated).to_pydatetime()
+                        status["updated_at"] = updated
+                        status["age_seconds"] = max(0.0, (datetime.utcnow() - updated).total_seconds())
+        except sa.exc.SQLAlchemyError as e:
+            logger.warning("月次集計の状態を確認できませんでした: %s", e)
+        cached = (now, status)
+        with _status_lock:
+            _status[url] = cached
+    if max_age_seconds is None:
+        max_age_seconds = float(secret("ROLLUP_MAX_AGE_MINUTES", "30")) * 60
+    age = cached[1]["age_seconds"]
+    return {**cached[1], "fresh": cached[1]["available"] and age is not None and age <= max_age_seconds}
+
+
+class RollupRefresher:
+    """refresh_rollup を一定間隔でバックグラウンド実行する（同時に 1 本まで）"""
+
+    def __init__(self, engine_factory, interval: float = 300):
+        self.engine_factory = engine_factory
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._last_started = 0.0
+        self.last_result: dict | None = None
+        self.last_error: str | None = None
+        self.runs = 0
+
+    def maybe_refresh(self) -> bool:
+        """前回から interval 秒以上たっていれば更新を開始する（開始したら True）"""
+        now = time.monotonic()
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            if now - self._last_started < self.interval:
+                return False
+            self._last_started = now
+            engine = self.engine_factory()
+            if engine.dialect.name != "mssql" or not rollup_status(engine)["available"]:
+                return False
+            self._thread = threading.Thread(target=self._run, args=(engine,), name="rollup-refresh", daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self, engine):
+        try:
+            with db_origin("rollup"):
+                self.last_result = refresh_rollup(engine)
+            self.last_error = None
+            self.runs += 1
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            logger.warning("月次集計の更新に失敗しました: %s", e)
+        finally:
+            with _status_lock:
+                _status.pop(str(engine.url), None)  # 次の rollup_status で最終更新を読み直す
+
+    def stats(self) -> dict:
+        return {"runs": self.runs, "last_result": self.last_result, "last_error": self.last_error,
+                "running": self._thread is not None and self._thread.is_alive()}
+
+
+@st.cache_resource
+def get_rollup_refresher() -> RollupRefresher:
+    """全セッションで共有する定期更新"""
+    from core.db import get_engine  # core.db の import を遅らせる
+
+    return RollupRefresher(get_engine, interval=float(secret("ROLLUP_REFRESH_SECONDS", "300")))
+
+
+def main(argv: list[str] | None = None):
+    from core.db import get_engine
+
+    parser = argparse.ArgumentParser(description="SeatLogMonthly の作成・更新・検証")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("init", help="集計テーブルを作成")
+    p = sub.add_parser("backfill", help="全件を集計し直す")
+    p.add_argument("--batch-size", type=int, default=200_000)
+    p.add_argument("--safety-rows", type=int, default=None, help="最大 LogId から集計しない件数")
+    p = sub.add_parser("refresh", help="増分更新")
+    p.add_argument("--batch-size", type=int, default=200_000)
+    p.add_argument("--safety-rows", type=int, default=None, help="最大 LogId から集計しない件数")
+    p = sub.add_parser("rebuild", help="指定月の範囲を集計し直す")
+    p.add_argument("--from", dest="start", required=True, help="開始月（例: 2025-01）")
+    p.add_argument("--to", dest="end", required=True, help="終了月（例: 2025-05、含む）")
+    sub.add_parser("reconcile", help="生ログとの突き合わせ")
+    args = parser.parse_args(argv)
+    engine = get_engine()
+
+    if engine.dialect.name != "mssql":
+        parser.error(f"集計のメンテナンスは SQL Server 専用です（接続先: {engine.dialect.name}）")
+
+    if args.command == "init":
+        init_rollup(engine)
+        print("✅ 集計テーブルを作成しました")
+    elif args.command == "backfill":
+        print(backfill_rollup(engine, batch_size=args.batch_size, safety_rows=args.safety_rows))
+    elif args.command == "refresh":
+        print(refresh_rollup(engine, batch_size=args.batch_size, safety_rows=args.safety_rows))
+    elif args.command == "rebuild":
+        print(rebuild_rollup_range(engine, args.start, args.end))
+    elif args.command == "reconcile":
+        df = reconcile_rollup(engine)
+        print(df.to_string(index=False))
+        bad = df[~df["Ok"]]
+        print("✅ 一致しました" if bad.empty else f"❌ 不一致の月があります: {', '.join(bad['Month'])}")
+        return 0 if bad.empty else 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
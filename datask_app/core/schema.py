@@ -5,12 +5,139 @@
 #
 # この情報を使って、AIが適切なSQL文を生成できるようにします。
 # 他のテーブルは使用できないように注意喚起しています。
+# SQL の書き方（TOP / LIMIT、月の取り出し方など）は接続先のDB（core/dialect.py）に合わせます。
+#
+# テーブル・列・型・PK・インデックス・概算件数は接続先DBから読み取った内容
+# （core/schema_catalog.py、スキーマが変わったときだけ読み直す）で組み立てます。
+# インデックスの先頭列を示し、関数で包まない比較（sargable な条件）を使うよう指示します。
+# SeatLogMonthly（月次集計）は、集計の最終更新が新しいとき（core/rollup.py の rollup_status）だけ載せます。
+# ヒントはスキーマのバージョンと集計の鮮度の組ごとに 1 回だけ組み立てます。
 # =============================================================================
 
-SCHEMA_HINT = """
-Available tables (only these 3):
-  dbo.Seat(SeatId int PK, Label nvarchar, Area nvarchar, SeatType nvarchar)
-  dbo.Employee(EmpCode varchar PK, Name nvarchar, Dept nvarchar)
-  dbo.SeatLog(LogId int PK, SeatId int FK, EmpCode varchar FK,
-              CheckIn datetime2, CheckOut datetime2)
-"""
+import threading
+
+from core.dialect import backend_name, dialect_rules
+
+# ヒントに載せるテーブル（集計用の内部テーブルは載せない）
+HINT_TABLES = ("Seat", "Employee", "SeatLog", "SeatLogMonthly")
+
+# DB で外部キーが宣言されていなくても示す参照
+LOGICAL_FKS = {
+    ("SeatLog", "SeatId"): "Seat",
+    ("SeatLog", "EmpCode"): "Employee",
+    ("SeatLogMonthly", "EmpCode"): "Employee",
+    ("SeatLogMonthly", "SeatId"): "Seat",
+}
+
+COLUMN_NOTES = {("SeatLogMonthly", "Month"): "'yyyy-MM'"}
+TABLE_NOTES = {"SeatLogMonthly": "monthly rollup of SeatLog"}
+
+_lock = threading.Lock()
+_hint: tuple[tuple[str, bool], str] | None = None  # ((スキーマのバージョン, 集計が新しいか), ヒント)
+
+
+def _rows(n: int | None) -> str:
+    if n is None:
+        return ""
+    for unit, size in (("M", 1_000_000), ("K", 1_000)):
+        if n >= size:
+            return f" ~{n / size:g}{unit} rows"
+    return f" ~{n} rows"
+
+
+def _table_line(name: str, info: dict, prefix: str) -> str:
+    fks = {c: fk["table"] for fk in info["fks"] for c in fk["columns"]}
+    columns = []
+    for col in info["columns"]:
+        text = f"{col['name']} {col['type']}"
+        ref = fks.get(col["name"]) or LOGICAL_FKS.get((name, col["name"]))
+        if ref:
+            text += f" -> {ref}"
+        if (name, col["name"]) in COLUMN_NOTES:
+            text += f" {COLUMN_NOTES[(name, col['name'])]}"
+        columns.append(text)
+    keys = []
+    if info["pk"]:
+        keys.append(f"PK({', '.join(info['pk'])})")
+    seen = {tuple(info["pk"])}
+    for ix in info["indexes"]:
+        if tuple(ix["columns"]) not in seen:
+            seen.add(tuple(ix["columns"]))
+            keys.append(f"{'unique' if ix['unique'] else 'idx'}({', '.join(ix['columns'])})")
+    line = f"  {prefix}{name}{_rows(info.get('rows'))}: {', '.join(columns)}"
+    if keys:
+        line += f"; {' '.join(keys)}"
+    if name in TABLE_NOTES:
+        line += f"  -- {TABLE_NOTES[name]}"
+    return line
+
+
+def build_schema_hint(catalog: dict | None = None, dialect: str | None = None, rollup: bool = False) -> str:
+    """
+    スキーマ情報（core/schema_catalog.py の形式）から接続先のDBに合わせたスキーマヒントを作る。
+    catalog を省略すると core/dialect.py のテーブル定義を使う。
+    rollup=False のときは SeatLogMonthly を載せない（集計が古い・未作成のときに案内しない）。
+    """
+    from core.schema_catalog import from_metadata
+
+    dialect = dialect or (catalog or {}).get("dialect") or backend_name()
+    catalog = catalog or from_metadata(dialect)
+    tables = {n: catalog["tables"][n] for n in HINT_TABLES
+              if n in catalog["tables"] and (rollup or n != "SeatLogMonthly")}
+    prefix = "dbo." if dialect == "mssql" else ""
+    lines = [
+        f"Available tables (only these {len(tables)}; ~rows = approximate size,"
+        " PK / idx(...) = primary key and index columns in key order):"
+    ]
+    lines += [_table_line(name, info, prefix) for name, info in tables.items()]
+    if "SeatLogMonthly" in tables:
+        lines.append(
+            f"For monthly / department / employee usage totals, aggregate {prefix}SeatLogMonthly"
+            f" instead of scanning {prefix}SeatLog."
+        )
+    lines.append(
+        "Filter large tables on the leading column of a PK / idx with plain comparisons"
+        " (e.g. CheckIn >= '2025-01-01' AND CheckIn < '2025-02-01', EmpCode = 'E0001');"
+        " do not wrap indexed columns in functions or use leading-wildcard LIKE on them."
+    )
+    return "\n".join(lines) + "\n" + "\n".join(dialect_rules(dialect)["rules"]) + "\n"
+
+
+def get_schema_hint() -> str:
+    """接続先のスキーマヒント（スキーマのバージョンが変わったときだけ組み立て直す）"""
+    global _hint
+    from core.rollup import rollup_status
+    from core.schema_catalog import get_schema_catalog
+
+    schema_catalog = get_schema_catalog()
+    catalog = schema_catalog.current()
+    rollup = "SeatLogMonthly" in catalog["tables"] and rollup_status(schema_catalog.engine_factory())["fresh"]
+    key = (catalog["version"], rollup)
+    with _lock:
+        if _hint is None or _hint[0] != key:
+            _hint = (key, build_schema_hint(catalog, rollup=rollup))
+        return _hint[1]
+
+
+def schema_hint_stats() -> dict:
+    """
+    スキーマヒントの大きさ（推定トークン数）とスキーマ情報のキャッシュの状態。
+    まだ組み立てていなければ tokens / chars は None（DB には接続しない）。
+    """
+    from core.schema_catalog import get_schema_catalog
+    from core.sql_examples import estimate_tokens
+
+    with _lock:
+        hint = _hint[1] if _hint is not None else None
+    return {
+        "tokens": estimate_tokens(hint) if hint is not None else None,
+        "chars": len(hint) if hint is not None else None,
+        **get_schema_catalog().stats(),
+    }
+
+
+def __getattr__(name: str):
+    # 互換のため core.schema.SCHEMA_HINT も残す（参照した時点で組み立てる）
+    if name == "SCHEMA_HINT":
+        return get_schema_hint()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,317 @@
+# =============================================================================
+# schema_catalog.py - 接続先DBのスキーマ情報（テーブル・列・型・PK/FK・インデックス・概算件数）
+# -----------------------------------------------------------------------------
+# SQLAlchemy の inspect で接続先のスキーマを読み取り、ファイルにキャッシュします。
+# core/schema.py はこの内容から LLM に渡すスキーマヒントを組み立てます。
+#
+# 主な機能：
+# - スキーマのバージョン（ハッシュ）を軽いクエリで取得し、変わったときだけ読み直す
+#     mssql  : sys.objects のユーザーテーブル数と最終更新日時（インデックスの作成でも更新される）
+#     sqlite : PRAGMA schema_version
+#     duckdb : information_schema.columns と duckdb_indexes() の内容
+#   バージョンの確認は SCHEMA_CATALOG_PROBE_SECONDS に 1 回まで
+# - 概算件数（mssql は sys.partitions、sqlite は MAX(rowid)、duckdb は estimated_size）は
+#   有効数字 1 桁に丸め、読み直したときだけ更新する（件数の増加でヒントが変わらないように）
+# - DB に接続できない場合は core/dialect.py のテーブル定義を使う（source: "metadata"）
+#
+# 設定（secrets / 環境変数）：
+#   SCHEMA_CATALOG_PATH          : キャッシュファイル（既定 一時ディレクトリの datask_schema_catalog.json）
+#   SCHEMA_CATALOG_PROBE_SECONDS : バージョンを確認する間隔（既定 300）
+#
+# コマンド（datask_app ディレクトリで実行）：
+#   python -m core.schema_catalog show       # スキーマヒントと推定トークン数
+#   python -m core.schema_catalog refresh    # バージョンに関係なく読み直す
+# =============================================================================
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+import sqlalchemy as sa
+import streamlit as st
+from core.config import secret
+from core.metrics import db_origin
+from core.tracing import span
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1  # キャッシュファイルの形式を変えたら上げる
+
+
+def _type_name(col_type, dialect) -> str:
+    """型名（長さ・照合順序は省く。char だけは桁数が意味を持つので残す）"""
+    try:
+        text = col_type.compile(dialect=dialect)
+    except Exception:
+        text = type(col_type).__name__
+    text = text.split(" COLLATE ")[0].lower()
+    if re.match(r"n?char\(", text):
+        return text
+    return re.sub(r"\(.*\)", "", text)
+
+
+def approx_rows(n: int | None) -> int | None:
+    """件数を有効数字 1 桁に丸める（1234 → 1000、56789 → 60000）"""
+    if n is None or n <= 0:
+        return n
+    magnitude = 10 ** (len(str(int(n))) - 1)
+    return int(round(n / magnitude) * magnitude)
+
+
+# -------------------------------
+# バージョン（スキーマのハッシュ）
+# -------------------------------
+def _probe(conn: sa.Connection) -> str:
+    """スキーマが変わると値が変わる文字列（方言ごとの軽いクエリ）"""
+    name = conn.dialect.name
+    if name == "mssql":
+        row = conn.execute(sa.text(
+            "SELECT COUNT(*), CONVERT(varchar(30), MAX(modify_date), 126) FROM sys.objects WHERE type = 'U'"
+        )).one()
+        return f"{row[0]}:{row[1]}"
+    if name == "sqlite":
+        return str(conn.exec_driver_sql("PRAGMA schema_version").scalar())
+    if name == "duckdb":
+        rows = conn.execute(sa.text(
+            "SELECT table_name, column_name, data_type FROM information_schema.columns"
+            " ORDER BY table_name, ordinal_position"
+        )).all()
+        rows += conn.execute(sa.text("SELECT index_name, sql FROM duckdb_indexes() ORDER BY index_name")).all()
+        return hashlib.sha256(repr(rows).encode("utf-8")).hexdigest()
+    inspector = sa.inspect(conn)
+    return repr([(t, [c["name"] for c in inspector.get_columns(t)]) for t in sorted(inspector.get_table_names())])
+
+
+def schema_version(conn: sa.Connection) -> str:
+    """接続先（パスワードを除く URL）とスキーマのハッシュ"""
+    url = conn.engine.url.render_as_string(hide_password=True)
+    key = f"{FORMAT_VERSION}|{url}|{_probe(conn)}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+# -------------------------------
+# 読み取り
+# -------------------------------
+def _row_counts(conn: sa.Connection, tables: list[str]) -> dict[str, int | None]:
+    """概算件数（取れなければ None）"""
+    name = conn.dialect.name
+    counts: dict[str, int | None] = {t: None for t in tables}
+    try:
+        if name == "mssql":
+            rows = conn.execute(sa.text(
+                "SELECT t.name, SUM(p.rows) FROM sys.partitions p"
+                " JOIN sys.tables t ON t.object_id = p.object_id"
+                " WHERE p.index_id IN (0, 1) GROUP BY t.name"
+            ))
+            counts.update({t: int(n) for t, n in rows if t in counts})
+        elif name == "duckdb":
+            rows = conn.execute(sa.text("SELECT table_name, estimated_size FROM duckdb_tables()"))
+            counts.update({t: int(n) for t, n in rows if t in counts})
+        elif name == "sqlite":
+            # 行IDの最大値（削除があると多めになるが、索引をたどるだけで済む）
+            for t in tables:
+                try:
+                    counts[t] = conn.exec_driver_sql(f'SELECT MAX(rowid) FROM "{t}"').scalar() or 0
+                except sa.exc.DBAPIError:
+                    counts[t] = None
+    except sa.exc.DBAPIError as e:
+        logger.warning("概算件数を取得できませんでした: %s", e)
+    return {t: approx_rows(n) for t, n in counts.items()}
+
+
+def introspect(conn: sa.Connection) -> dict:
+    """テーブル・列・型・PK/FK・インデックス・概算件数を読み取る"""
+    inspector = sa.inspect(conn)
+    schema = inspector.default_schema_name
+    tables = {}
+    for name in sorted(inspector.get_table_names()):
+        pk = inspector.get_pk_constraint(name).get("constrained_columns") or []
+        tables[name] = {
+            "schema": schema,
+            "columns": [
+                {"name": c["name"], "type": _type_name(c["type"], conn.dialect), "nullable": c.get("nullable", True)}
+                for c in inspector.get_columns(name)
+            ],
+            "pk": pk,
+            "fks": [
+                {"columns": fk["constrained_columns"], "table": fk["referred_table"],
+                 "referred": fk["referred_columns"]}
+                for fk in inspector.get_foreign_keys(name)
+            ],
+            "indexes": [
+                {"name": ix["name"], "columns": [c for c in ix["column_names"] if c], "unique": bool(ix.get("unique"))}
+                for ix in inspector.get_indexes(name) if any(ix["column_names"])
+            ],
+        }
+    for name, rows in _row_counts(conn, list(tables)).items():
+        tables[name]["rows"] = rows
+    return {"dialect": conn.dialect.name, "tables": tables}
+
+
+def from_metadata(dialect_name: str) -> dict:
+    """core/dialect.py のテーブル定義から同じ形式の情報を作る（DB に接続できない場合）"""
+    from core.dialect import metadata
+
+    try:
+        dialect = sa.engine.make_url(f"{dialect_name}://").get_dialect()()
+    except Exception:
+        dialect = sa.engine.default.DefaultDialect()
+    schema = "dbo" if dialect_name == "mssql" else None
+    tables = {}
+    for table in metadata.sorted_tables:
+        tables[table.name] = {
+            "schema": schema,
+            "columns": [{"name": c.name, "type": _type_name(c.type, dialect), "nullable": c.nullable}
+                        for c in table.columns],
+            "pk": [c.name for c in table.primary_key.columns],
+            "fks": [{"columns": [e.parent.name for e in fk.elements], "table": fk.referred_table.name,
+                     "referred": [e.column.name for e in fk.elements]} for fk in table.foreign_key_constraints],
+            "indexes": [{"name": ix.name, "columns": [c.name for c in ix.columns], "unique": bool(ix.unique)}
+                        for ix in table.indexes],
+            "rows": None,
+        }
+    return {"dialect": dialect_name, "tables": tables}
+
+
+# -------------------------------
+# キャッシュ
+# -------------------------------
+class SchemaCatalog:
+    """
+    スキーマ情報のキャッシュ（メモリとファイル）。
+
+    current() はバージョンを probe_seconds に 1 回まで確認し、変わっていなければ
+    キャッシュを、変わっていれば読み直した内容を返す。
+    """
+
+    def __init__(self, engine_factory, path: str | None = None, probe_seconds: float = 300):
+        self.engine_factory = engine_factory
+        self.path = path
+        self.probe_seconds = probe_seconds
+        self._lock = threading.Lock()
+        self._catalog: dict | None = None
+        self._checked = 0.0
+        self.probes = 0
+        self.rebuilds = 0
+        self.errors = 0
+
+    def _load_file(self) -> dict | None:
+        if not self.path or not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("スキーマのキャッシュを読めませんでした: %s", e)
+            return None
+
+    def _save_file(self, catalog: dict):
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(catalog, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
+
+    def current(self, force: bool = False) -> dict:
+        """最新のスキーマ情報（version・built_at・source・dialect・tables）"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._catalog is not None and now - self._checked < self.probe_seconds:
+                return self._catalog
+            self._checked = now
+            with span("schema_catalog") as s, db_origin("schema"):
+                try:
+                    engine = self.engine_factory()
+                    with engine.connect() as conn:
+                        version = schema_version(conn)
+                        self.probes += 1
+                        cached = self._catalog if self._catalog is not None else self._load_file()
+                        if not force and cached is not None and cached.get("version") == version:
+                            self._catalog = cached
+                            s.set(rebuilt=False)
+                            return cached
+                        catalog = {"version": version, "built_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                                   "source": "database", **introspect(conn)}
+                except Exception as e:
+                    # 接続できないときは前回の内容、それもなければテーブル定義を使う
+                    self.errors += 1
+                    logger.warning("スキーマを読み取れませんでした: %s", e)
+                    if self._catalog is None:
+                        from core.dialect import backend_name
+
+                        self._catalog = self._load_file() or {
+                            "version": "metadata", "built_at": None, "source": "metadata",
+                            **from_metadata(backend_name()),
+                        }
+                    s.set(rebuilt=False, error=type(e).__name__)
+                    return self._catalog
+                self.rebuilds += 1
+                s.set(rebuilt=True, tables=len(catalog["tables"]))
+            self._catalog = catalog
+            try:
+                self._save_file(catalog)
+            except OSError as e:
+                logger.warning("スキーマのキャッシュを書き込めませんでした: %s", e)
+            return catalog
+
+    def stats(self) -> dict:
+        with self._lock:
+            catalog = self._catalog or {}
+            return {
+                "version": catalog.get("version"),
+                "source": catalog.get("source"),
+                "built_at": catalog.get("built_at"),
+                "tables": len(catalog.get("tables", {})),
+                "probes": self.probes,
+                "rebuilds": self.rebuilds,
+                "errors": self.errors,
+            }
+
+
+@st.cache_resource
+def get_schema_catalog() -> SchemaCatalog:
+    """全セッションで共有するスキーマ情報のキャッシュ"""
+    from core.db import get_engine  # core.db が list_tables でこのモジュールを使うため遅延
+
+    return SchemaCatalog(
+        get_engine,
+        path=secret("SCHEMA_CATALOG_PATH") or os.path.join(tempfile.gettempdir(), "datask_schema_catalog.json"),
+        probe_seconds=float(secret("SCHEMA_CATALOG_PROBE_SECONDS", "300")),
+    )
+
+
+def main(argv: list[str] | None = None):
+    from core.schema import get_schema_hint
+    from core.sql_examples import estimate_tokens
+
+    parser = argparse.ArgumentParser(description="接続先DBのスキーマ情報とスキーマヒント")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("show", help="スキーマヒントと推定トークン数")
+    sub.add_parser("refresh", help="バージョンに関係なく読み直す")
+    sub.add_parser("json", help="キャッシュしている内容")
+    args = parser.parse_args(argv)
+
+    catalog = get_schema_catalog()
+    started = time.perf_counter()
+    data = catalog.current(force=args.command == "refresh")
+    elapsed = (time.perf_counter() - started) * 1000
+    if args.command == "json":
+        print(json.dumps(data, ensure_ascii=False, indent=1))
+        return 0
+    hint = get_schema_hint()  # 月次集計の鮮度も反映したヒント
+    print(hint)
+    print(f"-- version {data['version']}（{data['source']}、{data['built_at'] or '-'}）"
+          f" / 推定 {estimate_tokens(hint)} トークン・{len(hint)} 文字 / {elapsed:.1f} ms")
+    print(catalog.stats())
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,223 @@
+# =============================================================================
+# search_client.py - Azure AI Search の共有 HTTP クライアント
+# -----------------------------------------------------------------------------
+# requests.Session を全セッションで共有し、接続の再利用（keep-alive）・タイムアウト・
+# リトライ（指数バックオフ、Retry-After を優先）をまとめて設定します。
+#
+# 主な機能：
+# - ping()             : インデックス一覧の取得で接続確認（config.check_ai_search_connection）
+# - search()           : 検索（アプリの FAQ 検索はローカルの core/faq_index.py を使用）
+# - upload_documents() : 文書の一括反映。1000 件ずつのバッチに分けて並列に送り、
+#                        バッチごとの結果（失敗した文書ID・ステータス・エラー）を返す
+#
+# リトライ対象：接続エラー・読み取りタイムアウト・429 / 500 / 502 / 503 / 504
+# （文書の反映は mergeOrUpload / delete なので、POST も再送して問題ない）
+#
+# 設定（secrets / 環境変数）：
+#   AZURE_SEARCH_ENDPOINT / AZURE_SEARCH_API_KEY : 接続先（未設定ならクライアントは None）
+#   AZURE_SEARCH_INDEX          : インデックス名（既定 faq-index）
+#   AZURE_SEARCH_TIMEOUT        : 読み取りタイムアウト秒（既定 10、接続は 3 秒）
+#   AZURE_SEARCH_RETRIES        : リトライ回数（既定 3）
+#   AZURE_SEARCH_UPLOAD_WORKERS : 一括反映の並列数（既定 4）
+#
+# ローカルでの確認（tools/search_stub.py を代わりのサーバーとして使用）：
+#   python -m tools.search_stub --port 8765 --fail-rate 0.1 &
+#   python -m core.search_client upload --endpoint http://127.0.0.1:8765 --key dummy --count 10000
+# =============================================================================
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from core.config import secret
+
+API_VERSION = "2023-07-01-Preview"
+BATCH_SIZE = 1000  # Azure AI Search の 1 リクエストあたりの上限
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class BatchResult:
+    """一括反映の 1 バッチ分の結果"""
+
+    def __init__(self, number: int, keys: list[str], status: int | None = None,
+                 failed: dict[str, str] | None = None, error: str | None = None, seconds: float = 0.0):
+        self.number = number
+        self.keys = keys
+        self.status = status
+        self.failed = failed or {}  # 文書ID → エラー内容
+        self.error = error          # バッチ全体が失敗した場合
+        self.seconds = seconds
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.failed
+
+    def to_dict(self) -> dict:
+        return {
+            "batch": self.number, "documents": len(self.keys), "status": self.status,
+            "failed": self.failed, "error": self.error, "seconds": round(self.seconds, 3),
+        }
+
+
+class SearchClient:
+    """Azure AI Search の REST API（1 インデックス分）"""
+
+    def __init__(self, endpoint: str, api_key: str, index_name: str = "faq-index",
+                 timeout: float = 10.0, connect_timeout: float = 3.0, retries: int = 3,
+                 backoff: float = 0.5, pool_size: int = 8):
+        self.endpoint = endpoint.rstrip("/")
+        self.index_name = index_name
+        self.timeout = (connect_timeout, timeout)
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json", "api-key": api_key})
+        retry = Retry(
+            total=retries, connect=retries, read=retries, status=retries,
+            backoff_factor=backoff, status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,  # POST も再送する
+            respect_retry_after_header=True, raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _url(self, path: str) -> str:
+        return f"{self.endpoint}{path}?api-version={API_VERSION}"
+
+    def ping(self) -> tuple[bool, int | str]:
+        """
+        インデックス一覧を取得して接続を確認する
+
+        Returns:
+            (成功したか, ステータスコード or 例外メッセージ)
+        """
+        try:
+            rsp = self.session.get(self._url("/indexes"), timeout=self.timeout)
+            return rsp.status_code == 200, rsp.status_code
+        except requests.RequestException as e:
+            return False, str(e)
+
+    def search(self, text: str, top: int = 3) -> list[dict]:
+        rsp = self.session.post(
+            self._url(f"/indexes/{self.index_name}/docs/search"),
+            json={"search": text, "top": top}, timeout=self.timeout,
+        )
+        rsp.raise_for_status()
+        return rsp.json().get("value", [])
+
+    def index_batch(self, number: int, actions: list[dict]) -> BatchResult:
+        """1 バッチを送る（例外は送出せず BatchResult に記録）"""
+        keys = [str(a["id"]) for a in actions]
+        started = time.perf_counter()
+        try:
+            rsp = self.session.post(
+                self._url(f"/indexes/{self.index_name}/docs/index"),
+                json={"value": actions}, timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            return BatchResult(number, keys, error=str(e), seconds=time.perf_counter() - started)
+        seconds = time.perf_counter() - started
+        if rsp.status_code not in (200, 207):
+            return BatchResult(number, keys, rsp.status_code, error=rsp.text[:500], seconds=seconds)
+        # 207（一部失敗）の場合は文書ごとの status を確認する
+        failed = {
+            str(item.get("key")): item.get("errorMessage") or str(item.get("statusCode"))
+            for item in rsp.json().get("value", []) if not item.get("status", False)
+        }
+        return BatchResult(number, keys, rsp.status_code, failed=failed, seconds=seconds)
+
+    def upload_documents(self, docs: list[dict], deleted_ids=(), batch_size: int = BATCH_SIZE,
+                         workers: int = 4, progress=None) -> list[BatchResult]:
+        """
+        docs を mergeOrUpload、deleted_ids を delete として batch_size 件ずつ並列に送る。
+
+        Returns:
+            バッチ番号順の BatchResult のリスト
+        """
+        actions = [{"@search.action": "mergeOrUpload", **doc} for doc in docs]
+        actions += [{"@search.action": "delete", "id": doc_id} for doc_id in deleted_ids]
+        batches = [actions[i:i + batch_size] for i in range(0, len(actions), batch_size)]
+        if not batches:
+            return []
+
+        def send(numbered):
+            result = self.index_batch(*numbered)
+            if progress is not None:
+                progress(result)
+            return result
+
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="search-upload") as pool:
+            return list(pool.map(send, enumerate(batches, start=1)))
+
+    def close(self):
+        self.session.close()
+
+
+def summarize(results: list[BatchResult]) -> str:
+    """一括反映の結果を 1 行にまとめる"""
+    documents = sum(len(r.keys) for r in results)
+    failed_batches = [r for r in results if r.error is not None]
+    failed_docs = sum(len(r.keys) for r in failed_batches) + sum(len(r.failed) for r in results)
+    text = f"{documents} 件を {len(results)} バッチで送信、失敗 {failed_docs} 件"
+    if failed_batches:
+        text += "（失敗したバッチ：" + ", ".join(str(r.number) for r in failed_batches) + "）"
+    return text
+
+
+def client_from_settings(endpoint: str | None = None, api_key: str | None = None) -> SearchClient | None:
+    endpoint = endpoint or secret("AZURE_SEARCH_ENDPOINT")
+    api_key = api_key or secret("AZURE_SEARCH_API_KEY")
+    if not endpoint or not api_key:
+        return None
+    workers = int(secret("AZURE_SEARCH_UPLOAD_WORKERS", "4"))
+    return SearchClient(
+        endpoint, api_key,
+        index_name=secret("AZURE_SEARCH_INDEX", "faq-index"),
+        timeout=float(secret("AZURE_SEARCH_TIMEOUT", "10")),
+        retries=int(secret("AZURE_SEARCH_RETRIES", "3")),
+        pool_size=max(workers, 4),
+    )
+
+
+@st.cache_resource
+def get_search_client() -> SearchClient | None:
+    """共有の SearchClient（接続先が未設定なら None）"""
+    return client_from_settings()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Azure AI Search クライアントの動作確認")
+    parser.add_argument("--endpoint", help="既定 AZURE_SEARCH_ENDPOINT")
+    parser.add_argument("--key", help="既定 AZURE_SEARCH_API_KEY")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("ping", help="接続確認")
+    upload = sub.add_parser("upload", help="合成文書を一括反映して所要時間を計測")
+    upload.add_argument("--count", type=int, default=10_000)
+    upload.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    upload.add_argument("--workers", type=int, default=int(secret("AZURE_SEARCH_UPLOAD_WORKERS", "4")))
+    args = parser.parse_args(argv)
+
+    client = client_from_settings(args.endpoint, args.key)
+    if client is None:
+        parser.error("--endpoint / --key または AZURE_SEARCH_ENDPOINT / AZURE_SEARCH_API_KEY を指定してください")
+    if args.command == "ping":
+        ok, status = client.ping()
+        print("✅" if ok else "❌", status)
+        return 0 if ok else 1
+
+    docs = [{"id": str(i), "content": f"合成FAQ {i}"} for i in range(args.count)]
+    started = time.perf_counter()
+    results = client.upload_documents(docs, batch_size=args.batch_size, workers=args.workers)
+    elapsed = time.perf_counter() - started
+    for r in results:
+        if not r.ok:
+            print(f"  batch {r.number}: {r.error or r.failed}")
+    print(f"{summarize(results)}（{elapsed:.2f} 秒）")
+    return 0 if all(r.ok for r in results) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,272 @@
+# =============================================================================
+# sql_examples.py - 実行に成功した「質問 → SQL」の例（Few-shot と再利用）
+# -----------------------------------------------------------------------------
+# AI生成SQLが正常に実行でき、結果が 1 行以上あったときに（質問, SQL, 実行時間）を記録し、
+# 次の質問で次のように使います。
+#
+# 主な機能：
+# - 似た質問の例を上位 k 件取り出し、トークン数の上限内でプロンプトに追加
+#   （類似度は core/faq_index.py の文字 n-gram BM25 インデックスで計算）
+# - 同じ質問（Unicode NFKC・空白の統一だけをした質問文が完全に一致）で、
+#   スキーマが変わっていなければ、記録済みの SQL をそのまま使い LLM を呼ばない
+#   （例のキーは「教えて」「見せて」などの依頼の言い回しを除いた質問で 1 件。
+#     数値や記号が少しでも違う質問には再利用しない）
+# - 再利用した SQL の実行に失敗したら、その例を削除（forget）
+# - 接続先の方言（mssql / sqlite / duckdb）ごとに分けて保持
+# - SQLite ファイルへの永続化（SQL_EXAMPLES_PATH を設定した場合のみ）
+#
+# 使用例：
+#   examples = get_sql_examples()
+#   examples.record("部署別の利用回数", sql, "mssql", elapsed_ms=120, rows=20)
+#   examples.reusable("部署別の利用回数", "mssql", SCHEMA_HINT)   # → 記録済みの例
+#   examples.prompt_section("部署ごとの利用時間", "mssql")                # → プロンプトに追加する文
+#
+# 設定（secrets / 環境変数）：
+#   SQL_EXAMPLES_PATH         : 永続化する SQLite ファイル（未設定ならメモリのみ）
+#   SQL_EXAMPLES_MAXSIZE      : 保持する例の上限（既定 1000、古いものから削除）
+#   SQL_EXAMPLES_TOP_K        : プロンプトに入れる例の最大数（既定 3）
+#   SQL_EXAMPLES_TOKEN_BUDGET : プロンプトに入れる例の推定トークン数の上限（既定 600）
+#   SQL_EXAMPLES_REUSE        : 0 にすると同じ質問でも再利用しない（既定 1）
+#
+# コマンド（datask_app ディレクトリで実行、SQL_EXAMPLES_PATH の内容を対象）：
+#   python -m core.sql_examples list
+#   python -m core.sql_examples search "部署ごとの利用時間"
+# =============================================================================
+
+import argparse
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import streamlit as st
+from core.config import secret
+from core.faq_index import FaqIndex
+from core.nl_cache import normalize_question, schema_fingerprint
+
+COMPACT_EVERY = 64  # 追加がこの件数たまったらインデックスの差分をまとめる
+MIN_RELATIVE_SCORE = 0.3
+
+# 質問の末尾の依頼の言い回し（正規化後の文字列に適用、繰り返し除去）
+_REQUEST_SUFFIX_RE = re.compile(
+    r"(?:を|は|が)?(?:教えて|見せて|表示して|出して|調べて|知りたい|一覧にして)(?:ください|下さい|ほしい|欲しい)?(?:です)?$"
+    r"|(?:ください|下さい|ですか|でしょうか|か|は|を)$"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """推定トークン数（ASCII は 4 文字で 1、それ以外は 1 文字で 1）"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+def canonical_question(text: str) -> str:
+    """再利用の判定用：正規化して末尾の依頼の言い回しを除いた質問"""
+    text = normalize_question(text)
+    while True:
+        stripped = _REQUEST_SUFFIX_RE.sub("", text)
+        if stripped == text or not stripped:
+            return text
+        text = stripped
+
+
+def exact_question(text: str) -> str:
+    """再利用の判定用：Unicode NFKC と空白の統一だけをした質問（記号・数値はそのまま）"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class SqlExampleStore:
+    """実行に成功した質問と SQL の組（方言ごと、正規化した質問をキーに 1 件）"""
+
+    def __init__(self, maxsize: int = 1000, path: str | None = None, top_k: int = 3,
+                 token_budget: int = 600, reuse: bool = True):
+        self.maxsize = maxsize
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.reuse = reuse
+        self._lock = threading.Lock()
+        self.examples: dict[str, dict] = {}
+        self.index = FaqIndex()
+        self._pending = 0
+        self.retrievals = 0
+        self.injected = 0
+        self.reused = 0
+        self.forgotten = 0
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sql_examples ("
+                " key TEXT PRIMARY KEY, dialect TEXT NOT NULL, fingerprint TEXT NOT NULL,"
+                " question TEXT NOT NULL, sql TEXT NOT NULL, elapsed_ms REAL, rows INTEGER,"
+                " runs INTEGER NOT NULL, updated REAL NOT NULL)"
+            )
+            self._db.commit()
+            for row in self._db.execute(
+                "SELECT key, dialect, fingerprint, question, sql, elapsed_ms, rows, runs, updated"
+                " FROM sql_examples ORDER BY updated"
+            ):
+                example = dict(zip(
+                    ("key", "dialect", "fingerprint", "question", "sql", "elapsed_ms", "rows", "runs", "updated"), row
+                ))
+                self.examples[example["key"]] = example
+                self.index.add(example["key"], example["question"])
+            self.index.compact()
+
+    @staticmethod
+    def make_key(question: str, dialect: str) -> str:
+        return f"{dialect}:{canonical_question(question)}"
+
+    # ---------------------------------
+    # 記録・削除
+    # ---------------------------------
+    def record(self, question: str, sql: str, dialect: str, elapsed_ms: float | None = None,
+               rows: int | None = None, schema_hint: str = ""):
+        """実行に成功した質問と SQL を記録する（同じ質問は新しい SQL で置き換え）"""
+        key = self.make_key(question, dialect)
+        with self._lock:
+            previous = self.examples.get(key)
+            example = {
+                "key": key, "dialect": dialect, "fingerprint": schema_fingerprint(schema_hint),
+                "question": question, "sql": sql.strip(), "elapsed_ms": elapsed_ms, "rows": rows,
+                "runs": (previous["runs"] if previous else 0) + 1, "updated": time.time(),
+            }
+            self.examples[key] = example
+            if previous is None or previous["question"] != question:
+                self.index.add(key, question)
+                self._pending += 1
+            self._evict()
+            if self._pending >= COMPACT_EVERY:
+                self.index.compact()
+                self._pending = 0
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sql_examples"
+                    " (key, dialect, fingerprint, question, sql, elapsed_ms, rows, runs, updated)"
+                    " VALUES (:key, :dialect, :fingerprint, :question, :sql, :elapsed_ms, :rows, :runs, :updated)",
+                    example,
+                )
+                self._db.commit()
+
+    def _evict(self):
+        while len(self.examples) > self.maxsize:
+            oldest = min(self.examples.values(), key=lambda e: e["updated"])
+            self._remove(oldest["key"])
+
+    def _remove(self, key: str):
+        self.examples.pop(key, None)
+        self.index.delete(key)
+        if self._db is not None:
+            self._db.execute("DELETE FROM sql_examples WHERE key = ?", (key,))
+            self._db.commit()
+
+    def forget(self, question: str, dialect: str) -> bool:
+        """実行に失敗した例を削除する"""
+        key = self.make_key(question, dialect)
+        with self._lock:
+            if key not in self.examples:
+                return False
+            self._remove(key)
+            self.forgotten += 1
+            return True
+
+    # ---------------------------------
+    # 検索
+    # ---------------------------------
+    def similar(self, question: str, dialect: str, top_k: int | None = None) -> list[dict]:
+        """似た質問の例（類似度の高い順、同じ方言のみ）"""
+        top_k = top_k or self.top_k
+        with self._lock:
+            self.retrievals += 1
+            prefix = f"{dialect}:"
+            hits = [h for h in self.index.search(question, top_k * 4, mode="bm25") if h["id"].startswith(prefix)]
+            # 助詞 1 文字だけが一致するような例は入れない（最上位のスコアの 3 割未満は除く）
+            hits = [h for h in hits if h["score"] >= hits[0]["score"] * MIN_RELATIVE_SCORE]
+            return [{**self.examples[h["id"]], "score": h["score"]} for h in hits[:top_k]
+                    if h["id"] in self.examples]
+
+    def reusable(self, question: str, dialect: str, schema_hint: str = "") -> dict | None:
+        """同じ質問（exact_question が一致）の例があり、スキーマが同じなら返す（なければ None）"""
+        if not self.reuse:
+            return None
+        with self._lock:
+            example = self.examples.get(self.make_key(question, dialect))
+            if example is None or example["fingerprint"] != schema_fingerprint(schema_hint):
+                return None
+            if exact_question(example["question"]) != exact_question(question):
+                return None
+            self.reused += 1
+            return dict(example)
+
+    def prompt_section(self, question: str, dialect: str, budget: int | None = None) -> str:
+        """プロンプトに追加する例（推定トークン数が budget 以内、例がなければ空文字列）"""
+        budget = self.token_budget if budget is None else budget
+        header = "過去に正しく実行できた、似た質問のSQLの例（参考。質問に合わせて条件を変えること）："
+        used = estimate_tokens(header)
+        lines = []
+        for example in self.similar(question, dialect):
+            text = f"質問: {example['question']}\nSQL: {' '.join(example['sql'].split())}"
+            if example.get("elapsed_ms") is not None:
+                text += f"\n-- 実行 {example['elapsed_ms']:.0f} ms"
+            cost = estimate_tokens(text)
+            if used + cost > budget:
+                continue
+            lines.append(text)
+            used += cost
+        if not lines:
+            return ""
+        with self._lock:
+            self.injected += len(lines)
+        return header + "\n" + "\n\n".join(lines)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "examples": len(self.examples),
+                "retrievals": self.retrievals,
+                "injected": self.injected,
+                "reused": self.reused,
+                "forgotten": self.forgotten,
+                "maxsize": self.maxsize,
+            }
+
+
+@st.cache_resource
+def get_sql_examples() -> SqlExampleStore:
+    """全セッションで共有する例の保存先（設定は secrets / 環境変数から）"""
+    return SqlExampleStore(
+        maxsize=int(secret("SQL_EXAMPLES_MAXSIZE", "1000")),
+        path=secret("SQL_EXAMPLES_PATH"),
+        top_k=int(secret("SQL_EXAMPLES_TOP_K", "3")),
+        token_budget=int(secret("SQL_EXAMPLES_TOKEN_BUDGET", "600")),
+        reuse=secret("SQL_EXAMPLES_REUSE", "1") != "0",
+    )
+
+
+def main(argv: list[str] | None = None):
+    from core.dialect import backend_name
+
+    parser = argparse.ArgumentParser(description="実行に成功した質問と SQL の例")
+    parser.add_argument("--dialect", default=backend_name())
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="記録済みの例")
+    search = sub.add_parser("search", help="似た質問の例とプロンプトに入る文")
+    search.add_argument("question")
+    args = parser.parse_args(argv)
+
+    store = get_sql_examples()
+    if args.command == "list":
+        for e in sorted(store.examples.values(), key=lambda e: e["updated"]):
+            print(f"[{e['dialect']}] {e['question']}（{e['runs']} 回、{e['elapsed_ms'] or 0:.0f} ms）\n    {e['sql']}")
+        print(store.stats())
+    else:
+        for e in store.similar(args.question, args.dialect):
+            print(f"{e['score']:8.3f}  {e['question']}")
+        section = store.prompt_section(args.question, args.dialect)
+        print(f"\n{section}\n（推定 {estimate_tokens(section)} トークン）")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
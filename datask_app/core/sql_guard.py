@@ -0,0 +1,451 @@
+# =============================================================================
+# sql_guard.py - AI生成SQLの読み取り専用ガードとコスト制御
+# -----------------------------------------------------------------------------
+# Function Calling で生成された SQL を run_query に渡す前に検査・制限します。
+#
+# 主な機能：
+# - T-SQL を字句解析し（コメント・文字列・[識別子] を考慮）、以下を拒否
+#     ・SELECT / WITH 以外で始まる文
+#     ・複数の文（末尾以外の「;」）
+#     ・更新系・DDL・実行系のキーワード（INSERT/UPDATE/DELETE/EXEC/INTO など）
+#     ・文の先頭としての SET / USE（列名・別名としての Set / Use は許可）
+#     ・ファイルを読むテーブル関数（DuckDB の read_* / glob / parquet_scan など）と、
+#       FROM 句に書いたファイルのパス（'…' や "x.csv"。DuckDB ではファイルとして読まれる）
+# - 最上位の SELECT に TOP (n) を挿入、既存の TOP は上限値に丸める
+#   （ORDER BY … OFFSET がある場合は TOP を使えないため、FETCH NEXT n ROWS の件数を丸める）
+#   （SQLite / DuckDB に接続している場合は末尾の LIMIT n）
+# - 文のタイムアウト（pyodbc のクエリタイムアウト）
+# - 任意：推定実行プラン（SHOWPLAN_XML、SQL Server のみ）のコストが閾値を超えるクエリを実行前に拒否
+# - 取得行数は上限 + 1 行までに制限し、超えた場合は df.attrs["truncated"] = True
+#   （実行時間は df.attrs["elapsed_ms"]、core/sql_examples.py が記録に使用）
+# - 結果は core/result_cache.py にキャッシュ（データが変わるまで再実行しない）
+# - 過去の期間だけを読む SQL は core/archive.py の Parquet アーカイブで実行（df.attrs["source"] = "archive"）
+#
+# 使用例：
+#   df = run_governed_query(result["sql"])
+#
+# 設定（secrets / 環境変数）：
+#   SQL_MAX_ROWS        : 最大取得行数（既定 1000）
+#   SQL_TIMEOUT_SECONDS : クエリタイムアウト秒（既定 30）
+#   SQL_MAX_COST        : 推定コストの上限（既定 0 = 確認しない）
+# =============================================================================
+
+import re
+import time
+from collections.abc import Iterator
+
+import pandas as pd
+from core.config import secret
+from core.db import get_engine
+from core.metrics import db_origin, record_rows
+from core.tracing import span
+
+
+class QueryRejected(ValueError):
+    """ガードにより実行を拒否した SQL"""
+
+
+FORBIDDEN_WORDS = {
+    "INSERT", "UPDATE", "DELETE", "MERGE", "DROP", "ALTER", "CREATE", "TRUNCATE",
+    "EXEC", "EXECUTE", "GRANT", "REVOKE", "DENY", "BACKUP", "RESTORE", "DBCC",
+    "SHUTDOWN", "KILL", "DECLARE", "INTO", "OPENROWSET", "OPENQUERY",
+    "OPENDATASOURCE", "OPENXML", "BULK", "WAITFOR", "RECONFIGURE", "GO", "CHECKPOINT",
+    # SQLite / DuckDB
+    "PRAGMA", "ATTACH", "DETACH", "VACUUM", "COPY", "INSTALL", "LOAD", "EXPORT", "IMPORT", "CALL",
+}
+FORBIDDEN_PREFIXES = ("XP_", "SP_")
+# ファイルを読むテーブル関数（直後に「(」がある場合だけ拒否。列名の Read_Count などは許可）
+FILE_FUNCTIONS = {
+    "GLOB", "PARQUET_SCAN", "PARQUET_METADATA", "PARQUET_SCHEMA", "PARQUET_FILE_METADATA",
+    "PARQUET_KV_METADATA", "SNIFF_CSV",
+}
+FILE_FUNCTION_PREFIXES = ("READ_",)
+FILE_FUNCTION_SUFFIXES = ("_SCAN",)
+# 文の先頭にあるときだけ拒否するキーワード（SELECT の後ろに区切りなしで続く T-SQL の文）
+STATEMENT_WORDS = {"SET", "USE"}
+# 直後に来たら列名・別名として使われていると分かるキーワード
+_CLAUSE_WORDS = {
+    "FROM", "WHERE", "GROUP", "ORDER", "HAVING", "AS", "AND", "OR", "NOT", "IS", "IN", "LIKE", "BETWEEN",
+    "ON", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "CROSS", "OUTER", "UNION", "EXCEPT", "INTERSECT",
+    "ASC", "DESC", "WHEN", "THEN", "ELSE", "END", "OFFSET", "FETCH", "OPTION", "COLLATE",
+}
+SET_OPERATORS = {"UNION", "EXCEPT", "INTERSECT"}
+# FROM 句（カンマ区切りのテーブル一覧）の終わりを示すキーワード
+FROM_CLAUSE_END = {
+    "WHERE", "GROUP", "HAVING", "ORDER", "WINDOW", "QUALIFY", "LIMIT", "OFFSET", "FETCH",
+    "OPTION", "FOR", "SELECT",
+} | SET_OPERATORS
+
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<ws>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>N?'(?:[^']|'')*')
+  | (?P<ident>\[(?:[^\]]|\]\])*\]|"(?:[^"]|"")*")
+  | (?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<word>[@#]*[A-Za-z_\u0080-\uffff][\w$#@\u0080-\uffff]*)
+  | (?P<punct>[;(),.])
+  | (?P<op>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def tokenize(sql: str) -> list[tuple[str, str, int]]:
+    """SQL を (種類, 文字列, 開始位置) のリストに分解する"""
+    tokens = []
+    pos = 0
+    while pos < len(sql):
+        m = _TOKEN_RE.match(sql, pos)
+        kind = m.lastgroup
+        if kind == "op" and m.group() in ("'", '"', "["):
+            raise QueryRejected("SQLを解析できません（引用符や括弧が閉じていません）。")
+        if kind == "op" and sql.startswith("/*", pos):
+            raise QueryRejected("SQLを解析できません（コメントが閉じていません）。")
+        tokens.append((kind, m.group(), pos))
+        pos = m.end()
+    return tokens
+
+
+def _significant(tokens):
+    """空白・コメントを除いたトークンと、括弧の深さ"""
+    depth = 0
+    for kind, text, pos in tokens:
+        if kind in ("ws", "comment"):
+            continue
+        if text == ")":
+            depth -= 1
+        yield kind, text, pos, depth
+        if text == "(":
+            depth += 1
+
+
+def significant_tokens(sql: str) -> list[tuple[str, str, int, int]]:
+    """空白・コメントを除いた (種類, 文字列, 開始位置, 括弧の深さ) のリスト"""
+    return list(_significant(tokenize(sql)))
+
+
+def _from_items(sig) -> Iterator[int]:
+    """FROM / JOIN とカンマ区切りの FROM 句（FROM A, B）の各項目の先頭のインデックス（サブクエリの中も含む）"""
+    in_from = set()  # FROM 句の中にいる括弧の深さ
+    for i, (kind, text, _, depth) in enumerate(sig):
+        word = text.upper() if kind == "word" else None
+        if text == ")":
+            in_from.discard(depth + 1)
+            continue
+        if word in ("FROM", "JOIN"):
+            in_from.add(depth)
+        elif text == "," and depth in in_from:
+            pass
+        else:
+            if word in FROM_CLAUSE_END:
+                in_from.discard(depth)
+            continue
+        if i + 1 < len(sig):
+            yield i + 1
+
+
+def from_references(sql: str) -> list[tuple[str, int]]:
+    """
+    FROM 句で参照しているテーブル名（大文字、schema. と [ ] / " " は除く）と括弧の深さを出現順に返す。
+    サブクエリ自体は名前を持たないので返さない（中のテーブルは返す）。
+    """
+    sig = significant_tokens(sql)
+    refs = []
+    for i in _from_items(sig):
+        if sig[i][1] == "(":
+            continue
+        # schema.table の最後の部分をテーブル名とする
+        j = i
+        while j + 2 < len(sig) and sig[j + 1][1] == ".":
+            j += 2
+        name = sig[j][1]
+        if sig[j][0] == "ident":
+            name = name[1:-1]
+        refs.append((name.upper(), sig[i][3]))
+    return refs
+
+
+def table_references(sql: str) -> list[str]:
+    """FROM / JOIN とカンマ区切りの FROM 句（FROM A, B）で参照しているテーブル名（大文字）を出現順に返す"""
+    return [name for name, _ in from_references(sql)]
+
+
+def _is_file_function(sig, i: int) -> bool:
+    kind, text = sig[i][0], sig[i][1].upper()
+    if kind != "word" or i + 1 >= len(sig) or sig[i + 1][1] != "(":
+        return False
+    return text in FILE_FUNCTIONS or text.startswith(FILE_FUNCTION_PREFIXES) or text.endswith(FILE_FUNCTION_SUFFIXES)
+
+
+def validate_select(sql: str) -> str:
+    """
+    読み取り専用の単一 SELECT 文であることを確認し、末尾の「;」を除いて返す。
+    問題があれば QueryRejected を送出する。
+    """
+    tokens = tokenize(sql)
+    sig = list(_significant(tokens))
+    if not sig:
+        raise QueryRejected("SQLが空です。")
+
+    # 末尾の「;」は許可（取り除く）
+    while sig and sig[-1][1] == ";":
+        sql = sql[:sig[-1][2]]
+        sig.pop()
+    if any(text == ";" for _, text, _, _ in sig):
+        raise QueryRejected("複数のSQL文は実行できません。")
+
+    first = sig[0][1].upper()
+    if first not in ("SELECT", "WITH"):
+        raise QueryRejected(f"SELECT文以外は実行できません（{sig[0][1]}）。")
+
+    for i, (kind, text, _, depth) in enumerate(sig):
+        if depth < 0:
+            raise QueryRejected("括弧の対応が正しくありません。")
+        if kind != "word":
+            continue
+        word = text.upper()
+        if word in FORBIDDEN_WORDS or word.startswith(FORBIDDEN_PREFIXES):
+            raise QueryRejected(f"使用できないキーワードが含まれています（{text}）。")
+        if word in STATEMENT_WORDS and _starts_statement(sig, i):
+            raise QueryRejected(f"使用できないキーワードが含まれています（{text}）。")
+        if _is_file_function(sig, i):
+            raise QueryRejected(f"ファイルを読む関数は使用できません（{text}）。")
+    for i in _from_items(sig):
+        kind, text = sig[i][0], sig[i][1]
+        if kind == "string" or (kind == "ident" and any(c in text[1:-1] for c in "/\\.")):
+            raise QueryRejected(f"FROM 句にファイルのパスは指定できません（{text}）。")
+    if sum(t == "(" for _, t, _, _ in sig) != sum(t == ")" for _, t, _, _ in sig):
+        raise QueryRejected("括弧の対応が正しくありません。")
+    return sql.strip()
+
+
+def _starts_statement(sig, i: int) -> bool:
+    """
+    sig[i]（SET / USE）が新しい文の先頭か。
+    「T.Set」「AS Use」や、直後が句のキーワード・演算子・区切りなら列名・別名として扱う。
+    """
+    prev = sig[i - 1][1].upper() if i > 0 else None
+    if prev in (".", "AS", ",", "(", "SELECT", "BY", "DISTINCT"):
+        return False
+    if i + 1 >= len(sig):
+        return False
+    kind, text = sig[i + 1][0], sig[i + 1][1]
+    return kind in ("word", "ident") and text.upper() not in _CLAUSE_WORDS
+
+
+def _clamp_fetch(sql: str, sig, offset: int, max_rows: int) -> tuple[str, bool]:
+    """ORDER BY … OFFSET n ROWS [FETCH NEXT m ROWS ONLY] の m を上限値に丸める（なければ付ける）"""
+    def top_level(start, words):
+        return next((i for i in range(start, len(sig))
+                     if sig[i][3] == 0 and sig[i][0] == "word" and sig[i][1].upper() in words), None)
+
+    rows = top_level(offset + 1, ("ROW", "ROWS"))
+    if rows is None:
+        return sql, False
+    fetch = top_level(rows + 1, ("FETCH",))
+    if fetch is None:
+        end = sig[rows][2] + len(sig[rows][1])
+        return f"{sql[:end]} FETCH NEXT {max_rows} ROWS ONLY{sql[end:]}", True
+    # FETCH NEXT | FIRST <件数> ROW | ROWS ONLY
+    count_end = top_level(fetch + 2, ("ROW", "ROWS"))
+    if count_end is None or count_end <= fetch + 2:
+        return sql, False
+    count = [t for t in sig[fetch + 2:count_end] if t[1] not in ("(", ")")]
+    if len(count) == 1 and count[0][0] == "number" and float(count[0][1]) <= max_rows:
+        return sql, True
+    start = sig[fetch + 2][2]
+    end = sig[count_end - 1][2] + len(sig[count_end - 1][1])
+    return f"{sql[:start]}{max_rows}{sql[end:]}", True
+
+
+def clamp_top(sql: str, max_rows: int) -> tuple[str, bool]:
+    """
+    最上位の SELECT に TOP (max_rows) を付ける（既存の TOP は上限値に丸める）。
+    UNION など集合演算を含む場合は書き換えず、取得時の行数制限に任せる。
+    ORDER BY … OFFSET では TOP を使えないため、FETCH NEXT の件数を丸める。
+
+    Returns:
+        (書き換え後のSQL, TOP / FETCH を適用できたか)
+    """
+    sig = list(_significant(tokenize(sql)))
+    if any(d == 0 and k == "word" and t.upper() in SET_OPERATORS for k, t, _, d in sig):
+        return sql, False
+    top_words = [(i, t.upper()) for i, (k, t, _, d) in enumerate(sig) if d == 0 and k == "word"]
+    order = next((i for i, w in top_words if w == "ORDER"), None)
+    offset = next((i for i, w in top_words if w == "OFFSET" and order is not None and i > order), None)
+    if offset is not None:
+        return _clamp_fetch(sql, sig, offset, max_rows)
+
+    # WITH 句の CTE は括弧内なので、深さ0の最初の SELECT が本体
+    idx = next(
+        (i for i, (k, t, _, d) in enumerate(sig) if d == 0 and k == "word" and t.upper() == "SELECT"),
+        None,
+    )
+    if idx is None:
+        return sql, False
+    i = idx + 1
+    if i < len(sig) and sig[i][1].upper() in ("DISTINCT", "ALL"):
+        i += 1
+    insert_at = sig[i - 1][2] + len(sig[i - 1][1])
+
+    if i < len(sig) and sig[i][1].upper() == "TOP":
+        start = sig[i][2]
+        j = i + 1
+        value = None
+        if j < len(sig) and sig[j][1] == "(":
+            # TOP (expr)
+            depth = sig[j][3]
+            k = j + 1
+            inner = []
+            while k < len(sig) and not (sig[k][1] == ")" and sig[k][3] == depth):
+                inner.append(sig[k])
+                k += 1
+            if len(inner) == 1 and inner[0][0] == "number":
+                value = float(inner[0][1])
+            end_tok = sig[k]
+            j = k + 1
+        elif j < len(sig) and sig[j][0] == "number":
+            value = float(sig[j][1])
+            end_tok = sig[j]
+            j += 1
+        else:
+            return sql, False
+        end = end_tok[2] + len(end_tok[1])
+        percent = j < len(sig) and sig[j][1].upper() == "PERCENT"
+        if percent:
+            end = sig[j][2] + len(sig[j][1])
+        if value is not None and not percent and value <= max_rows:
+            return sql, True
+        return f"{sql[:start]}TOP ({max_rows}){sql[end:]}", True
+
+    return f"{sql[:insert_at]} TOP ({max_rows}){sql[insert_at:]}", True
+
+
+def clamp_limit(sql: str, max_rows: int) -> tuple[str, bool]:
+    """
+    SQLite / DuckDB 用：末尾に LIMIT max_rows を付ける（最上位の既存の LIMIT は上限値に丸める）。
+
+    Returns:
+        (書き換え後のSQL, LIMIT を適用できたか)
+    """
+    sig = list(_significant(tokenize(sql)))
+    idx = next(
+        (i for i in range(len(sig) - 1, -1, -1)
+         if sig[i][3] == 0 and sig[i][0] == "word" and sig[i][1].upper() == "LIMIT"),
+        None,
+    )
+    if idx is None:
+        # 行末コメントの後ろに付けないよう改行を挟む
+        return f"{sql}\nLIMIT {max_rows}", True
+    if idx + 1 < len(sig) and sig[idx + 1][0] == "number":
+        _, text, pos, _ = sig[idx + 1]
+        if float(text) <= max_rows:
+            return sql, True
+        return f"{sql[:pos]}{max_rows}{sql[pos + len(text):]}", True
+    # LIMIT が式の場合は外側で制限する
+    return f"SELECT * FROM (\n{sql}\n) AS governed LIMIT {max_rows}", True
+
+
+def apply_row_limit(sql: str, max_rows: int, dialect: str = "mssql") -> str:
+    """接続先に合わせて TOP（SQL Server）または LIMIT で行数を制限する"""
+    if dialect == "mssql":
+        return clamp_top(sql, max_rows)[0]
+    return clamp_limit(sql, max_rows)[0]
+
+
+def govern_sql(sql: str, max_rows: int, dialect: str = "mssql") -> str:
+    """検査と TOP / LIMIT の付与をまとめて行う"""
+    sql = validate_select(sql)
+    return apply_row_limit(sql, max_rows, dialect)
+
+
+# -------------------------------
+# 実行時の制限
+# -------------------------------
+def _set_timeout(conn, seconds: int | None):
+    """pyodbc のクエリタイムアウトを設定し、元の値を返す（他ドライバーでは何もしない）"""
+    raw = conn.connection.driver_connection
+    if seconds is None or not hasattr(raw, "timeout"):
+        return None
+    previous = raw.timeout
+    raw.timeout = int(seconds)
+    return previous
+
+
+def estimate_cost(conn, sql: str) -> float:
+    """SHOWPLAN_XML で推定コスト（StatementSubTreeCost の最大値）を取得する"""
+    conn.exec_driver_sql("SET SHOWPLAN_XML ON")
+    try:
+        plan = conn.exec_driver_sql(sql).fetchone()[0]
+    finally:
+        conn.exec_driver_sql("SET SHOWPLAN_XML OFF")
+    costs = [float(c) for c in re.findall(r'StatementSubTreeCost="([^"]+)"', plan or "")]
+    return max(costs, default=0.0)
+
+
+def run_governed_query(sql: str, max_rows: int | None = None, timeout: int | None = None,
+                       max_cost: float | None = None) -> pd.DataFrame:
+    """
+    ガードを通した SQL を実行して DataFrame で返す。
+
+    - 検査に失敗した場合・推定コストが上限を超えた場合は QueryRejected
+    - 上限を超える行があった場合は先頭 max_rows 行だけを返し、df.attrs["truncated"] = True
+    """
+    max_rows = max_rows or int(secret("SQL_MAX_ROWS", "1000"))
+    timeout = timeout or int(secret("SQL_TIMEOUT_SECONDS", "30"))
+    max_cost = max_cost if max_cost is not None else float(secret("SQL_MAX_COST", "0"))
+
+    from core.result_cache import get_result_cache  # result_cache が tokenize を使うため遅延
+
+    with span("sql") as s:
+        governed = govern_sql(sql, max_rows, get_engine().dialect.name)
+        df = get_result_cache().get_or_run(
+            governed,
+            lambda: _execute_governed(governed, max_rows, timeout, max_cost, sql),
+            params={"max_rows": max_rows},
+        )
+        s.set(result_rows=len(df), truncated=bool(df.attrs.get("truncated")),
+              source=df.attrs.get("source", "db"))
+    return df
+
+
+def _execute_governed(governed: str, max_rows: int, timeout: int, max_cost: float,
+                      original: str | None = None) -> pd.DataFrame:
+    with span("sql.execute"):
+        return _execute(governed, max_rows, timeout, max_cost, original)
+
+
+def _execute(governed: str, max_rows: int, timeout: int, max_cost: float, original: str | None) -> pd.DataFrame:
+    engine = get_engine()
+    if original is not None:
+        from core.archive import route_query
+
+        df = route_query(original, max_rows, engine)
+        if df is not None:
+            df.attrs["sql"] = governed
+            return df
+    with db_origin("llm_sql"), engine.connect() as conn:
+        previous = _set_timeout(conn, timeout)
+        try:
+            if max_cost > 0 and engine.dialect.name == "mssql":
+                cost = estimate_cost(conn, governed)
+                if cost > max_cost:
+                    raise QueryRejected(
+                        f"推定コストが上限を超えるため実行しません（推定 {cost:.1f} / 上限 {max_cost:.1f}）。"
+                    )
+            # LLM の SQL には ':' を含む文字列リテラルがあり得るため、バインド解析しない
+            started = time.perf_counter()
+            result = conn.exec_driver_sql(governed)
+            rows = result.fetchmany(max_rows + 1)
+            df = pd.DataFrame.from_records(rows[:max_rows], columns=list(result.keys()))
+            result.close()
+            elapsed = time.perf_counter() - started
+        finally:
+            if previous is not None:
+                conn.connection.driver_connection.timeout = previous
+    record_rows(len(df), origin="llm_sql")
+    df.attrs["truncated"] = len(rows) > max_rows
+    df.attrs["sql"] = governed
+    df.attrs["elapsed_ms"] = elapsed * 1000
+    return df
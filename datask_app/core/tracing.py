@@ -0,0 +1,310 @@
+# =============================================================================
+# tracing.py - 質問 1 件ごとの処理時間の内訳（スパン）
+# -----------------------------------------------------------------------------
+# 質問の処理（AI判定・社員名の照合・SQL 実行・グラフ / 座席マップの描画）を
+# スパンとして計測し、質問ごとのリクエストID の下にまとめます。
+#
+# 使い方：
+#   trace = start_trace("question", question=nl)     # app.py（質問の処理の開始）
+#   with span("sql") as s:                           # 各モジュール
+#       df = ...
+#       s.set(rows=len(df))
+#   finish_trace(trace)                              # 記録・ログ出力
+#
+# - スパンはコンテキスト変数で親子関係をたどる（トレースの外では何もしない）
+# - core/metrics.py のエンジンのイベントから、スパンごとの DB 時間・クエリ数・件数を加算
+# - LLM のトークン使用量は core/openai_sql.py が llm スパンに記録
+# - 終了したトレースは直近 TRACE_RECENT 件をメモリに保持（サイドバーの p50 / p95）
+# - TRACE_LOG_PATH を設定すると、1 行 1 トレースの JSONL を追記（サイズでローテーション）
+#
+# 設定（secrets / 環境変数）：
+#   TRACE_LOG_PATH     : JSONL の出力先（未設定なら書き出さない）
+#   TRACE_LOG_MAX_MB   : ローテーションするサイズ（既定 10）
+#   TRACE_LOG_BACKUPS  : 残す世代数（既定 5）
+#   TRACE_RECENT       : メモリに保持するトレース数（既定 200）
+#
+# コマンド（datask_app ディレクトリで実行、ローテーション済みのファイルも読む）：
+#   python -m core.tracing report traces.jsonl     # スパン名ごとの件数・p50・p95・最大
+# =============================================================================
+
+import argparse
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+_current_trace: ContextVar["Trace | None"] = ContextVar("datask_trace", default=None)
+_current_span: ContextVar["Span | None"] = ContextVar("datask_span", default=None)
+
+_log_lock = threading.Lock()
+_logger: logging.Logger | None = None
+_recent_lock = threading.Lock()
+_recent: deque | None = None
+
+
+class Span:
+    """1 区間の計測（開始はトレースの開始からのミリ秒）"""
+
+    __slots__ = ("name", "span_id", "parent", "start", "end", "attrs", "error")
+
+    def __init__(self, name: str, span_id: int, parent: int | None, start: float, attrs: dict):
+        self.name = name
+        self.span_id = span_id
+        self.parent = parent
+        self.start = start
+        self.end = None
+        self.attrs = attrs
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def add(self, key: str, value: float):
+        self.attrs[key] = round(self.attrs.get(key, 0) + value, 3)
+
+    def to_dict(self, origin: float) -> dict:
+        end = self.end if self.end is not None else time.perf_counter()
+        return {
+            "name": self.name, "span_id": self.span_id, "parent": self.parent,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round((end - self.start) * 1000, 3),
+            "attrs": self.attrs, "error": self.error,
+        }
+
+
+class _NullSpan:
+    """トレースの外で使われたスパン（何も記録しない）"""
+
+    def set(self, **attrs):
+        return self
+
+    def add(self, key: str, value: float):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    """質問 1 件分のスパンの集まり"""
+
+    def __init__(self, name: str, attrs: dict):
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attrs = attrs
+        self.started_at = datetime.now().isoformat(timespec="milliseconds")
+        self.root = Span(name, 0, None, time.perf_counter(), {})
+        self.spans = [self.root]
+        self._token = None
+        self._span_token = None
+
+    def new_span(self, name: str, parent: Span | None, attrs: dict) -> Span:
+        s = Span(name, len(self.spans), parent.span_id if parent else 0, time.perf_counter(), attrs)
+        self.spans.append(s)
+        return s
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.root.end if self.root.end is not None else time.perf_counter()
+        return (end - self.root.start) * 1000
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id, "name": self.name, "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 3), "attrs": self.attrs,
+            "spans": [s.to_dict(self.root.start) for s in self.spans],
+        }
+
+
+# -------------------------------
+# トレース・スパン
+# -------------------------------
+def start_trace(name: str, /, **attrs) -> Trace:
+    """トレースを開始し、以降のスパンをこのトレースに記録する"""
+    trace = Trace(name, attrs)
+    trace._token = _current_trace.set(trace)
+    trace._span_token = _current_span.set(trace.root)
+    return trace
+
+
+def finish_trace(trace: Trace, **attrs) -> dict:
+    """トレースを終了して記録する（直近の一覧と JSONL）"""
+    trace.attrs.update(attrs)
+    trace.root.end = time.perf_counter()
+    _current_span.reset(trace._span_token)
+    _current_trace.reset(trace._token)
+    record = trace.to_dict()
+    _remember(record)
+    logger = _trace_logger()
+    if logger is not None:
+        logger.info(json.dumps(record, ensure_ascii=False, default=str))
+    return record
+
+
+@contextmanager
+def trace(name: str, /, **attrs):
+    """with で使うトレース（終了時に finish_trace）"""
+    t = start_trace(name, **attrs)
+    try:
+        yield t
+    except Exception as e:
+        t.root.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        finish_trace(t)
+
+
+@contextmanager
+def span(name: str, /, **attrs):
+    """区間を計測する（トレースの外では何もしない。デコレーターとしても使える）"""
+    t = _current_trace.get()
+    if t is None:
+        yield NULL_SPAN
+        return
+    s = t.new_span(name, _current_span.get(), attrs)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except Exception as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+def current_span() -> Span | _NullSpan:
+    return _current_span.get() or NULL_SPAN
+
+
+def current_trace() -> Trace | None:
+    return _current_trace.get()
+
+
+def add_db_time(seconds: float, rows: int | None = None):
+    """実行中のスパンに DB 時間を加算する（core/metrics.py から呼ばれる）"""
+    s = _current_span.get()
+    if s is None:
+        return
+    s.add("db_ms", round(seconds * 1000, 3))
+    s.add("db_queries", 1)
+    if rows:
+        s.add("db_rows", rows)
+
+
+# -------------------------------
+# 記録先
+# -------------------------------
+def _remember(record: dict):
+    global _recent
+    with _recent_lock:
+        if _recent is None:
+            from core.config import secret
+
+            _recent = deque(maxlen=int(secret("TRACE_RECENT", "200")))
+        _recent.append(record)
+
+
+def recent_traces() -> list[dict]:
+    with _recent_lock:
+        return list(_recent or [])
+
+
+def _trace_logger() -> logging.Logger | None:
+    """TRACE_LOG_PATH があれば JSONL を書くロガー（初回だけ設定）"""
+    global _logger
+    if _logger is not None:
+        return _logger if _logger.handlers else None
+    with _log_lock:
+        if _logger is None:
+            from core.config import secret
+
+            logger = logging.getLogger("datask.trace")
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            path = secret("TRACE_LOG_PATH")
+            if path and not logger.handlers:
+                handler = RotatingFileHandler(
+                    path, encoding="utf-8",
+                    maxBytes=int(float(secret("TRACE_LOG_MAX_MB", "10")) * 1024 * 1024),
+                    backupCount=int(secret("TRACE_LOG_BACKUPS", "5")),
+                )
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger.addHandler(handler)
+            _logger = logger
+    return _logger if _logger.handlers else None
+
+
+# -------------------------------
+# 集計
+# -------------------------------
+def _percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(traces: list[dict]) -> list[dict]:
+    """スパン名ごとの件数・p50・p95・最大（ミリ秒）。トレース全体は名前の先頭に「*」"""
+    durations: dict[str, list[float]] = {}
+    for t in traces:
+        durations.setdefault(f"*{t['name']}", []).append(t["duration_ms"])
+        for s in t["spans"][1:]:
+            durations.setdefault(s["name"], []).append(s["duration_ms"])
+    return [
+        {
+            "span": name, "count": len(values),
+            "p50_ms": round(_percentile(values, 0.5), 1),
+            "p95_ms": round(_percentile(values, 0.95), 1),
+            "max_ms": round(max(values), 1),
+        }
+        for name, values in sorted(durations.items(), key=lambda kv: -_percentile(kv[1], 0.95))
+    ]
+
+
+def read_trace_log(path: str) -> list[dict]:
+    """JSONL（ローテーション済みの path.1, path.2 ... も含む）を古い順に読む"""
+    files = sorted(glob.glob(f"{glob.escape(path)}.*"), key=lambda p: -int(p.rsplit(".", 1)[1])
+                   if p.rsplit(".", 1)[1].isdigit() else 0)
+    traces = []
+    for file in [f for f in files if f.rsplit(".", 1)[1].isdigit()] + [path]:
+        if not os.path.exists(file):
+            continue
+        with open(file, encoding="utf-8") as f:
+            traces.extend(json.loads(line) for line in f if line.strip())
+    return traces
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="トレースの JSONL の集計")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report = sub.add_parser("report", help="スパン名ごとの p50 / p95")
+    report.add_argument("path")
+    report.add_argument("--name", help="このトレース名だけを集計")
+    args = parser.parse_args(argv)
+
+    traces = read_trace_log(args.path)
+    if args.name:
+        traces = [t for t in traces if t["name"] == args.name]
+    print(f"{len(traces)} トレース")
+    print(f"{'span':<24} {'count':>7} {'p50_ms':>10} {'p95_ms':>10} {'max_ms':>10}")
+    for row in summarize(traces):
+        print(f"{row['span']:<24} {row['count']:>7} {row['p50_ms']:>10} {row['p95_ms']:>10} {row['max_ms']:>10}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -4,68 +4,53 @@
 # このモジュールは初期データ確認用にのみ使用します。
 # 2025年1月〜5月の範囲で、全日ランダムに社員が席に着いたログを生成します。
 # 各日最低10件（最大20件）を挿入します。
+# 期間・件数は引数で変更でき、負荷試験用に数年分の履歴も生成できます。
 # =============================================================================
 
-import random
-from datetime import datetime, timedelta
+import numpy as np
 import pandas as pd
-import sqlalchemy as sa
-from core.db import engine
+from core.db import get_engine
+from core.ingest import ingest
 
 
-def generate_dummy_seatlog() -> pd.DataFrame:
+def generate_dummy_seatlog(start: str = "2025-01-01", end: str = "2025-05-31",
+                           min_per_day: int = 10, max_per_day: int = 20,
+                           seed: int | None = None) -> pd.DataFrame:
     """
-    2025年1月〜5月の各日に最低10件のSeatLogを生成（最大20件）
+    start〜end の各日に min_per_day〜max_per_day 件の SeatLog を生成
+    （NumPy でまとめて生成するため、数年分でも数秒で作成できる）
     ・SeatId：1〜20
     ・EmpCode：E10001〜E10050
     ・CheckIn：9:00〜10:00の間
     ・CheckOut：6〜9時間後
     """
-    seat_ids = list(range(1, 21))  # SeatId: 1〜20
-    emp_codes = [f"E{10000 + i:03}" for i in range(1, 51)]  # E10001〜E10050
-    start_date = datetime(2025, 1, 1)
-    end_date = datetime(2025, 5, 31)
+    rng = np.random.default_rng(seed)
+    emp_codes = np.array([f"E{10000 + i:03}" for i in range(1, 51)])  # E10001〜E10050
+    days = pd.date_range(start, end, freq="D").to_numpy()
 
-    data = []
-    current_day = start_date
+    # 1日あたりの件数だけ日付を繰り返す
+    per_day = rng.integers(min_per_day, max_per_day + 1, size=len(days))
+    day = np.repeat(days, per_day)
+    n = len(day)
 
-    while current_day <= end_date:
-        entries_today = random.randint(10, 20)  # 1日あたり10〜20件
-        for _ in range(entries_today):
-            seat_id = random.choice(seat_ids)
-            emp_code = random.choice(emp_codes)
+    # CheckIn は 9:00〜10:00、CheckOut はその 6〜9時間後（分単位）
+    check_in = day + np.timedelta64(9 * 60, "m") + rng.integers(0, 61, size=n).astype("timedelta64[m]")
+    stay = rng.integers(6, 10, size=n) * 60 + rng.integers(0, 60, size=n)
+    check_out = check_in + stay.astype("timedelta64[m]")
 
-            # CheckIn は 9:00〜10:00 の範囲でランダム
-            check_in = datetime.combine(current_day, datetime.min.time()) + timedelta(hours=9, minutes=random.randint(0, 60))
-            check_out = check_in + timedelta(hours=random.randint(6, 9), minutes=random.randint(0, 59))
+    return pd.DataFrame({
+        "SeatId": rng.integers(1, 21, size=n),  # SeatId: 1〜20
+        "EmpCode": emp_codes[rng.integers(0, len(emp_codes), size=n)],
+        "CheckIn": check_in,
+        "CheckOut": check_out,
+    })
 
-            data.append({
-                "SeatId": seat_id,
-                "EmpCode": emp_code,
-                "CheckIn": check_in,
-                "CheckOut": check_out
-            })
 
-        current_day += timedelta(days=1)
-
-    return pd.DataFrame(data)
-
-
-def insert_seatlog(df: pd.DataFrame):
+def insert_seatlog(df: pd.DataFrame, chunk_size: int = 5000) -> dict:
     """
-    DataFrameからSeatLogに一括INSERT
+    DataFrameからSeatLogに一括INSERT（core/ingest.py 経由、重複はスキップ）
     """
-    with engine.begin() as conn:
-        for _, row in df.iterrows():
-            conn.execute(sa.text("""
-                INSERT INTO SeatLog (SeatId, EmpCode, CheckIn, CheckOut)
-                VALUES (:seat, :emp, :cin, :cout)
-            """), {
-                "seat": row.SeatId,
-                "emp": row.EmpCode,
-                "cin": row.CheckIn,
-                "cout": row.CheckOut
-            })
+    return ingest(get_engine(), "SeatLog", df, chunk_size=chunk_size)
 
 
 def create_test_logs():
@@ -74,4 +59,4 @@ def create_test_logs():
     Streamlitのボタンから呼び出し可能
     """
     df = generate_dummy_seatlog()
-    insert_seatlog(df)
+    return insert_seatlog(df)
@@ -0,0 +1,174 @@
+# =============================================================================
+# search_stub.py - Azure AI Search の代わりに使うローカル HTTP サーバー
+# -----------------------------------------------------------------------------
+# core/search_client.py をネットワークなしで確認するための簡易サーバーです。
+# 文書はメモリ上に保持し、次の API だけを受け付けます。
+#   GET  /indexes                          : インデックス一覧
+#   POST /indexes/{name}/docs/index        : mergeOrUpload / upload / delete（200 または 207）
+#   POST /indexes/{name}/docs/search       : 部分一致の簡易検索
+#   GET  /stats                            : 受け付けたリクエスト数・接続数・文書数
+# -----------------------------------------------------------------------------
+# 障害の再現：
+#   --fail-rate 0.1      : リクエストの 10% を --fail-status（既定 503、Retry-After: 0）で失敗させる
+#   --doc-fail-rate 0.01 : 文書の 1% を 207 の個別失敗にする
+#   --latency-ms 20      : 応答を遅らせる
+# 接続数がリクエスト数より十分少なければ、keep-alive で接続が再利用されています。
+#
+# 使用例（datask_app ディレクトリで実行）：
+#   python -m tools.search_stub --port 8765 --fail-rate 0.1
+# =============================================================================
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+INDEX_PATH_RE = re.compile(r"^/indexes/([^/]+)/docs/(index|search)$")
+
+
+class StubState:
+    def __init__(self, fail_rate: float = 0.0, fail_status: int = 503, doc_fail_rate: float = 0.0,
+                 latency_ms: float = 0.0, seed: int | None = None):
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.doc_fail_rate = doc_fail_rate
+        self.latency_ms = latency_ms
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.indexes: dict[str, dict[str, dict]] = {}
+        self.requests = 0
+        self.connections = 0
+        self.failures = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests, "connections": self.connections, "failures": self.failures,
+                "documents": {name: len(docs) for name, docs in self.indexes.items()},
+            }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    state: StubState = None
+
+    def setup(self):
+        super().setup()
+        with self.state.lock:
+            self.state.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: dict | None = None, headers: dict | None = None):
+        data = json.dumps(body or {}, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _begin(self) -> bool:
+        """共通処理：遅延・件数・障害の注入（失敗を返したら False）"""
+        state = self.state
+        if state.latency_ms:
+            time.sleep(state.latency_ms / 1000)
+        with state.lock:
+            state.requests += 1
+            fail = state.random.random() < state.fail_rate
+            if fail:
+                state.failures += 1
+        if fail:
+            self._reply(state.fail_status, {"error": {"message": "injected failure"}}, {"Retry-After": "0"})
+            return False
+        if not self.headers.get("api-key"):
+            self._reply(403, {"error": {"message": "api-key is required"}})
+            return False
+        return True
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/stats":
+            self._reply(200, self.state.stats())
+            return
+        if not self._begin():
+            return
+        if path == "/indexes":
+            with self.state.lock:
+                names = list(self.state.indexes)
+            self._reply(200, {"value": [{"name": n} for n in names]})
+        else:
+            self._reply(404, {"error": {"message": path}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self._begin():
+            return
+        m = INDEX_PATH_RE.match(self.path.split("?")[0])
+        if m is None:
+            self._reply(404, {"error": {"message": self.path}})
+            return
+        name, op = m.groups()
+        state = self.state
+        with state.lock:
+            docs = state.indexes.setdefault(name, {})
+            if op == "search":
+                text = body.get("search", "")
+                hits = [d for d in docs.values() if text in d.get("content", "")][:body.get("top", 50)]
+                self._reply(200, {"value": hits})
+                return
+            results = []
+            for action in body.get("value", []):
+                key = str(action.get("id"))
+                if state.random.random() < state.doc_fail_rate:
+                    results.append({"key": key, "status": False, "errorMessage": "injected", "statusCode": 503})
+                    continue
+                kind = action.get("@search.action", "upload")
+                fields = {k: v for k, v in action.items() if k != "@search.action"}
+                if kind == "delete":
+                    docs.pop(key, None)
+                elif kind in ("merge", "mergeOrUpload"):
+                    docs[key] = {**docs.get(key, {}), **fields}
+                else:
+                    docs[key] = fields
+                results.append({"key": key, "status": True, "errorMessage": None, "statusCode": 200})
+        partial = any(not r["status"] for r in results)
+        self._reply(207 if partial else 200, {"value": results})
+
+
+def serve(port: int = 8765, host: str = "127.0.0.1", **options) -> ThreadingHTTPServer:
+    """サーバーを作成して返す（serve_forever は呼び出し側で実行）"""
+    handler = type("Handler", (StubHandler,), {"state": StubState(**options)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Azure AI Search の代わりのローカルサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--doc-fail-rate", type=float, default=0.0)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    server = serve(args.port, args.host, fail_rate=args.fail_rate, fail_status=args.fail_status,
+                   doc_fail_rate=args.doc_fail_rate, latency_ms=args.latency_ms, seed=args.seed)
+    print(f"search stub: http://{args.host}:{args.port}（Ctrl+C で終了）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,48 +2,49 @@
 # upload_faq.py - FAQデータを Azure AI Search にアップロード
 # -----------------------------------------------------------------------------
 # このモジュールは Streamlit アプリまたはローカルから呼び出して、
-# faq-index に簡易的な質問文を登録するために使用します。
+# FAQ ファイル（data/faq.jsonl、FAQ_DOCS_PATH で変更可）の内容を faq-index に登録します。
+# アプリの FAQ 検索はローカルのインデックス（core/faq_index.py）で行うため、
+# Azure AI Search への反映は任意です（python -m core.faq_index sync --azure でも実行可）。
+# 送信は core/search_client.py の共有クライアントで、1000 件ずつ並列に行います。
 # -----------------------------------------------------------------------------
-# 依存: core/config.py にある get_secret() を使用して
-# AZURE_SEARCH_ENDPOINT / AZURE_SEARCH_API_KEY を取得します。
+# 依存: core/search_client.py が AZURE_SEARCH_ENDPOINT / AZURE_SEARCH_API_KEY を使用します。
 # =============================================================================
 
-import os
-import requests
-import json
 from core.config import get_secret
+from core.search_client import get_search_client, summarize
 
-def upload_faq():
-    """FAQデータを Azure AI Search にアップロードする"""
-    endpoint = get_secret("AZURE_SEARCH_ENDPOINT")
-    api_key = get_secret("AZURE_SEARCH_API_KEY")
-    index_name = "faq-index"
-
-    docs = [
-        { "id": "1", "content": "現在空いている席は？" },
-        { "id": "2", "content": "固定席とフリー席の違いは？" },
-        { "id": "3", "content": "利用状況を確認したい" },
-        { "id": "4", "content": "過去の座席利用履歴を見せて" },
-        { "id": "5", "content": "一番利用されていない席を教えて" }
-    ]
-
-    url = f"{endpoint}/indexes/{index_name}/docs/index?api-version=2023-07-01-Preview"
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": api_key
-    }
-    payload = {
-        "value": [{"@search.action": "upload", **doc} for doc in docs]
-    }
-
-    try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
-        if response.status_code == 200:
-            return True, "FAQデータをアップロードしました"
-        else:
-            return False, f"エラー: {response.status_code}\n{response.text}"
-    except Exception as e:
-        return False, f"アップロード中に例外が発生しました: {e}"
+def upload_faq(docs: list[dict] | None = None, deleted_ids: list[str] = ()):
+    """
+    FAQデータを Azure AI Search にアップロードする
+
+    Args:
+        docs: [{"id", "content"}]（省略時は FAQ ファイルの内容）
+        deleted_ids: インデックスから削除する文書ID
+
+    Returns:
+        (すべて成功したか, メッセージ)
+    """
+    from core.faq_index import DEFAULT_DOCS_PATH, read_faq_docs
+
+    client = get_search_client()
+    if client is None:
+        return False, "AZURE_SEARCH_ENDPOINT / AZURE_SEARCH_API_KEY が設定されていません"
+
+    if docs is None:
+        docs = read_faq_docs(get_secret("FAQ_DOCS_PATH", DEFAULT_DOCS_PATH))
+
+    results = client.upload_documents(
+        docs, deleted_ids, workers=int(get_secret("AZURE_SEARCH_UPLOAD_WORKERS", "4"))
+    )
+    message = summarize(results)
+    for r in results:
+        if r.error is not None:
+            message += f"\nバッチ {r.number}: エラー {r.status or ''} {r.error}"
+        elif r.failed:
+            message += f"\nバッチ {r.number}: {len(r.failed)} 件失敗（{', '.join(list(r.failed)[:10])}）"
+    if all(r.ok for r in results):
+        return True, f"FAQデータをアップロードしました（{message}）"
+    return False, message
 
 # テスト実行用（単独実行）
 if __name__ == "__main__":
@@ -3,78 +3,376 @@
 # -----------------------------------------------------------------------------
 # - Seat usage counts (draw_usage_bar_chart)
 # - Monthly usage counts per employee (draw_monthly_usage_chart)
+# - Department usage per month (get_dept_usage)
 # - JP font rendering support (for Windows/macOS/Linux)
+#
+# matplotlib is imported and the font configured on the first draw, not at
+# import time, so pages that never draw a chart don't pay for it.
+#
+# Rendering:
+# - Charts are drawn on a standalone Figure (no pyplot, so nothing is kept in
+#   pyplot's global figure registry) and released as soon as the bytes are out
+# - Rendered output is cached per (chart type, key, data version, format) in a
+#   byte-bounded LRU (ChartCache); the data version is MAX(SeatLog.LogId) plus the
+#   rollup watermark, probed at most every CHART_CACHE_PROBE_SECONDS
+# - DATASK_CHART_RENDERER (secrets / env): png (default) / svg / native
+#   (native = Vega-Lite spec drawn by the browser, no matplotlib at all)
+# - bench/soak_charts.py renders thousands of charts and checks RSS stays flat
+# - Inside a request trace (core/tracing.py) each lookup is a "chart" span
+#   (cached or not) with a nested "render" span when the chart is drawn
+#
+# Settings (secrets / env):
+#   CHART_CACHE_MAX_MB        : cache size limit (default 32MB)
+#   CHART_CACHE_PROBE_SECONDS : data version probe interval (default 5s)
+#
+# Monthly / department queries read the SeatLogMonthly rollup (core/rollup.py)
+# plus the few SeatLog rows above its watermark, instead of scanning SeatLog.
+# Where the rollup tables don't exist (rollup_status), they aggregate SeatLog alone.
+# Seat usage counts read archived months from the Parquet archive (core/archive.py)
+# when DATASK_ARCHIVE_DIR is set, and only the months after it from SeatLog.
+# Queries are SQLAlchemy Core expressions (core/dialect.py), so they run on
+# SQL Server, SQLite and DuckDB alike.
 # =============================================================================
 
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 import pandas as pd
 import sqlalchemy as sa
-import matplotlib
-import matplotlib.pyplot as plt
 import streamlit as st
 import platform
-from matplotlib.font_manager import FontProperties
+from core.config import secret
+from core.dialect import (
+    employee, minutes_between, month_of, rollup_state, seat, seatlog, seatlog_monthly,
+)
+from core.metrics import db_origin, record_rows
+from core.rollup import rollup_status
+from core.tracing import span
 
 # ▼ Platform-based Japanese font configuration (only for Streamlit rendering safety)
-if platform.system() == "Windows":
-    jp_font = FontProperties(fname="C:/Windows/Fonts/YuGothR.ttc")
-    matplotlib.rc("font", family="Yu Gothic")
-elif platform.system() == "Darwin":
-    jp_font = FontProperties(fname="/System/Library/Fonts/ヒラギノ丸ゴ ProN W4.ttc")
-    matplotlib.rc("font", family="Hiragino Maru Gothic Pro")
-else:
-    jp_font = FontProperties(fname="/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc")
-    matplotlib.rc("font", family="Noto Sans CJK JP")
-
-matplotlib.rcParams["axes.unicode_minus"] = False
+JP_FONTS = {
+    "Windows": ("C:/Windows/Fonts/YuGothR.ttc", "Yu Gothic"),
+    "Darwin": ("/System/Library/Fonts/ヒラギノ丸ゴ ProN W4.ttc", "Hiragino Maru Gothic Pro"),
+}
+DEFAULT_JP_FONT = ("/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc", "Noto Sans CJK JP")
+
+@st.cache_resource
+def jp_font():
+    """Configure matplotlib for Japanese text once per process; returns the FontProperties or None"""
+    import matplotlib
+    from matplotlib.font_manager import FontProperties
+
+    path, family = JP_FONTS.get(platform.system(), DEFAULT_JP_FONT)
+    matplotlib.rcParams["axes.unicode_minus"] = False
+    if not os.path.exists(path):
+        return None
+    matplotlib.rc("font", family=family)
+    return FontProperties(fname=path)
+
+@contextmanager
+def _figure(figsize: tuple[float, float]):
+    """A standalone Figure + Axes, cleared on exit so nothing outlives the render"""
+    jp_font()
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    try:
+        yield fig, fig.add_subplot()
+    finally:
+        fig.clear()
+
+RENDERERS = ("png", "svg", "native")
+MIME_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+PNG_DPI = 100
 
 # -------------------------------
 # Seat usage counts
 # -------------------------------
+@db_origin("chart")
 def get_seat_usage_counts(engine) -> pd.DataFrame:
-    sql = """
-    SELECT S.Label, COUNT(*) AS UsageCount
-    FROM SeatLog L
-    JOIN Seat S ON S.SeatId = L.SeatId
-    GROUP BY S.Label
-    ORDER BY S.Label
-    """
-    return pd.read_sql(sa.text(sql), engine)
+    from core.archive import get_archive
+
+    archive = get_archive()
+    cutoff = archive.cutoff() if archive is not None else None
+    if cutoff is None:
+        query = (
+            sa.select(seat.c.Label, sa.func.count().label("UsageCount"))
+            .select_from(seatlog.join(seat, seat.c.SeatId == seatlog.c.SeatId))
+            .group_by(seat.c.Label)
+            .order_by(seat.c.Label)
+        )
+        df = pd.read_sql(query, engine)
+        record_rows(len(df))
+        return df
+
+    # Archived months from Parquet, the rest (CheckIn >= cutoff) from SeatLog
+    recent = (
+        sa.select(seatlog.c.SeatId, sa.func.count().label("UsageCount"))
+        .where(seatlog.c.CheckIn >= cutoff)
+        .group_by(seatlog.c.SeatId)
+    )
+    with engine.connect() as conn:
+        counts = pd.read_sql(recent, conn)
+        labels = pd.read_sql(sa.select(seat.c.SeatId, seat.c.Label), conn)
+    record_rows(len(counts) + len(labels))
+    archived = archive.query("SELECT SeatId, COUNT(*) AS UsageCount FROM SeatLog GROUP BY SeatId")
+    counts = pd.concat([counts, archived]).groupby("SeatId", as_index=False)["UsageCount"].sum()
+    df = (
+        counts.merge(labels, on="SeatId")
+        .groupby("Label", as_index=False)["UsageCount"].sum()
+        .sort_values("Label", ignore_index=True)
+    )
+    df["UsageCount"] = df["UsageCount"].astype(int)
+    return df
 
 def draw_usage_bar_chart(df: pd.DataFrame):
-    fig, ax = plt.subplots(figsize=(10, 4))
-    ax.bar(df["Label"], df["UsageCount"], color="skyblue", edgecolor="black")
-    ax.set_title("Usage Count per Seat")
-    ax.set_xlabel("Seat")
-    ax.set_ylabel("Usage Count")
-    ax.set_xticklabels(df["Label"], rotation=45, ha="right")
-    st.pyplot(fig)
+    _show(render_chart("seat_usage", df, _renderer()))
 
 # -------------------------------
 # Monthly usage per employee
 # -------------------------------
+def _rollup_watermark(engine):
+    # Without the rollup tables every SeatLog row counts as "recent"
+    if not rollup_status(engine)["available"]:
+        return sa.literal(0)
+    return sa.select(rollup_state.c.LastLogId).where(rollup_state.c.Id == 1).scalar_subquery()
+
+def _with_rollup(engine, rolled, recent):
+    return sa.union_all(rolled, recent) if rollup_status(engine)["available"] else recent
+
+@db_origin("chart")
 def get_monthly_usage_by_employee(engine, emp_code: str) -> pd.DataFrame:
-    sql = """
-    SELECT 
-        FORMAT(CheckIn, 'yyyy-MM') AS Month,
-        COUNT(*) AS UsageCount
-    FROM SeatLog
-    WHERE EmpCode = :emp
-    GROUP BY FORMAT(CheckIn, 'yyyy-MM')
-    ORDER BY Month
-    """
+    # Rollup rows + raw rows newer than the rollup watermark (LogId range seek)
+    rolled = sa.select(seatlog_monthly.c.Month, seatlog_monthly.c.UsageCount).where(
+        seatlog_monthly.c.EmpCode == emp_code
+    )
+    recent = sa.select(
+        month_of(seatlog.c.CheckIn).label("Month"), sa.literal_column("1").label("UsageCount")
+    ).where(seatlog.c.LogId > _rollup_watermark(engine), seatlog.c.EmpCode == emp_code)
+    u = _with_rollup(engine, rolled, recent).subquery("U")
+    query = (
+        sa.select(u.c.Month, sa.func.sum(u.c.UsageCount).label("UsageCount"))
+        .group_by(u.c.Month)
+        .order_by(u.c.Month)
+    )
     with engine.begin() as conn:
-        df = pd.read_sql(sa.text(sql), conn, params={"emp": emp_code})
+        df = pd.read_sql(query, conn)
+    record_rows(len(df))
+    return df
+
+# -------------------------------
+# Department usage per month
+# -------------------------------
+@db_origin("chart")
+def get_dept_usage(engine, start_month: str | None = None, end_month: str | None = None) -> pd.DataFrame:
+    """Dept x Month usage count and minutes, optionally limited to 'yyyy-MM' bounds (inclusive)"""
+    rolled = sa.select(
+        seatlog_monthly.c.Dept, seatlog_monthly.c.Month,
+        seatlog_monthly.c.UsageCount, seatlog_monthly.c.TotalMinutes,
+    )
+    recent = (
+        sa.select(
+            employee.c.Dept,
+            month_of(seatlog.c.CheckIn).label("Month"),
+            sa.literal_column("1").label("UsageCount"),
+            sa.func.coalesce(minutes_between(seatlog.c.CheckIn, seatlog.c.CheckOut), 0).label("TotalMinutes"),
+        )
+        .select_from(seatlog.outerjoin(employee, employee.c.EmpCode == seatlog.c.EmpCode))
+        .where(seatlog.c.LogId > _rollup_watermark(engine))
+    )
+    u = _with_rollup(engine, rolled, recent).subquery("U")
+    query = sa.select(
+        u.c.Dept, u.c.Month,
+        sa.func.sum(u.c.UsageCount).label("UsageCount"),
+        sa.func.sum(u.c.TotalMinutes).label("TotalMinutes"),
+    )
+    if start_month is not None:
+        query = query.where(u.c.Month >= start_month)
+    if end_month is not None:
+        query = query.where(u.c.Month <= end_month)
+    query = query.group_by(u.c.Dept, u.c.Month).order_by(u.c.Dept, u.c.Month)
+    with engine.begin() as conn:
+        df = pd.read_sql(query, conn)
+    record_rows(len(df))
     return df
 
 def draw_monthly_usage_chart(df: pd.DataFrame, name: str = ""):
     if df.empty:
         st.warning("No data available.")
         return
-    fig, ax = plt.subplots(figsize=(8, 4))
-    ax.bar(df["Month"], df["UsageCount"], color="salmon", edgecolor="black")
-    ax.set_title(f"Monthly Usage")
-    ax.set_xlabel("Month")
+    _show(render_chart("monthly_usage", df, _renderer()))
+
+# -------------------------------
+# Chart specs and rendering
+# -------------------------------
+# chart type -> (x column, title, x label, bar color, figure size)
+CHARTS = {
+    "seat_usage": ("Label", "Usage Count per Seat", "Seat", "skyblue", (10, 4)),
+    "monthly_usage": ("Month", "Monthly Usage", "Month", "salmon", (8, 4)),
+}
+
+def _plot(ax, kind: str, df: pd.DataFrame):
+    x, title, x_label, color, _ = CHARTS[kind]
+    ax.bar(range(len(df)), df["UsageCount"], color=color, edgecolor="black")
+    ax.set_title(title)
+    ax.set_xlabel(x_label)
     ax.set_ylabel("Usage Count")
-    ax.set_xticks(range(len(df["Month"])))
-    ax.set_xticklabels(df["Month"], rotation=45, ha="right")
-    st.pyplot(fig)
+    ax.set_xticks(range(len(df)))
+    ax.set_xticklabels(df[x].astype(str), rotation=45, ha="right")
+
+def vega_spec(kind: str, df: pd.DataFrame) -> dict:
+    """Vega-Lite spec for st.vega_lite_chart (the browser draws it, no matplotlib)"""
+    x, title, x_label, color, _ = CHARTS[kind]
+    return {
+        "$schema": "https://vega.github.io/schema/vega-lite/v5.json",
+        "title": title,
+        "data": {"values": [{x: str(k), "UsageCount": int(v)} for k, v in zip(df[x], df["UsageCount"])]},
+        "mark": {"type": "bar", "color": color, "stroke": "black"},
+        "encoding": {
+            "x": {"field": x, "type": "ordinal", "title": x_label, "axis": {"labelAngle": -45}},
+            "y": {"field": "UsageCount", "type": "quantitative", "title": "Usage Count"},
+            "tooltip": [{"field": x}, {"field": "UsageCount"}],
+        },
+    }
+
+def render_chart(kind: str, df: pd.DataFrame, fmt: str = "png") -> bytes | dict:
+    """PNG / SVG bytes, or the Vega-Lite spec when fmt is "native" """
+    if fmt == "native":
+        return vega_spec(kind, df)
+    if fmt not in MIME_TYPES:
+        raise ValueError(f"unsupported chart format: {fmt} ({' / '.join(RENDERERS)})")
+    buf = io.BytesIO()
+    with _figure(CHARTS[kind][4]) as (fig, ax):
+        _plot(ax, kind, df)
+        fig.tight_layout()
+        fig.savefig(buf, format=fmt, dpi=PNG_DPI)
+    return buf.getvalue()
+
+def _renderer() -> str:
+    return (secret("DATASK_CHART_RENDERER", "png") or "png").lower()
+
+def _show(chart: bytes | dict):
+    if isinstance(chart, dict):
+        st.vega_lite_chart(chart)
+    elif chart.lstrip().startswith(b"<"):
+        st.markdown(f'<div style="overflow:auto">{chart.decode("utf-8")}</div>', unsafe_allow_html=True)
+    else:
+        st.image(chart)
+
+# -------------------------------
+# Rendered chart cache
+# -------------------------------
+def _size(chart: bytes | dict) -> int:
+    return len(chart) if isinstance(chart, bytes) else len(json.dumps(chart))
+
+class ChartCache:
+    """Rendered charts keyed by (chart type, key, data version, format); byte-bounded LRU"""
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, probe_interval: float = 5.0):
+        self.max_bytes = max_bytes
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, bytes | dict] = OrderedDict()
+        self._versions: dict[str, tuple[float, tuple]] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.renders = 0
+
+    def data_version(self, engine) -> tuple:
+        """(MAX(SeatLog.LogId), rollup watermark), re-probed after probe_interval seconds"""
+        url = str(engine.url)
+        now = time.time()
+        cached = self._versions.get(url)
+        if cached is None or now - cached[0] > self.probe_interval:
+            query = sa.select(sa.func.max(seatlog.c.LogId), _rollup_watermark(engine))
+            with db_origin("cache_probe"), engine.connect() as conn:
+                cached = (now, tuple(conn.execute(query).one()))
+            self._versions[url] = cached
+        return cached[1]
+
+    def get_or_render(self, engine, kind: str, key: str, load, fmt: str) -> bytes | dict | None:
+        """Cached chart, or load(engine) -> DataFrame and render it; None when there is no data"""
+        with span("chart", kind=kind, fmt=fmt) as s:
+            return self._get_or_render(engine, kind, key, load, fmt, s)
+
+    def _get_or_render(self, engine, kind, key, load, fmt, s) -> bytes | dict | None:
+        entry_key = (kind, key, self.data_version(engine), fmt)
+        with self._lock:
+            chart = self._entries.get(entry_key)
+            if chart is not None:
+                self._entries.move_to_end(entry_key)
+                self.hits += 1
+                s.set(cached=True)
+                return chart
+            self.misses += 1
+        s.set(cached=False)
+        df = load(engine)
+        if df.empty:
+            return None
+        with span("render", target=kind, fmt=fmt, points=len(df)):
+            chart = render_chart(kind, df, fmt)
+        size = _size(chart)
+        with self._lock:
+            self.renders += 1
+            if size <= self.max_bytes and entry_key not in self._entries:
+                # Entries for an older data version of the same chart can never hit again
+                for old in [k for k in self._entries if k[:2] == (kind, key) and k[3] == fmt]:
+                    self.bytes -= _size(self._entries.pop(old))
+                self._entries[entry_key] = chart
+                self.bytes += size
+                while self.bytes > self.max_bytes:
+                    self.bytes -= _size(self._entries.popitem(last=False)[1])
+        return chart
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "renders": self.renders,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+@st.cache_resource
+def get_chart_cache() -> ChartCache:
+    """Process-wide rendered chart cache"""
+    return ChartCache(
+        max_bytes=int(float(secret("CHART_CACHE_MAX_MB", "32")) * 1024 * 1024),
+        probe_interval=float(secret("CHART_CACHE_PROBE_SECONDS", "5")),
+    )
+
+def monthly_usage_chart(engine, emp_code: str, fmt: str | None = None) -> bytes | dict | None:
+    """Monthly usage chart for one employee (cached); None when there is no data"""
+    return get_chart_cache().get_or_render(
+        engine, "monthly_usage", emp_code,
+        lambda e: get_monthly_usage_by_employee(e, emp_code), fmt or _renderer(),
+    )
+
+def seat_usage_chart(engine, fmt: str | None = None) -> bytes | dict | None:
+    """Usage count per seat (cached); None when there is no data"""
+    return get_chart_cache().get_or_render(engine, "seat_usage", "", get_seat_usage_counts, fmt or _renderer())
+
+def show_monthly_usage_chart(engine, emp_code: str) -> bool:
+    """Draw the cached monthly usage chart; False when there is no data"""
+    chart = monthly_usage_chart(engine, emp_code)
+    if chart is None:
+        return False
+    _show(chart)
+    return True
@@ -0,0 +1,289 @@
+# =============================================================================
+# floor_layout.py - 座席の配置（エリアごとの座標・空間インデックス・表示範囲）
+# -----------------------------------------------------------------------------
+# 座席マップを描くための座標を、Seat の Area ごとに管理します。
+# 大きなフロアでも、表示するのは指定したエリアの1画面分（ビューポート）だけです。
+#
+# 座標の取得元（上から順に優先）：
+# 1. フロアプランのファイル（secrets / 環境変数 DATASK_FLOOR_PLAN）
+#      CSV  : Label,X,Y[,Area] のヘッダー付き
+#      JSON : [{"Label": "A-1", "X": 0, "Y": 0, "Area": "北フロア"}, ...]（または {"seats": [...]}）
+# 2. dbo.SeatPosition テーブル（SeatId, X, Y）
+# 3. どちらにもない席は、エリアごとに Label 順で格子状に自動配置
+#    （4席ごとに通路をあける、列数は席数の平方根程度）
+# 座標の単位は「席の間隔 = 1」、X は右向き・Y は下向きです。
+#
+# 主な機能：
+# - SeatLayout            : 描画に渡す座標（visual/seatmap.py が使う）
+# - compute_layout()      : ラベル順に N 列で並べた座標（エリアを使わない従来の配置）
+# - AreaLayout.query()    : 矩形内の席を格子状の空間インデックスで検索（セルの数に比例）
+# - AreaLayout.pages()    : エリアを一定の大きさのビューポートに分割（席のある範囲のみ）
+# - get_floor_layout()    : DB とフロアプランから組み立てた全エリアの配置（キャッシュ）
+# =============================================================================
+
+import hashlib
+import json
+import math
+import os
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+import streamlit as st
+from core.config import secret
+from core.dialect import seat, seat_position
+from core.metrics import db_origin, record_rows
+
+UNASSIGNED_AREA = "（エリア未設定）"
+MARGIN = 0.5        # 座席の外側の余白
+CELL_SIZE = 8.0     # 空間インデックスのセルの大きさ
+VIEW_WIDTH = 16.0   # ビューポート（1画面）の大きさ
+VIEW_HEIGHT = 12.0
+BLOCK = 4           # 自動配置で通路をあける席数
+
+
+@dataclass(frozen=True)
+class SeatLayout:
+    """描画する席の座標（labels[i] の席は (x[i], y[i])）と表示範囲"""
+    key: str
+    labels: tuple[str, ...]
+    x: np.ndarray
+    y: np.ndarray
+    extent: tuple[float, float, float, float]  # (左, 右, 下, 上)。Y は下向きなので 下 > 上
+    seat_types: tuple = ()
+    index: dict = field(default_factory=dict)
+
+    def positions(self, labels) -> np.ndarray:
+        """ラベル（配置にないものは無視）の位置番号"""
+        return np.fromiter((self.index[l] for l in labels if l in self.index), dtype=np.intp)
+
+
+def make_layout(key: str, labels, x, y, extent=None, seat_types=()) -> SeatLayout:
+    labels = tuple(labels)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if extent is None:
+        if len(labels):
+            extent = (x.min() - MARGIN, x.max() + MARGIN, y.max() + MARGIN, y.min() - MARGIN)
+        else:
+            extent = (-MARGIN, MARGIN, MARGIN, -MARGIN)
+    return SeatLayout(
+        key=key, labels=labels, x=x, y=y, extent=tuple(float(v) for v in extent),
+        seat_types=tuple(seat_types), index={label: i for i, label in enumerate(labels)},
+    )
+
+
+def _digest(labels) -> str:
+    return hashlib.sha1("\n".join(labels).encode("utf-8")).hexdigest()[:16]
+
+
+@st.cache_resource(max_entries=16)
+def compute_layout(labels: tuple[str, ...], columns: int = 4) -> SeatLayout:
+    """ラベル順に columns 列で並べた座標"""
+    i = np.arange(len(labels))
+    rows = max(1, -(-len(labels) // columns))
+    return make_layout(
+        f"grid:{columns}:{_digest(labels)}", labels, i % columns, i // columns,
+        extent=(-MARGIN, columns - MARGIN, rows - MARGIN, -MARGIN),
+    )
+
+
+def grid_positions(n: int, columns: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """n 席を格子状に並べた座標（BLOCK 席ごとに通路の分だけ X をずらす）"""
+    columns = columns or max(BLOCK, math.ceil(math.sqrt(n) / BLOCK) * BLOCK)
+    i = np.arange(n)
+    col = i % columns
+    return col + (col // BLOCK) * 0.5, (i // columns).astype(float)
+
+
+class AreaLayout:
+    """1エリアの座標と、矩形検索のための格子状の空間インデックス"""
+
+    def __init__(self, name: str, labels, x, y, seat_types=(), version: str = ""):
+        self.name = name
+        self.version = version
+        self.labels = np.asarray(labels, dtype=object)
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.seat_types = np.asarray(seat_types if len(seat_types) else [None] * len(self.labels), dtype=object)
+        if len(self.labels):
+            self.bounds = (self.x.min(), self.x.max(), self.y.min(), self.y.max())
+        else:
+            self.bounds = (0.0, 0.0, 0.0, 0.0)
+
+        # セル (cx, cy) → そのセルにある席の番号
+        cx = np.floor(self.x / CELL_SIZE).astype(np.int64)
+        cy = np.floor(self.y / CELL_SIZE).astype(np.int64)
+        order = np.lexsort((cy, cx))
+        keys = np.column_stack([cx[order], cy[order]])
+        self.cells: dict[tuple[int, int], np.ndarray] = {}
+        self._pages: dict[tuple[float, float], list] = {}
+        if len(order):
+            starts = np.flatnonzero(np.r_[True, np.any(keys[1:] != keys[:-1], axis=1)])
+            for start, end in zip(starts, np.r_[starts[1:], len(order)]):
+                self.cells[(int(keys[start, 0]), int(keys[start, 1]))] = order[start:end]
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def query(self, x0: float, x1: float, y0: float, y1: float) -> np.ndarray:
+        """矩形 [x0, x1] × [y0, y1] にある席の番号（昇順）"""
+        hits = [
+            self.cells[key]
+            for cx in range(math.floor(x0 / CELL_SIZE), math.floor(x1 / CELL_SIZE) + 1)
+            for cy in range(math.floor(y0 / CELL_SIZE), math.floor(y1 / CELL_SIZE) + 1)
+            if (key := (cx, cy)) in self.cells
+        ]
+        if not hits:
+            return np.empty(0, dtype=np.intp)
+        idx = np.concatenate(hits)
+        inside = (self.x[idx] >= x0) & (self.x[idx] <= x1) & (self.y[idx] >= y0) & (self.y[idx] <= y1)
+        return np.sort(idx[inside])
+
+    def in_view(self, view: tuple[float, float, float, float]) -> np.ndarray:
+        """ビューポート内の席の番号（右端・下端は含まない：隣のビューポートと重複させない）"""
+        x0, x1, y0, y1 = view
+        return self.query(x0, np.nextafter(x1, x0), y0, np.nextafter(y1, y0))
+
+    def pages(self, width: float = VIEW_WIDTH, height: float = VIEW_HEIGHT) -> list[tuple[float, float, float, float]]:
+        """エリアを width × height のビューポートに分割（席のない範囲は除く、左上から順）"""
+        if (width, height) in self._pages:
+            return self._pages[(width, height)]
+        xmin, xmax, ymin, ymax = self.bounds
+        pages = []
+        for row in range(max(1, math.ceil((ymax - ymin + 1) / height))):
+            for col in range(max(1, math.ceil((xmax - xmin + 1) / width))):
+                x0 = xmin - MARGIN + col * width
+                y0 = ymin - MARGIN + row * height
+                view = (x0, x0 + width, y0, y0 + height)
+                if len(self.in_view(view)):
+                    pages.append(view)
+        pages = pages or [(xmin - MARGIN, xmin - MARGIN + width, ymin - MARGIN, ymin - MARGIN + height)]
+        self._pages[(width, height)] = pages
+        return pages
+
+    def seat_layout(self, view: tuple[float, float, float, float] | None = None) -> SeatLayout:
+        """ビューポート内の席だけの SeatLayout（view を省略するとエリア全体）"""
+        if view is None:
+            idx = np.arange(len(self.labels))
+            extent = None
+        else:
+            x0, x1, y0, y1 = view
+            idx = self.in_view(view)
+            extent = (x0, x1, y1, y0)
+        key = f"area:{self.version}:{self.name}:{view}"
+        return make_layout(key, self.labels[idx], self.x[idx], self.y[idx], extent, self.seat_types[idx])
+
+
+class FloorLayout:
+    """全エリアの配置"""
+
+    def __init__(self, areas: dict[str, AreaLayout], source: str, version: str):
+        self.areas = areas
+        self.source = source
+        self.version = version
+        self.area_of = {label: name for name, a in areas.items() for label in a.labels}
+
+    def area_names(self) -> list[str]:
+        return list(self.areas)
+
+    def find_area(self, text: str) -> str | None:
+        """文中に含まれるエリア名（長い名前を優先）"""
+        for name in sorted(self.areas, key=len, reverse=True):
+            if name and name != UNASSIGNED_AREA and name in text:
+                return name
+        return None
+
+    def page_of(self, area: str, label: str) -> int | None:
+        """席を含むビューポートの番号"""
+        a = self.areas[area]
+        hit = np.flatnonzero(a.labels == label)
+        if not len(hit):
+            return None
+        for i, view in enumerate(a.pages()):
+            if hit[0] in a.in_view(view):
+                return i
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "source": self.source,
+            "areas": len(self.areas),
+            "seats": sum(len(a) for a in self.areas.values()),
+            "pages": {name: len(a.pages()) for name, a in self.areas.items()},
+        }
+
+
+def read_floor_plan(path: str) -> pd.DataFrame:
+    """フロアプランのファイル（CSV / JSON）を Label, X, Y[, Area] の DataFrame で読む"""
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        df = pd.DataFrame(data["seats"] if isinstance(data, dict) else data)
+    else:
+        df = pd.read_csv(path)
+    missing = {"Label", "X", "Y"} - set(df.columns)
+    if missing:
+        raise ValueError(f"フロアプランに必要な列がありません: {', '.join(sorted(missing))}（{path}）")
+    return df
+
+
+def build_floor_layout(seats: pd.DataFrame, positions: pd.DataFrame | None = None,
+                       source: str = "grid") -> FloorLayout:
+    """
+    Seat（SeatId, Label, Area, SeatType）と座標（Label, X, Y[, Area]）からエリアごとの配置を作る。
+    座標のない席は、そのエリアの既存の席の下に格子状に並べる。
+    """
+    seats = seats.copy()
+    seats["Area"] = seats["Area"].fillna(UNASSIGNED_AREA).replace("", UNASSIGNED_AREA)
+    if positions is not None and len(positions):
+        pos = positions.drop_duplicates("Label", keep="last").set_index("Label")
+        seats["X"] = seats["Label"].map(pos["X"])
+        seats["Y"] = seats["Label"].map(pos["Y"])
+        if "Area" in pos.columns:
+            seats["Area"] = seats["Label"].map(pos["Area"]).fillna(seats["Area"])
+    else:
+        seats["X"] = np.nan
+        seats["Y"] = np.nan
+
+    areas = {}
+    for name, group in seats.sort_values(["Area", "Label"]).groupby("Area", sort=True):
+        x = group["X"].to_numpy(dtype=float, copy=True)
+        y = group["Y"].to_numpy(dtype=float, copy=True)
+        missing = np.isnan(x) | np.isnan(y)
+        if missing.any():
+            gx, gy = grid_positions(int(missing.sum()))
+            below = np.nanmax(y[~missing]) + 2 if (~missing).any() else 0.0
+            x[missing], y[missing] = gx, gy + below
+        version = _digest(f"{l}:{a}:{b}" for l, a, b in zip(group["Label"], x, y))
+        areas[name] = AreaLayout(name, group["Label"].tolist(), x, y, group["SeatType"].tolist(), version)
+    version = _digest(a.version for a in areas.values())
+    return FloorLayout(areas, source, version)
+
+
+@db_origin("seatmap")
+def load_floor_layout(engine, plan_path: str | None = None) -> FloorLayout:
+    """Seat と座標（フロアプラン → SeatPosition の順）を読み込んで配置を作る"""
+    with engine.connect() as conn:
+        seats = pd.read_sql(sa.select(seat.c.SeatId, seat.c.Label, seat.c.Area, seat.c.SeatType), conn)
+        positions, source = None, "grid"
+        if plan_path:
+            positions, source = read_floor_plan(plan_path), os.path.basename(plan_path)
+        elif sa.inspect(conn).has_table(seat_position.name):
+            positions = pd.read_sql(
+                sa.select(seat.c.Label, seat_position.c.X, seat_position.c.Y)
+                .select_from(seat_position.join(seat, seat.c.SeatId == seat_position.c.SeatId)),
+                conn,
+            )
+            source = seat_position.name if len(positions) else "grid"
+    record_rows(len(seats) + (len(positions) if positions is not None else 0))
+    return build_floor_layout(seats, positions, source)
+
+
+@st.cache_resource(ttl=600)
+def get_floor_layout() -> FloorLayout:
+    """全セッションで共有する配置（10分ごとに読み直す）"""
+    from core.db import get_engine  # core.db は初回利用時まで読み込まない
+
+    return load_floor_layout(get_engine(), secret("DATASK_FLOOR_PLAN"))
@@ -9,106 +9,287 @@
 # - get_seat_labels()：全席のラベルを昇順取得
 # - get_used_labels()：使用中の席ラベルを取得（従来版）
 # - get_used_label_name_dict()：使用中の席ラベル→社員名マッピング
+# - show_seatmap()：座席マップを表示（描画方式は DATASK_SEATMAP_RENDERER で選択）
+# - show_area_seatmap()：エリアの1画面分（ビューポート）だけを表示（visual/floor_layout.py）
 # - draw_auto_seat_map()：ラベルのみのマップ描画
 # - draw_auto_seat_map_with_names()：名前付きのマップ描画
+#
+# 描画の仕組み：
+# - 座席の座標は NumPy 配列で一度だけ計算（visual/floor_layout.py、配置ごとにキャッシュ）
+# - 全席を空席として描いた「床の画像」を配置（エリア・ビューポート）ごとにキャッシュし、
+#   リクエストごとには使用中の席だけを EllipseCollection で重ねて描く
+# - 使用中の判定は dict / set で行う
+#
+# 描画方式（secrets / 環境変数 DATASK_SEATMAP_RENDERER）：
+#   matplotlib : PNG 画像（既定）
+#   svg        : SVG をブラウザで描画（matplotlib 不要）
+#   vega       : Vega-Lite（st.vega_lite_chart、ブラウザで描画・拡大縮小可）
+#
+# matplotlib とフォントは初回の描画時に読み込みます（import 時には読み込まない）。
+# 描画にかかった時間は core/tracing.py の render スパンとして記録します。
 # =============================================================================
 
-import matplotlib.pyplot as plt
+import html
+import io
+import os
+
+import numpy as np
 import pandas as pd
 import sqlalchemy as sa
 import streamlit as st
-from matplotlib.font_manager import FontProperties
-import os
+from core.config import secret
+from core.dialect import db_now, employee, seat, seatlog
+from core.metrics import db_origin, record_rows
+from core.tracing import span
+from visual.floor_layout import SeatLayout, compute_layout, get_floor_layout
 
 # フォントファイルへの絶対パスを取得
 font_path = os.path.join(os.path.dirname(__file__), "..", "fonts", "ipaexg.ttf")
 font_path = os.path.abspath(font_path)
 
-if os.path.exists(font_path):
-    jp_font = FontProperties(fname=font_path)
-else:
-    jp_font = None
+@st.cache_resource
+def get_jp_font():
+    """同梱フォントの FontProperties（プロセスで1回だけ読み込む、なければ None）"""
+    if not os.path.exists(font_path):
+        return None
+    from matplotlib.font_manager import FontProperties
+    return FontProperties(fname=font_path)
 
+@db_origin("seatmap")
 def get_seat_labels(engine) -> list[str]:
     """すべての Seat.Label を昇順に取得"""
-    sql = "SELECT Label FROM Seat ORDER BY Label"
-    df = pd.read_sql(sa.text(sql), engine)
+    query = sa.select(seat.c.Label).order_by(seat.c.Label)
+    df = pd.read_sql(query, engine)
+    record_rows(len(df))
     return df["Label"].tolist()
 
+@db_origin("seatmap")
 def get_used_labels(engine) -> list[str]:
     """現在使用中（CheckOut が NULL）の Seat.Label を取得"""
-    sql = """
-    SELECT S.Label
-    FROM SeatLog L
-    JOIN Seat S ON S.SeatId = L.SeatId
-    WHERE L.CheckIn <= GETDATE() AND L.CheckOut IS NULL
-    """
-    df = pd.read_sql(sa.text(sql), engine)
+    query = (
+        sa.select(seat.c.Label)
+        .select_from(seatlog.join(seat, seat.c.SeatId == seatlog.c.SeatId))
+        .where(seatlog.c.CheckIn <= db_now(), seatlog.c.CheckOut.is_(None))
+    )
+    df = pd.read_sql(query, engine)
+    record_rows(len(df))
     return df["Label"].tolist()
 
+@db_origin("seatmap")
 def get_used_label_name_dict(engine) -> dict[str, str]:
     """
     使用中の席に座っている社員の名前を取得（Label → Name の辞書）
     """
-    sql = """
-    SELECT S.Label, E.Name
-    FROM SeatLog L
-    JOIN Seat S ON S.SeatId = L.SeatId
-    JOIN Employee E ON E.EmpCode = L.EmpCode
-    WHERE L.CheckIn <= GETDATE() AND L.CheckOut IS NULL
-    """
-    df = pd.read_sql(sa.text(sql), engine)
+    query = (
+        sa.select(seat.c.Label, employee.c.Name)
+        .select_from(
+            seatlog.join(seat, seat.c.SeatId == seatlog.c.SeatId)
+            .join(employee, employee.c.EmpCode == seatlog.c.EmpCode)
+        )
+        .where(seatlog.c.CheckIn <= db_now(), seatlog.c.CheckOut.is_(None))
+    )
+    df = pd.read_sql(query, engine)
+    record_rows(len(df))
     return dict(zip(df["Label"], df["Name"]))
 
 def group_labels(labels: list[str], columns: int = 4) -> list[list[str]]:
     """ラベルを列数ごとに分割（2次元リスト）"""
     return [labels[i:i + columns] for i in range(0, len(labels), columns)]
 
+# -------------------------------
+# 描画の設定
+# -------------------------------
+SEAT_RADIUS = 0.3
+FREE_COLOR = "lightblue"
+USED_COLOR = "lightpink"
+FONT_SIZE = 9
+DPI = 100
+MAX_IMAGE_PX = 16000  # 画像の長辺の上限（席数が多いときは解像度を下げる）
+
+def _occupancy(used) -> dict[str, str | None]:
+    """使用中の席（ラベルのリスト/集合、または Label → 社員名）を dict にそろえる"""
+    return dict(used) if isinstance(used, dict) else dict.fromkeys(used)
+
+def _size(layout: SeatLayout) -> tuple[float, float]:
+    left, right, bottom, top = layout.extent
+    return right - left, bottom - top
+
+# -------------------------------
+# matplotlib（床の画像をキャッシュして使用中の席だけ重ねる）
+# -------------------------------
+def _new_figure(layout: SeatLayout):
+    """データ座標 1 = 1 インチの Figure（pyplot を使わないのでスレッドセーフ）"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    left, right, bottom, top = layout.extent
+    width, height = _size(layout)
+    dpi = min(DPI, MAX_IMAGE_PX / max(width, height))
+    fig = Figure(figsize=(width, height), dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_axes((0, 0, 1, 1))
+    ax.set_xlim(left, right)
+    ax.set_ylim(bottom, top)  # Y は下向き
+    ax.axis("off")
+    return fig, ax
+
+def _draw_seats(ax, x: np.ndarray, y: np.ndarray, color: str, texts: list[str]):
+    """円はまとめて1つのコレクション、文字は席ごと"""
+    from matplotlib.collections import EllipseCollection
+
+    diameter = np.full(len(x), SEAT_RADIUS * 2)
+    ax.add_collection(EllipseCollection(
+        diameter, diameter, np.zeros(len(x)), units="xy",
+        offsets=np.column_stack([x, y]), offset_transform=ax.transData, facecolors=color,
+    ))
+    font = get_jp_font()
+    for xi, yi, text in zip(x.tolist(), y.tolist(), texts):
+        ax.text(xi, yi, text, ha="center", va="center", fontsize=FONT_SIZE, color="black",
+                fontproperties=font, clip_on=True)
+
+def _rgba(fig) -> np.ndarray:
+    fig.canvas.draw()
+    return np.asarray(fig.canvas.buffer_rgba())
+
+@st.cache_resource(max_entries=64)
+def render_base_image(key: str, _layout: SeatLayout) -> np.ndarray:
+    """全席を空席として描いた床の画像（RGB）。配置（key）が変わるまで再利用する"""
+    fig, ax = _new_figure(_layout)
+    _draw_seats(ax, _layout.x, _layout.y, FREE_COLOR, list(_layout.labels))
+    return _rgba(fig)[..., :3].copy()
+
+def render_seatmap_image(layout: SeatLayout, used) -> np.ndarray:
+    """
+    座席マップの画像（RGB の配列）。used は使用中の席ラベルの集合、または Label → 社員名。
+    社員名があれば使用中の席に名前を、なければ席番号を表示する。
+    床の画像に、透明な背景に描いた使用中の席だけを合成する。
+    """
+    occupied = _occupancy(used)
+    image = render_base_image(layout.key, layout).copy()
+    pos = layout.positions(occupied)
+    if len(pos) == 0:
+        return image
+    fig, ax = _new_figure(layout)
+    fig.patch.set_alpha(0)
+    texts = [occupied[layout.labels[p]] or layout.labels[p] for p in pos.tolist()]
+    _draw_seats(ax, layout.x[pos], layout.y[pos], USED_COLOR, texts)
+    overlay = _rgba(fig)
+    mask = overlay[..., 3] > 0
+    alpha = overlay[..., 3][mask, None].astype(np.uint16)
+    image[mask] = ((overlay[..., :3][mask] * alpha + image[mask] * (255 - alpha)) // 255).astype(np.uint8)
+    return image
+
+def render_seatmap_png(layout: SeatLayout, used) -> bytes:
+    """座席マップの PNG（圧縮より速度を優先）"""
+    from PIL import Image
+
+    buf = io.BytesIO()
+    Image.fromarray(render_seatmap_image(layout, used)).save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+# -------------------------------
+# SVG / Vega-Lite（ブラウザで描画、matplotlib 不要）
+# -------------------------------
+SVG_SCALE = 48  # データ座標 1 あたりのピクセル
+SVG_FONT = "IPAexGothic, 'Noto Sans CJK JP', 'Hiragino Sans', 'Yu Gothic', sans-serif"
+
+def render_seatmap_svg(layout: SeatLayout, used) -> str:
+    """座席マップの SVG 文字列"""
+    occupied = _occupancy(used)
+    left, right, bottom, top = layout.extent
+    width, height = _size(layout)
+    cx = ((layout.x - left) * SVG_SCALE).round(1).tolist()
+    cy = ((layout.y - top) * SVG_SCALE).round(1).tolist()
+    r = SEAT_RADIUS * SVG_SCALE
+    types = layout.seat_types or (None,) * len(layout.labels)
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width * SVG_SCALE:.0f}" '
+        f'height="{height * SVG_SCALE:.0f}" font-family="{SVG_FONT}" font-size="{FONT_SIZE}pt" '
+        f'text-anchor="middle" dominant-baseline="central">'
+    ]
+    for label, seat_type, x, y in zip(layout.labels, types, cx, cy):
+        is_used = label in occupied
+        text = html.escape((occupied[label] or label) if is_used else label)
+        title = html.escape(f"{label}（{seat_type}）" if seat_type else label)
+        parts.append(
+            f'<g><title>{title}</title>'
+            f'<circle cx="{x}" cy="{y}" r="{r}" fill="{USED_COLOR if is_used else FREE_COLOR}"/>'
+            f'<text x="{x}" y="{y}">{text}</text></g>'
+        )
+    parts.append("</svg>")
+    return "".join(parts)
+
+def seatmap_vega_spec(layout: SeatLayout, used) -> dict:
+    """座席マップの Vega-Lite 仕様（st.vega_lite_chart に渡す）"""
+    occupied = _occupancy(used)
+    types = layout.seat_types or (None,) * len(layout.labels)
+    values = [
+        {"x": x, "y": y, "label": label, "type": seat_type, "used": label in occupied,
+         "text": (occupied[label] or label) if label in occupied else label}
+        for label, seat_type, x, y in zip(layout.labels, types, layout.x.tolist(), layout.y.tolist())
+    ]
+    left, right, bottom, top = layout.extent
+    width, height = _size(layout)
+    axis = {"axis": None}
+    return {
+        "$schema": "https://vega.github.io/schema/vega-lite/v5.json",
+        "data": {"values": values},
+        "width": width * SVG_SCALE,
+        "height": height * SVG_SCALE,
+        "encoding": {
+            "x": {"field": "x", "type": "quantitative", "scale": {"domain": [left, right]}, **axis},
+            "y": {"field": "y", "type": "quantitative", "scale": {"domain": [top, bottom], "reverse": True}, **axis},
+        },
+        "layer": [
+            {
+                "mark": {"type": "circle", "size": (SEAT_RADIUS * 2 * SVG_SCALE) ** 2 * 0.78, "opacity": 1},
+                "encoding": {
+                    "color": {"field": "used", "type": "nominal", "legend": None,
+                              "scale": {"domain": [False, True], "range": [FREE_COLOR, USED_COLOR]}},
+                    "tooltip": [{"field": "label", "title": "席"}, {"field": "type", "title": "種別"},
+                                {"field": "text", "title": "表示"}],
+                },
+            },
+            {"mark": {"type": "text", "fontSize": FONT_SIZE * 4 / 3}, "encoding": {"text": {"field": "text"}}},
+        ],
+        "config": {"view": {"stroke": None}},
+    }
+
+# -------------------------------
+# 表示
+# -------------------------------
+RENDERERS = ("matplotlib", "svg", "vega")
+
+def show_seatmap(layout: SeatLayout, used, renderer: str | None = None):
+    """
+    座席マップを表示する。used は使用中の席ラベル（リスト・集合）または Label → 社員名。
+    renderer を省略すると DATASK_SEATMAP_RENDERER（既定 matplotlib）に従う。
+    """
+    renderer = (renderer or secret("DATASK_SEATMAP_RENDERER", "matplotlib")).lower()
+    with span("render", target="seatmap", renderer=renderer, seats=len(layout.labels)):
+        if renderer == "svg":
+            st.markdown(f'<div style="overflow:auto">{render_seatmap_svg(layout, used)}</div>', unsafe_allow_html=True)
+        elif renderer == "vega":
+            st.vega_lite_chart(seatmap_vega_spec(layout, used))
+        elif renderer == "matplotlib":
+            st.image(render_seatmap_png(layout, used))
+        else:
+            raise ValueError(f"未対応の描画方式です: {renderer}（{' / '.join(RENDERERS)}）")
+
+def show_area_seatmap(area: str, used, page: int = 0, renderer: str | None = None):
+    """エリアの page 番目のビューポートだけを表示する（visual/floor_layout.py の配置）"""
+    area_layout = get_floor_layout().areas[area]
+    pages = area_layout.pages()
+    show_seatmap(area_layout.seat_layout(pages[min(page, len(pages) - 1)]), used, renderer)
+
 def draw_auto_seat_map(labels: list[str], used: list[str], columns: int = 4):
     """
     使用中かどうかに応じて色分けして座席マップを描画（ラベル表示）
     """
-    layout = group_labels(labels, columns)
-    fig, ax = plt.subplots(figsize=(columns + 1, len(layout)))
-
-    for y, row in enumerate(layout):
-        for x, label in enumerate(row):
-            color = "lightpink" if label in used else "lightblue"
-            circle = plt.Circle((x, -y), 0.3, color=color)
-            ax.add_patch(circle)
-            display_text = label
-            if jp_font:
-                ax.text(x, -y, display_text, ha="center", va="center", fontsize=9, color="black", fontproperties=jp_font)
-            else:
-                ax.text(x, -y, display_text, ha="center", va="center", fontsize=9, color="black")
-
-    ax.set_xlim(-0.5, columns)
-    ax.set_ylim(-len(layout), 0.5)
-    ax.set_aspect("equal")
-    ax.axis("off")
-    st.pyplot(fig)
+    show_seatmap(compute_layout(tuple(labels), columns), set(used))
 
 def draw_auto_seat_map_with_names(labels: list[str], used_label_to_name: dict[str, str], columns: int = 4):
     """
     使用中：社員名、空席：席番号を表示した座席マップを描画
     """
-    layout = group_labels(labels, columns)
-    fig, ax = plt.subplots(figsize=(columns + 1, len(layout)))
-
-    for y, row in enumerate(layout):
-        for x, label in enumerate(row):
-            is_used = label in used_label_to_name
-            color = "lightpink" if is_used else "lightblue"
-            text = used_label_to_name[label] if is_used else label
-            circle = plt.Circle((x, -y), 0.3, color=color)
-            ax.add_patch(circle)
-            if jp_font:
-                ax.text(x, -y, text, ha="center", va="center", fontsize=9, color="black", fontproperties=jp_font)
-            else:
-                ax.text(x, -y, text, ha="center", va="center", fontsize=9, color="black")
-
-    ax.set_xlim(-0.5, columns)
-    ax.set_ylim(-len(layout), 0.5)
-    ax.set_aspect("equal")
-    ax.axis("off")
-    st.pyplot(fig)
+    show_seatmap(compute_layout(tuple(labels), columns), used_label_to_name)